@@ -1,5 +1,21 @@
 import streamlit as st
-from main import process_chat
+from utils import config
+
+if config.CHAT_SERVER_URL:
+    # Thin client: the model and the conversation live in server.py
+    from utils.chat_client import ChatClient
+else:
+    from main import process_chat_stream
+    from utils.history import ConversationMemory
+    from utils.metrics import start_metrics_server
+
+    @st.cache_resource
+    def metrics_server(port):
+        # Once per process, not on every Streamlit rerun
+        return start_metrics_server(port)
+
+    if config.METRICS_PORT:
+        metrics_server(config.METRICS_PORT)
 
 st.set_page_config(page_title="FoodieSpot Assistant", layout="wide")
 
@@ -7,6 +23,12 @@ st.title("🍽️ FoodieSpot - Your Restaurant Assistant")
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if config.CHAT_SERVER_URL and "chat_client" not in st.session_state:
+    # One server session per browser session, renewed if the server expires it
+    st.session_state.chat_client = ChatClient(config.CHAT_SERVER_URL)
+if not config.CHAT_SERVER_URL and "memory" not in st.session_state:
+    # What the model sees of the conversation, kept under HISTORY_TOKEN_BUDGET
+    st.session_state.memory = ConversationMemory()
 
 # Display chat history
 for message in st.session_state.messages:
@@ -20,12 +42,16 @@ if user_message:
     with st.chat_message("user"):
         st.markdown(user_message)
 
-    response = process_chat(user_message, st.session_state.messages)
+    # Tokens are rendered as they are decoded
+    with st.chat_message("assistant"):
+        if config.CHAT_SERVER_URL:
+            chunks = st.session_state.chat_client.stream(user_message)
+        else:
+            chunks = process_chat_stream(user_message, st.session_state.memory)
+        response = st.write_stream(chunks)
     # formatted response to string
     assistant_response = response if isinstance(response, str) else str(response)
 
     st.session_state.messages.append(
         {"role": "assistant", "content": assistant_response}
     )
-    with st.chat_message("assistant"):
-        st.markdown(assistant_response)
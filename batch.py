@@ -0,0 +1,227 @@
+"""Runs a JSONL file of conversations through the assistant offline.
+
+    python batch.py conversations.jsonl results.jsonl
+    python batch.py queries.jsonl warmup.jsonl --tools-only    # fill the generation cache
+
+Each input line is {"id": ..., "message": "..."} or {"id": ..., "messages": [...]},
+the messages being user messages as strings or {"role": "user", "content": ...}
+(other roles are skipped); "id", a string or an integer, defaults to the line
+number. Up to --concurrency records run at once, so their intent, extraction
+and response prompts share model batches. Each record is appended to the
+output as soon as it finishes, with every turn's response, tool result and
+timings. The output is also the checkpoint: rerunning the same command skips
+the records it already holds, and retries failed ones (appending their new
+result after the failed one). Bookings are made in a temporary copy of the
+knowledge base unless --write-bookings is given.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import BaseModel
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+# The assistant's modules are imported once main() has set KNOWLEDGE_BASE_DIR,
+# which utils.config reads at import time; utils.logging_utils configures this logger
+logger = logging.getLogger("RestaurantAssistant")
+
+
+def read_records(path):
+    """Yields (record_id, user_messages) for each input line."""
+    with open(path, "r") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if "messages" in record:
+                    messages = [
+                        message if isinstance(message, str) else message["content"]
+                        for message in record["messages"]
+                        if isinstance(message, str) or message.get("role", "user") == "user"
+                    ]
+                else:
+                    messages = [record["message"]]
+                record_id = record.get("id", line_number)
+                # Matched against the ids read back from the output's JSON
+                if isinstance(record_id, bool) or not isinstance(record_id, (str, int)):
+                    raise TypeError(f"id must be a string or an integer, not {record_id!r}")
+                if not all(isinstance(message, str) for message in messages):
+                    raise TypeError("messages must be strings")
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                logger.error("Skipping line %s of %s: %s", line_number, path, e)
+                continue
+            yield record_id, messages
+
+
+def completed_ids(path):
+    """IDs of the records already in the output, except failed ones (which are
+    retried); a last line cut short by a crash is removed."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        size = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                result = json.loads(line)
+                if "error" not in result:
+                    done.add(result["id"])
+            except (ValueError, KeyError, TypeError):
+                break
+            size += len(line)
+        f.truncate(size)
+    return done
+
+
+def to_jsonable(tool_result):
+    if isinstance(tool_result, BaseModel):
+        return tool_result.model_dump(mode="json")
+    return tool_result
+
+
+async def run_turn(message, memory, tools_only=False):
+    from main import agenerate_final_response, arun_tool, remember_turn
+    from utils import tracing
+
+    start = time.perf_counter()
+    response = None
+    with tracing.span("turn") as turn:
+        tool_result = await arun_tool(message)
+        if not tools_only:
+            response = await agenerate_final_response(message, memory, tool_result)
+    result = {"message": message}
+    if not tools_only:
+        remember_turn(memory, message, response, tool_result)
+        result["response"] = response
+    result["tool_result"] = to_jsonable(tool_result)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    if turn is not None:
+        stages = defaultdict(float)
+        for child in turn.children:
+            stages[child.name] += child.duration * 1000
+        result["intent"] = turn.attributes.get("intent")
+        result["stages_ms"] = {stage: round(ms, 3) for stage, ms in stages.items()}
+        result.update(turn.totals())
+    return result
+
+
+async def run_record(record_id, messages, tools_only=False):
+    from utils.history import ConversationMemory
+
+    start = time.perf_counter()
+    result = {"id": record_id, "turns": []}
+    memory = ConversationMemory()
+    try:
+        for message in messages:
+            result["turns"].append(await run_turn(message, memory, tools_only))
+    except Exception as e:
+        logger.exception("Record %s failed", record_id)
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+async def run_batch(input_path, output_path, concurrency=None, tool_threads=None, tools_only=False):
+    """Runs the records of input_path missing from output_path; returns counts of
+    "completed", "failed" and "skipped" (already done) records."""
+    from utils import config
+
+    concurrency = concurrency or config.OFFLINE_CONCURRENCY
+    # Tool lookups run through asyncio.to_thread on the loop's default executor
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(tool_threads or config.OFFLINE_TOOL_THREADS, thread_name_prefix="batch-tool")
+    )
+    done = completed_ids(output_path)
+    counts = Counter(completed=0, failed=0, skipped=0)
+    in_flight = set()
+
+    with open(output_path, "a") as out:
+
+        def write(finished):
+            for task in finished:
+                result = task.result()
+                out.write(json.dumps(result, default=str) + "\n")
+                counts["failed" if "error" in result else "completed"] += 1
+            out.flush()
+
+        for record_id, messages in read_records(input_path):
+            if record_id in done:
+                counts["skipped"] += 1
+                continue
+            done.add(record_id)
+            if len(in_flight) >= concurrency:
+                finished, in_flight = await asyncio.wait(
+                    in_flight, return_when=asyncio.FIRST_COMPLETED
+                )
+                write(finished)
+            in_flight.add(asyncio.create_task(run_record(record_id, messages, tools_only)))
+        if in_flight:
+            write((await asyncio.wait(in_flight))[0])
+    return counts
+
+
+def prepare_knowledge_base():
+    """Points KNOWLEDGE_BASE_DIR at a temporary copy of it, so bookings made by
+    the input leave the real one untouched; returns the directory to remove."""
+    source = os.environ.get("KNOWLEDGE_BASE_DIR", os.path.join(PACKAGE_DIR, "knowledge_base"))
+    workdir = tempfile.mkdtemp(prefix="batch-kb-")
+    knowledge_base_dir = os.path.join(workdir, "knowledge_base")
+    shutil.copytree(source, knowledge_base_dir)
+    os.environ["KNOWLEDGE_BASE_DIR"] = knowledge_base_dir
+    return workdir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run JSONL conversations through the FoodieSpot assistant")
+    parser.add_argument("input")
+    parser.add_argument("output", help="results JSONL; appended to, skipping the records already in it")
+    parser.add_argument("--concurrency", type=int, help="OFFLINE_CONCURRENCY by default")
+    parser.add_argument("--tool-threads", type=int, help="OFFLINE_TOOL_THREADS by default")
+    parser.add_argument(
+        "--tools-only",
+        action="store_true",
+        help="stop after the tool lookup, skipping the (sampled, never cached) final response",
+    )
+    parser.add_argument(
+        "--write-bookings",
+        action="store_true",
+        help="make the input's bookings in KNOWLEDGE_BASE_DIR rather than in a temporary copy",
+    )
+    parser.add_argument("--verbose", action="store_true", help="keep the assistant's INFO logs")
+    args = parser.parse_args()
+    workdir = None if args.write_bookings else prepare_knowledge_base()
+    if not args.verbose:
+        logger.setLevel(logging.WARNING)
+    from utils.model import get_scheduler
+
+    start = time.perf_counter()
+    try:
+        counts = asyncio.run(
+            run_batch(args.input, args.output, args.concurrency, args.tool_threads, args.tools_only)
+        )
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    seconds = time.perf_counter() - start
+    scheduler = get_scheduler()
+    batching = ""
+    if scheduler.batches_run:
+        batching = f", {scheduler.prompts_run / scheduler.batches_run:.1f} prompts per model batch"
+    print(
+        f"{counts['completed']} records ({counts['failed']} failed, {counts['skipped']} already done) "
+        f"in {seconds:.1f}s, {(counts['completed'] + counts['failed']) / seconds:.1f} records/s"
+        f"{batching}. Results in {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
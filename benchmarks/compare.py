@@ -0,0 +1,77 @@
+"""Diffs two benchmarks/run.py reports.
+
+    python -m benchmarks.compare benchmarks/results/base.json benchmarks/results/new.json
+
+Exits with status 1 when a stage's p95 grew by more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+PERCENTILES = ("p50", "p95", "p99")
+
+
+def change(old, new):
+    if old in (None, 0) or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def format_change(old, new):
+    delta = change(old, new)
+    return f"{old:>9.2f} -> {new:>9.2f} ({delta:+6.1f}%)" if delta is not None else "n/a"
+
+
+def compare(base, new, threshold):
+    regressions = []
+    print(f"{base['backend']} @ {base['revision']}  vs  {new['backend']} @ {new['revision']}")
+    for stage, summary in new["stages_ms"].items():
+        old = base["stages_ms"].get(stage, {})
+        if not summary.get("count") or not old.get("count"):
+            continue
+        print(f"{stage}")
+        for key in PERCENTILES:
+            print(f"  {key:<4} {format_change(old[key], summary[key])}")
+        delta = change(old["p95"], summary["p95"])
+        if delta is not None and delta > threshold:
+            regressions.append(f"{stage} p95 {delta:+.1f}%")
+
+    print(
+        "turns/s       "
+        + format_change(
+            base["throughput"]["turns_per_second"], new["throughput"]["turns_per_second"]
+        )
+    )
+    print("peak RSS MB   " + format_change(base["peak_rss_mb"], new["peak_rss_mb"]))
+    for direction in ("in", "out"):
+        print(
+            f"tokens {direction:<4}   "
+            + format_change(
+                base["tokens_per_turn"][direction]["mean"],
+                new["tokens_per_turn"][direction]["mean"],
+            )
+        )
+    if base["settings"] != new["settings"]:
+        print("Note: the two runs used different settings")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed p95 growth, percent")
+    args = parser.parse_args()
+
+    with open(args.base, "r") as f:
+        base = json.load(f)
+    with open(args.new, "r") as f:
+        new = json.load(f)
+    regressions = compare(base, new, args.threshold)
+    if regressions:
+        print("Regressions: " + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
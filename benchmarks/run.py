@@ -0,0 +1,345 @@
+"""Replays benchmarks/corpus.jsonl through process_chat and reports per-stage latency.
+
+    python -m benchmarks.run                          # deterministic stub model
+    python -m benchmarks.run --backend hf             # the configured model
+    python -m benchmarks.run --sessions 32 --concurrency 8 --stub-latency-ms 20
+    python -m benchmarks.compare old.json new.json
+
+Bookings are written to a temporary copy of the knowledge base, and the
+generation cache is off unless --generation-cache is passed.
+"""
+import argparse
+import importlib
+import inspect
+import json
+import logging
+import math
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(BENCHMARK_DIR)
+CORPUS_PATH = os.path.join(BENCHMARK_DIR, "corpus.jsonl")
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+
+# STAGE -> [(MODULE[:CLASS], FUNCTION)] timed in place
+STAGES = {
+    "intent": [("main", "detect_intent"), ("main", "detect_intent_and_slots")],
+    "extraction": [
+        ("services.fetch_menu:FetchMenuService", "call_model"),
+        ("services.fetch_price:FetchPriceService", "extract_dish_query"),
+        ("services.search_restaurant:SearchRestaurantService", "extract_search_criteria"),
+        ("services.reserve_restaurant:ReserveRestaurantService", "extract_reservation_details"),
+        ("services.check_availability:CheckAvailabilityService", "extract_availability_details"),
+    ],
+    "kb_lookup": [
+        ("services.fetch_menu:FetchMenuService", "respond"),
+        ("services.fetch_price:FetchPriceService", "respond"),
+        ("services.search_restaurant:SearchRestaurantService", "respond"),
+        ("services.reserve_restaurant:ReserveRestaurantService", "respond"),
+        ("services.check_availability:CheckAvailabilityService", "respond"),
+    ],
+    "response": [("main", "generate_final_response")],
+}
+
+
+def load_corpus(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def resolve(path):
+    """"module" or "module:Class" -> the module or class."""
+    module_name, _, class_name = path.partition(":")
+    owner = importlib.import_module(module_name)
+    return getattr(owner, class_name) if class_name else owner
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted values."""
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def summarize(values, digits=3):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), digits),
+        "p50": round(percentile(values, 50), digits),
+        "p95": round(percentile(values, 95), digits),
+        "p99": round(percentile(values, 99), digits),
+        "max": round(values[-1], digits),
+    }
+
+
+class Recorder:
+    """Times the STAGES functions in place and captures each turn's model calls."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.turn = threading.local()
+        self._patched = []
+
+    def time_stage(self, owner, attribute, stage):
+        original = inspect.getattr_static(owner, attribute)
+        wrapper_type = type(original) if isinstance(original, (staticmethod, classmethod)) else None
+        func = original.__func__ if wrapper_type else original
+        samples = self.samples[stage]
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                samples.append((time.perf_counter() - start) * 1000)
+
+        setattr(owner, attribute, wrapper_type(timed) if wrapper_type else timed)
+        self._patched.append((owner, attribute, original))
+
+    def capture_model_calls(self):
+        from utils.model import ModelPipeline
+
+        original = ModelPipeline.__call__
+        turn = self.turn
+
+        @wraps(original)
+        def call(pipeline, prompt, return_full_text=True, **kwargs):
+            output = original(pipeline, prompt, return_full_text=return_full_text, **kwargs)
+            calls = getattr(turn, "calls", None)
+            if calls is not None:
+                text = output[0]["generated_text"]
+                calls.append((prompt, text[len(prompt) :] if return_full_text else text))
+            return output
+
+        ModelPipeline.__call__ = call
+        self._patched.append((ModelPipeline, "__call__", original))
+
+    def install(self):
+        for stage, targets in STAGES.items():
+            for owner, attribute in targets:
+                self.time_stage(resolve(owner), attribute, stage)
+        self.capture_model_calls()
+
+    def restore(self):
+        while self._patched:
+            owner, attribute, original = self._patched.pop()
+            setattr(owner, attribute, original)
+
+    def reset(self):
+        for samples in self.samples.values():
+            samples.clear()
+
+
+def run_session(session_index, corpus, turns, recorder):
+    from main import process_chat
+    from utils.history import ConversationMemory
+
+    memory = ConversationMemory()
+    results = []
+    for turn_index in range(turns):
+        entry = corpus[(session_index + turn_index) % len(corpus)]
+        recorder.turn.calls = []
+        start = time.perf_counter()
+        process_chat(entry["message"], memory)
+        elapsed = (time.perf_counter() - start) * 1000
+        results.append({"intent": entry["intent"], "ms": elapsed, "calls": recorder.turn.calls})
+        recorder.turn.calls = None
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=PACKAGE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare_environment(args):
+    # utils.config reads these at import time
+    if args.backend != "stub":
+        os.environ["MODEL_BACKEND"] = args.backend
+    os.environ["GENERATION_CACHE_ENABLED"] = "1" if args.generation_cache else "0"
+    source = os.environ.get("KNOWLEDGE_BASE_DIR", os.path.join(PACKAGE_DIR, "knowledge_base"))
+    workdir = tempfile.mkdtemp(prefix="benchmark-kb-")
+    knowledge_base_dir = os.path.join(workdir, "knowledge_base")
+    shutil.copytree(source, knowledge_base_dir)
+    os.environ["KNOWLEDGE_BASE_DIR"] = knowledge_base_dir
+    return workdir
+
+
+def run(args, corpus):
+    from utils import config
+    from utils.intent_classifier import INTENT_TIERS
+    from utils.model import SPECULATIVE_ACCEPTED, SPECULATIVE_DRAFTED, get_backend, set_backend
+
+    if args.backend == "stub":
+        from benchmarks.stub_backend import CorpusBackend
+
+        set_backend(CorpusBackend(corpus, latency_ms=args.stub_latency_ms))
+    backend = get_backend()
+
+    recorder = Recorder()
+    recorder.install()
+    try:
+        if args.warmup:
+            run_session(0, corpus, args.warmup, recorder)
+            recorder.reset()
+
+        drafted, accepted = SPECULATIVE_DRAFTED.value(), SPECULATIVE_ACCEPTED.value()
+        tiers = {tier: INTENT_TIERS.value(tier=tier) for tier in ("rules", "model")}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            sessions = list(
+                pool.map(
+                    lambda index: run_session(index, corpus, args.turns, recorder),
+                    range(args.sessions),
+                )
+            )
+        wall_seconds = time.perf_counter() - start
+        drafted = SPECULATIVE_DRAFTED.value() - drafted
+        accepted = SPECULATIVE_ACCEPTED.value() - accepted
+        tiers = {tier: INTENT_TIERS.value(tier=tier) - hits for tier, hits in tiers.items()}
+        classified = sum(tiers.values())
+    finally:
+        recorder.restore()
+
+    turns = [turn for session in sessions for turn in session]
+    tokens_in, tokens_out = [], []
+    for turn in turns:
+        tokens_in.append(sum(backend.count_tokens(prompt) for prompt, _ in turn["calls"]))
+        tokens_out.append(sum(backend.count_tokens(text) for _, text in turn["calls"]))
+
+    stages = {stage: summarize(samples) for stage, samples in recorder.samples.items()}
+    stages["turn"] = summarize([turn["ms"] for turn in turns])
+    return {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "backend": backend.name,
+        "settings": {
+            "sessions": args.sessions,
+            "concurrency": args.concurrency,
+            "turns_per_session": args.turns,
+            "warmup_turns": args.warmup,
+            "stub_latency_ms": args.stub_latency_ms if args.backend == "stub" else None,
+            "corpus": os.path.relpath(args.corpus, PACKAGE_DIR),
+            "batching": config.BATCHING_ENABLED,
+            "fused_extraction": config.FUSED_EXTRACTION,
+            "prefix_cache": config.PREFIX_CACHE_ENABLED,
+            "generation_cache": config.GENERATION_CACHE_ENABLED,
+            "kb_storage": config.KB_STORAGE,
+            "draft_model": config.DRAFT_MODEL_ID,
+            "speculative_lookahead": config.SPECULATIVE_LOOKAHEAD if config.DRAFT_MODEL_ID else None,
+        },
+        "stages_ms": stages,
+        "throughput": {
+            "turns": len(turns),
+            "wall_seconds": round(wall_seconds, 3),
+            "turns_per_second": round(len(turns) / wall_seconds, 3),
+        },
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "tokens_per_turn": {
+            "in": summarize(tokens_in, digits=1),
+            "out": summarize(tokens_out, digits=1),
+            "model_calls": summarize([len(turn["calls"]) for turn in turns], digits=2),
+        },
+        "intents": dict(Counter(turn["intent"] for turn in turns)),
+        "intent_tiers": {
+            tier: {"hits": hits, "rate": round(hits / classified, 3) if classified else None}
+            for tier, hits in tiers.items()
+        },
+        "speculative": {
+            "drafted_tokens": drafted,
+            "accepted_tokens": accepted,
+            "acceptance_rate": round(accepted / drafted, 3) if drafted else None,
+        },
+    }
+
+
+def print_report(report):
+    print(f"{report['backend']} @ {report['revision']}")
+    print(f"{'stage':<12}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, summary in report["stages_ms"].items():
+        if summary["count"]:
+            print(
+                f"{stage:<12}{summary['count']:>7}{summary['p50']:>10.2f}"
+                f"{summary['p95']:>10.2f}{summary['p99']:>10.2f}"
+            )
+    throughput = report["throughput"]
+    tokens = report["tokens_per_turn"]
+    print(
+        f"{throughput['turns']} turns in {throughput['wall_seconds']}s "
+        f"({throughput['turns_per_second']} turns/s), peak RSS {report['peak_rss_mb']} MB, "
+        f"tokens/turn in {tokens['in']['mean']} out {tokens['out']['mean']}"
+    )
+    tiers = report.get("intent_tiers", {})
+    if any(tier["hits"] for tier in tiers.values()):
+        print(
+            "intent tiers: "
+            + ", ".join(f"{name} {tier['hits']} ({tier['rate']:.1%})" for name, tier in tiers.items())
+        )
+    speculative = report.get("speculative", {})
+    if speculative.get("drafted_tokens"):
+        print(
+            f"speculative decoding: {speculative['accepted_tokens']} of "
+            f"{speculative['drafted_tokens']} drafted tokens accepted "
+            f"({speculative['acceptance_rate']:.1%})"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FoodieSpot stage-level latency benchmark")
+    parser.add_argument(
+        "--backend",
+        default="stub",
+        help='"stub" for the deterministic corpus backend, or a utils.model backend name',
+    )
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=None, help="per session; the corpus size by default")
+    parser.add_argument("--warmup", type=int, default=5, help="turns run before measuring")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0)
+    parser.add_argument("--generation-cache", action="store_true")
+    parser.add_argument("--output", help="JSON report path; benchmarks/results/<revision>-<backend>.json by default")
+    parser.add_argument("--verbose", action="store_true", help="keep the assistant's INFO logs")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    args.turns = args.turns or len(corpus)
+    workdir = prepare_environment(args)
+    if not args.verbose:
+        logging.getLogger("RestaurantAssistant").setLevel(logging.WARNING)
+    try:
+        report = run(args, corpus)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{report['revision'] or 'unknown'}-{report['backend']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
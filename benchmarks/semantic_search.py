@@ -0,0 +1,109 @@
+"""Times EmbeddingIndex queries over a synthetic catalogue.
+
+    python -m benchmarks.semantic_search                   # 100k restaurants
+    python -m benchmarks.semantic_search --restaurants 10000 --queries 500
+
+Restaurants are the knowledge base's own, repeated with shuffled names,
+locations and menus. The matrix is built once under --workdir and
+memory-mapped on later runs.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.run import PACKAGE_DIR, summarize
+
+QUERIES = [
+    ("I need something spicy near me", {}),
+    ("cheap vegetarian breakfast", {"food_choice": "veg", "price_range": "cheap"}),
+    ("romantic italian dinner", {"cuisine": "Italian", "price_range": "expensive"}),
+    ("outdoor place for drinks in Indiranagar", {"location": "Indiranagar", "ambience": "outdoor"}),
+    ("seafood under 500", {"price_range": "under 500", "food_choice": "non veg"}),
+    ("dosa", {}),
+]
+
+
+def synthetic_catalogue(size, seed=0):
+    knowledge_base_dir = os.environ.get(
+        "KNOWLEDGE_BASE_DIR", os.path.join(PACKAGE_DIR, "knowledge_base")
+    )
+    with open(os.path.join(knowledge_base_dir, "restaurant_db.json"), "r") as f:
+        base_restaurants = json.load(f)
+    with open(os.path.join(knowledge_base_dir, "menu.json"), "r") as f:
+        base_menus = [items["menu"] for items in json.load(f)]
+
+    rng = random.Random(seed)
+    locations = sorted({restaurant["location"] for restaurant in base_restaurants})
+    restaurants, menus = [], []
+    for index in range(size):
+        base = base_restaurants[index % len(base_restaurants)]
+        restaurant_id = f"S{index:06d}"
+        restaurants.append(
+            {
+                **base,
+                "restaurant_id": restaurant_id,
+                "name": f"{base['name']} {index}",
+                "location": rng.choice(locations),
+                "ambience": rng.choice(("indoor", "outdoor")),
+            }
+        )
+        dishes = [dict(dish) for menu in rng.sample(base_menus, 2) for dish in menu]
+        for dish in dishes:
+            dish["price"] = max(20, round(dish["price"] * rng.uniform(0.6, 1.4)))
+        menus.append({"restaurant_id": restaurant_id, "menu": dishes})
+    return restaurants, menus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Semantic restaurant search latency")
+    parser.add_argument("--restaurants", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "semantic-search-benchmark"))
+    args = parser.parse_args()
+    logging.getLogger("RestaurantAssistant").setLevel(logging.WARNING)
+
+    from utils.embedding_index import EmbeddingIndex, create_embedder
+    from utils.knowledge_base import KnowledgeBase
+
+    restaurants, menus = synthetic_catalogue(args.restaurants)
+    kb = KnowledgeBase(restaurants, menus)
+    os.makedirs(args.workdir, exist_ok=True)
+    path = os.path.join(args.workdir, f"embeddings-{args.restaurants}.npy")
+    start = time.perf_counter()
+    index = EmbeddingIndex(kb, create_embedder(), path=path)
+    load_seconds = time.perf_counter() - start
+    print(
+        f"{len(index)} restaurants, {index.matrix.shape[0]}-d {index.embedder.name}, "
+        f"index ready in {load_seconds:.2f}s ({path})"
+    )
+
+    timings = {"embed_query": [], "filter": [], "search": []}
+    for run in range(args.queries):
+        query, criteria = QUERIES[run % len(QUERIES)]
+        start = time.perf_counter()
+        index.embedder.embed_query(query, index.vocabulary)
+        timings["embed_query"].append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        mask = index.filter_mask(**criteria)
+        timings["filter"].append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        index.search(query, k=args.k, mask=mask)
+        timings["search"].append((time.perf_counter() - start) * 1000)
+
+    print(f"{'step':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for step, samples in timings.items():
+        summary = summarize(samples)
+        print(f"{step:<12}{summary['p50']:>10.3f}{summary['p95']:>10.3f}{summary['p99']:>10.3f}")
+    for query, criteria in QUERIES:
+        top = index.search(query, k=3, mask=index.filter_mask(**criteria))
+        names = ", ".join(f"{kb.restaurant(rid)['name']} ({score:.2f})" for rid, score in top)
+        print(f"{query!r}: {names}")
+
+
+if __name__ == "__main__":
+    main()
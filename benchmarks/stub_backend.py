@@ -0,0 +1,63 @@
+import json
+import re
+import time
+from utils.model import ScriptedBackend
+
+# How each template's prompt ends, with the user message captured
+PROMPT_ENDINGS = [
+    ("classify_intent", re.compile(r"\n- User: (.*)\n  Assistant:\Z")),
+    ("fetch_menu", re.compile(r"\nUser: (.*)\nAssistant: \Z")),
+    ("extract_intent_slots", re.compile(r"\nUser: \"(.*)\"\Z")),
+    ("extract_slots", re.compile(r"\nUser Query: \"(.*)\"\nOutput:\s*\Z")),
+]
+FINAL_RESPONSE = (
+    "Final Assistant Response: Here is what I found for you. "
+    "Let me know if you would like to book a table or see anything else."
+)
+
+
+class CorpusBackend(ScriptedBackend):
+    """Deterministic stand-in for the model on benchmark corpus messages.
+
+    Every prompt is answered from the message's recorded intent and slots, in
+    the format of the template it was rendered from, after `latency_ms` per
+    generate call to stand in for model time.
+    """
+
+    name = "benchmark_stub"
+
+    def __init__(self, corpus, latency_ms=0.0):
+        super().__init__()
+        self.entries = {entry["message"]: entry for entry in corpus}
+        self.latency_ms = latency_ms
+
+    def load(self):
+        pass
+
+    def reply(self, prompt):
+        if prompt.endswith("Final Assistant Response:"):
+            return FINAL_RESPONSE
+        for kind, pattern in PROMPT_ENDINGS:
+            match = pattern.search(prompt)
+            if match:
+                entry = self.entries.get(match.group(1))
+                return self.answer(kind, entry) if entry else self.default_reply
+        return self.default_reply
+
+    @staticmethod
+    def answer(kind, entry):
+        intent, slots = entry["intent"], entry["slots"]
+        if intent == "general_response":
+            intent = "generate_response"
+        if kind == "classify_intent":
+            return f" Intent: {intent} Confidence: 0.98"
+        if kind == "extract_intent_slots":
+            return f"\nIntent: {intent} Confidence: 0.98\nSlots: {json.dumps(slots)}"
+        if kind == "fetch_menu":
+            return f"{slots.get('restaurant_name')} (confidence: 0.98)"
+        return "\n" + json.dumps(slots)
+
+    def generate(self, prompts, **generate_kwargs):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return super().generate(prompts, **generate_kwargs)
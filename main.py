@@ -1,14 +1,21 @@
+import asyncio
+import json
 import re
-from jinja2 import Environment, FileSystemLoader
 from services.fetch_menu import FetchMenuService
 from services.search_restaurant import SearchRestaurantService
 from services.fetch_price import FetchPriceService
 from services.reserve_restaurant import ReserveRestaurantService
 from services.check_availability import CheckAvailabilityService
+from utils import config, tracing
 from utils.model import model_pipeline
+from utils.prompts import prompts
+from utils.intent_classifier import IntentClassifier
+from utils.service_registry import ServiceRegistry
+from utils.history import ConversationMemory
+from utils.structured_output import extract_json_object
+from utils.streaming import ResponseStreamFormatter, format_response
 from utils.logging_utils import logger
-
-env = Environment(loader=FileSystemLoader("templates"))
+from utils.tracing import traced
 
 # INTENT-SERVICE MAPPING
 INTENT_TO_SERVICE = {
@@ -18,15 +25,47 @@ INTENT_TO_SERVICE = {
     "search_restaurant": SearchRestaurantService,
     "fetch_price": FetchPriceService,
 }
+service_registry = ServiceRegistry(INTENT_TO_SERVICE)
 
 
-def detect_intent(user_message):
-    template = env.get_template("classify_intent.jinja2")
-    prompt = template.render(user_message=user_message)
+# The classify_intent template ends at "Assistant:", so the answer is the first generated line
+INTENT_GENERATION_KWARGS = {
+    "max_new_tokens": 16,
+    "do_sample": False,
+    "temperature": 0.1,
+    "stop": ["\n"],
+}
+SLOTS_GENERATION_KWARGS = {
+    "max_new_tokens": 80,
+    "do_sample": False,
+    "temperature": 0.1,
+    "stop_at_json_close": True,
+}
+
+
+def render_prompt(template_name, user_message):
+    return prompts.render(template_name, user_message=user_message)
+
+
+def detect_intent_with_model(user_message):
+    template, prompt = render_prompt("classify_intent.jinja2", user_message)
+    model_response = model_pipeline(
+        prompt, template=template, return_full_text=False, **INTENT_GENERATION_KWARGS
+    )[0]["generated_text"]
+    return parse_intent(model_response)
+
 
-    model_response = model_pipeline(prompt, do_sample=False, temperature=0.1)[0][
-        "generated_text"
-    ]
+async def adetect_intent_with_model(user_message):
+    template, prompt = render_prompt("classify_intent.jinja2", user_message)
+    model_response = (
+        await model_pipeline.agenerate(
+            prompt, template=template, return_full_text=False, **INTENT_GENERATION_KWARGS
+        )
+    )[0]["generated_text"]
+    return parse_intent(model_response)
+
+
+def parse_intent(model_response):
     lines = model_response.strip().split("\n")
 
     for line in reversed(lines):
@@ -34,7 +73,7 @@ def detect_intent(user_message):
         if match:
             intent = match.group(1)
             confidence = float(match.group(2))
-            logger.info(f"Extracted Intent: {intent}, Confidence: {confidence}")
+            logger.info("Extracted Intent: %s, Confidence: %s", intent, confidence)
             if confidence > 0.9:
                 return intent
 
@@ -42,41 +81,252 @@ def detect_intent(user_message):
     return "general_response"
 
 
-def generate_final_response(user_message, conversation_history, tool_result):
-    context = "\n".join(
-        [
-            f"{msg['role'].capitalize()}: {msg['content']}"
-            for msg in conversation_history
-        ]
+intent_classifier = IntentClassifier(
+    model_fallback=detect_intent_with_model,
+    async_model_fallback=adetect_intent_with_model,
+)
+
+
+@traced("intent")
+def detect_intent(user_message):
+    return intent_classifier.classify(user_message)
+
+
+@traced("intent")
+async def adetect_intent(user_message):
+    return await intent_classifier.aclassify(user_message)
+
+
+def extract_intent_and_slots(user_message):
+    template, prompt = render_prompt("extract_intent_slots.jinja2", user_message)
+    model_response = model_pipeline(
+        prompt, template=template, return_full_text=False, **SLOTS_GENERATION_KWARGS
+    )[0]["generated_text"]
+    return parse_intent_and_slots(model_response)
+
+
+async def aextract_intent_and_slots(user_message):
+    template, prompt = render_prompt("extract_intent_slots.jinja2", user_message)
+    model_response = (
+        await model_pipeline.agenerate(
+            prompt, template=template, return_full_text=False, **SLOTS_GENERATION_KWARGS
+        )
+    )[0]["generated_text"]
+    return parse_intent_and_slots(model_response)
+
+
+def parse_intent_and_slots(model_response):
+    intent_match = re.search(
+        r"Intent:\s*([\w_]+)\s+Confidence:\s*([\d.]+)", model_response
     )
-    template = env.get_template("generate_response.jinja2")
-    prompt = template.render(
-        conversation=context, user_message=user_message, tool_result=tool_result
+    if not intent_match or float(intent_match.group(2)) <= 0.9:
+        logger.info("Default Intent Extracted.")
+        return "general_response", None
+
+    intent = intent_match.group(1)
+    logger.info("Extracted Intent: %s, Confidence: %s", intent, intent_match.group(2))
+
+    slots = None
+    slots_json = extract_json_object(model_response)
+    if slots_json:
+        try:
+            slots = json.loads(slots_json)
+            logger.info("Extracted Slots: %s", slots)
+        except json.JSONDecodeError as e:
+            logger.error("Failed to parse slots: %s\nModel output: %s", e, model_response)
+    return intent, slots
+
+
+@traced("intent")
+def detect_intent_and_slots(user_message):
+    intent = intent_classifier.rules_tier(user_message)
+    if intent is not None:
+        # Slots are left to the service's own extractor
+        return intent, None
+    return extract_intent_and_slots(user_message)
+
+
+@traced("intent")
+async def adetect_intent_and_slots(user_message):
+    intent = intent_classifier.rules_tier(user_message)
+    if intent is not None:
+        return intent, None
+    return await aextract_intent_and_slots(user_message)
+
+
+RESPONSE_MARKER = "Final Assistant Response:"
+RESPONSE_GENERATION_KWARGS = {
+    "max_new_tokens": 200,
+    "do_sample": True,
+    "temperature": 0.7,
+    # Long, single-prompt generations are where a draft model pays off (config.DRAFT_MODEL_ID)
+    "speculative": True,
+}
+
+
+def render_response_prompt(user_message, conversation_history, tool_result):
+    # conversation_history holds the turns before user_message: a ConversationMemory,
+    # or a plain message list that is fitted into the same token budget
+    if not isinstance(conversation_history, ConversationMemory):
+        conversation_history = ConversationMemory.from_messages(conversation_history)
+    context = conversation_history.render()
+    return prompts.render(
+        "generate_response.jinja2",
+        conversation=context,
+        user_message=user_message,
+        tool_result=tool_result,
     )
 
+
+@traced("response")
+def generate_final_response(user_message, conversation_history, tool_result):
+    template, prompt = render_response_prompt(
+        user_message, conversation_history, tool_result
+    )
     raw_response = model_pipeline(
-        prompt, max_new_tokens=200, do_sample=True, temperature=0.7
+        prompt,
+        template=template,
+        return_full_text=False,
+        **RESPONSE_GENERATION_KWARGS,
+    )[0]["generated_text"]
+    return format_response(raw_response, RESPONSE_MARKER)
+
+
+@traced("response")
+async def agenerate_final_response(user_message, conversation_history, tool_result):
+    template, prompt = render_response_prompt(
+        user_message, conversation_history, tool_result
+    )
+    raw_response = (
+        await model_pipeline.agenerate(
+            prompt,
+            template=template,
+            return_full_text=False,
+            **RESPONSE_GENERATION_KWARGS,
+        )
     )[0]["generated_text"]
-    marker = "Final Assistant Response:"
-    if marker in raw_response:
-        final_response = raw_response.split(marker, 1)[1].strip()
+    return format_response(raw_response, RESPONSE_MARKER)
+
+
+def stream_final_response(user_message, conversation_history, tool_result):
+    template, prompt = render_response_prompt(
+        user_message, conversation_history, tool_result
+    )
+    formatter = ResponseStreamFormatter(RESPONSE_MARKER)
+    with tracing.span("response"):
+        for chunk in model_pipeline.stream(
+            prompt, template=template, **RESPONSE_GENERATION_KWARGS
+        ):
+            text = formatter.feed(chunk)
+            if text:
+                yield text
+        text = formatter.flush()
+        if text:
+            yield text
+
+
+async def astream_final_response(user_message, conversation_history, tool_result):
+    template, prompt = render_response_prompt(
+        user_message, conversation_history, tool_result
+    )
+    formatter = ResponseStreamFormatter(RESPONSE_MARKER)
+    with tracing.span("response"):
+        async for chunk in model_pipeline.astream(
+            prompt, template=template, **RESPONSE_GENERATION_KWARGS
+        ):
+            text = formatter.feed(chunk)
+            if text:
+                yield text
+        text = formatter.flush()
+        if text:
+            yield text
+
+
+def run_tool(user_message):
+    if config.FUSED_EXTRACTION:
+        intent, slots = detect_intent_and_slots(user_message)
     else:
-        final_response = raw_response.strip()
-    final_response = " ".join(final_response.split())
-    return final_response
+        intent, slots = detect_intent(user_message), None
+    tracing.annotate(intent=intent)
+    tool_result = None
 
+    if intent in INTENT_TO_SERVICE and intent != "general_response":
+        with tracing.span("tool", service=intent):
+            service = service_registry.get(intent)
+            tool_result = service.process_request(user_message, slots=slots)
+        logger.debug("Tool result: %s", tool_result)
+    return tool_result
 
-def process_chat(user_message, conversation_history):
-    logger.info(f"User Query: {user_message}")
-    intent = detect_intent(user_message)
+
+async def arun_tool(user_message):
+    if config.FUSED_EXTRACTION:
+        intent, slots = await adetect_intent_and_slots(user_message)
+    else:
+        intent, slots = await adetect_intent(user_message), None
+    tracing.annotate(intent=intent)
     tool_result = None
 
     if intent in INTENT_TO_SERVICE and intent != "general_response":
-        service = INTENT_TO_SERVICE[intent]()
-        tool_result = service.process_request(user_message)
-        logger.info(f"Tool result: {tool_result}")
+        with tracing.span("tool", service=intent):
+            # The registry may stat or reload the knowledge base files
+            service = await asyncio.to_thread(service_registry.get, intent)
+            tool_result = await service.aprocess_request(user_message, slots=slots)
+        logger.debug("Tool result: %s", tool_result)
+    return tool_result
 
-    final_response = generate_final_response(
-        user_message, conversation_history, tool_result
-    )
+
+def remember_turn(conversation_history, user_message, response, tool_result):
+    # Plain message lists are left to the caller
+    if isinstance(conversation_history, ConversationMemory):
+        conversation_history.add_turn(user_message, response, tool_result)
+
+
+def process_chat(user_message, conversation_history):
+    logger.info("User Query: %s", user_message)
+    with tracing.span("turn"):
+        tool_result = run_tool(user_message)
+
+        final_response = generate_final_response(
+            user_message, conversation_history, tool_result
+        )
+    remember_turn(conversation_history, user_message, final_response, tool_result)
     return final_response
+
+
+def process_chat_stream(user_message, conversation_history):
+    """Like process_chat, but yields the final response as it is decoded."""
+    logger.info("User Query: %s", user_message)
+    chunks = []
+    with tracing.span("turn"):
+        tool_result = run_tool(user_message)
+        for text in stream_final_response(user_message, conversation_history, tool_result):
+            chunks.append(text)
+            yield text
+    remember_turn(conversation_history, user_message, "".join(chunks), tool_result)
+
+
+async def aprocess_chat(user_message, conversation_history):
+    """process_chat for an event loop: model calls are awaited and knowledge base
+    and reservation I/O runs on worker threads, so many conversations can be in
+    flight at once."""
+    logger.info("User Query: %s", user_message)
+    with tracing.span("turn"):
+        tool_result = await arun_tool(user_message)
+        final_response = await agenerate_final_response(
+            user_message, conversation_history, tool_result
+        )
+    remember_turn(conversation_history, user_message, final_response, tool_result)
+    return final_response
+
+
+async def aprocess_chat_stream(user_message, conversation_history):
+    logger.info("User Query: %s", user_message)
+    chunks = []
+    with tracing.span("turn"):
+        tool_result = await arun_tool(user_message)
+        async for text in astream_final_response(
+            user_message, conversation_history, tool_result
+        ):
+            chunks.append(text)
+            yield text
+    remember_turn(conversation_history, user_message, "".join(chunks), tool_result)
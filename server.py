@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from http import HTTPStatus
+from urllib.parse import urlsplit
+from main import aprocess_chat_stream
+from utils import config, metrics, tracing
+from utils.history import ConversationMemory
+from utils.logging_utils import logger
+
+MAX_BODY_BYTES = 1 << 20
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+class Session:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.messages = []
+        self.memory = ConversationMemory()
+        self.last_used = time.monotonic()
+        # Turns of one conversation run one at a time
+        self.lock = asyncio.Lock()
+
+    def to_dict(self):
+        return {"session_id": self.session_id, "messages": self.messages}
+
+
+class SessionStore:
+    """Server-side conversations keyed by session ID, least recently used first out."""
+
+    def __init__(self, max_sessions=None, ttl_seconds=None):
+        self.max_sessions = max_sessions or config.MAX_SESSIONS
+        self.ttl_seconds = ttl_seconds or config.SESSION_TTL_SECONDS
+        self._sessions = OrderedDict()
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl_seconds
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_used >= deadline and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+
+    def create(self):
+        session = Session(uuid.uuid4().hex)
+        self._sessions[session.session_id] = session
+        self._expire()
+        return session
+
+    def get(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown session '{session_id}'")
+        session.last_used = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id):
+        if self._sessions.pop(session_id, None) is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown session '{session_id}'")
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class Request:
+    def __init__(self, method, path, headers, body):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        try:
+            payload = json.loads(self.body or b"{}")
+        except json.JSONDecodeError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Invalid JSON body: {e}")
+        if not isinstance(payload, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Expected a JSON object")
+        return payload
+
+
+async def read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+    body = await reader.readexactly(length) if length else b""
+    return Request(method, urlsplit(target).path, headers, body)
+
+
+def response_head(status, content_type, extra_headers=()):
+    lines = [
+        f"HTTP/1.1 {status.value} {status.phrase}",
+        f"Content-Type: {content_type}",
+        *extra_headers,
+    ]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send_json(writer, payload, status=HTTPStatus.OK):
+    body = json.dumps(payload).encode()
+    writer.write(
+        response_head(status, "application/json", [f"Content-Length: {len(body)}"])
+        + body
+    )
+    await writer.drain()
+
+
+async def send_text(writer, text, content_type, status=HTTPStatus.OK):
+    body = text.encode()
+    writer.write(response_head(status, content_type, [f"Content-Length: {len(body)}"]) + body)
+    await writer.drain()
+
+
+async def send_event(writer, data, event=None):
+    # One Server-Sent Event per HTTP chunk
+    message = f"event: {event}\n" if event else ""
+    message += f"data: {json.dumps(data)}\n\n"
+    chunk = message.encode()
+    writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+    await writer.drain()
+
+
+class ChatServer:
+    """Headless chat API over aprocess_chat_stream; all connections share this
+    process's model backend and batching queue.
+
+    POST   /sessions                          -> {"session_id"}
+    GET    /sessions/<id>                     -> {"session_id", "messages"}
+    DELETE /sessions/<id>
+    POST   /chat        {"message", "session_id"?} -> {"session_id", "response"}
+    POST   /chat/stream {"message", "session_id"?} -> text/event-stream of
+           {"text"} events, then a "done" event with {"session_id", "response"}
+    GET    /health
+    GET    /metrics                           -> Prometheus text format
+    GET    /traces                            -> the last TRACE_BUFFER_SIZE turn traces
+    """
+
+    def __init__(self, sessions=None):
+        self.sessions = sessions or SessionStore()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = None
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    await self.dispatch(request, writer)
+                except HTTPError as e:
+                    await send_json(writer, {"error": str(e)}, e.status)
+                # A request that couldn't be read leaves the stream in an unknown state
+                if request is None or request.headers.get("connection") == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            logger.exception("Chat server request failed")
+            try:
+                await send_json(
+                    writer, {"error": "Internal server error"}, HTTPStatus.INTERNAL_SERVER_ERROR
+                )
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request, writer):
+        parts = tuple(part for part in request.path.split("/") if part)
+        method = request.method
+
+        def allow(*methods):
+            if method not in methods:
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+
+        if parts == ("health",):
+            allow("GET")
+            await send_json(writer, {"status": "ok", "sessions": len(self.sessions)})
+        elif parts == ("metrics",):
+            allow("GET")
+            await send_text(writer, metrics.registry.render(), metrics.CONTENT_TYPE)
+        elif parts == ("traces",):
+            allow("GET")
+            await send_json(
+                writer, {"traces": [trace.to_dict() for trace in list(tracing.recent_traces)]}
+            )
+        elif parts == ("sessions",):
+            allow("POST")
+            session = self.sessions.create()
+            await send_json(writer, {"session_id": session.session_id}, HTTPStatus.CREATED)
+        elif len(parts) == 2 and parts[0] == "sessions":
+            allow("GET", "DELETE")
+            if method == "GET":
+                await send_json(writer, self.sessions.get(parts[1]).to_dict())
+            else:
+                self.sessions.delete(parts[1])
+                await send_json(writer, {"session_id": parts[1], "deleted": True})
+        elif parts == ("chat",):
+            allow("POST")
+            session, message = self._chat_request(request)
+            async with session.lock:
+                response = "".join([text async for text in self._turn(session, message)])
+            await send_json(writer, {"session_id": session.session_id, "response": response})
+        elif parts == ("chat", "stream"):
+            allow("POST")
+            session, message = self._chat_request(request)
+            async with session.lock:
+                await self._stream(session, message, writer)
+        else:
+            raise HTTPError(HTTPStatus.NOT_FOUND)
+
+    def _chat_request(self, request):
+        payload = request.json()
+        message = payload.get("message")
+        if not isinstance(message, str) or not message.strip():
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "'message' must be a non-empty string")
+        session_id = payload.get("session_id")
+        session = self.sessions.get(session_id) if session_id else self.sessions.create()
+        return session, message
+
+    async def _turn(self, session, message):
+        chunks = []
+        # The memory records the turn once the response is complete
+        async for text in aprocess_chat_stream(message, session.memory):
+            chunks.append(text)
+            yield text
+        session.messages.append({"role": "user", "content": message})
+        session.messages.append({"role": "assistant", "content": "".join(chunks)})
+
+    async def _stream(self, session, message, writer):
+        writer.write(
+            response_head(
+                HTTPStatus.OK,
+                "text/event-stream",
+                ["Cache-Control: no-cache", "Transfer-Encoding: chunked"],
+            )
+        )
+        chunks = []
+        try:
+            async for text in self._turn(session, message):
+                chunks.append(text)
+                await send_event(writer, {"text": text})
+            await send_event(
+                writer,
+                {"session_id": session.session_id, "response": "".join(chunks)},
+                event="done",
+            )
+        except ConnectionError:
+            raise
+        except Exception as e:
+            # Headers are already sent, so the failure is reported in-stream
+            logger.exception("Chat stream failed")
+            await send_event(writer, {"error": str(e)}, event="error")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+async def serve(host=None, port=None):
+    server = ChatServer()
+    listener = await asyncio.start_server(
+        server.handle_connection,
+        host or config.CHAT_SERVER_HOST,
+        port or config.CHAT_SERVER_PORT,
+    )
+    for socket in listener.sockets:
+        logger.info("Chat server listening on %s", socket.getsockname())
+    async with listener:
+        await listener.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless FoodieSpot chat server")
+    parser.add_argument("--host", default=config.CHAT_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=config.CHAT_SERVER_PORT)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
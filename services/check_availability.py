@@ -1,13 +1,14 @@
-import json
-import re
-from jinja2 import Environment, FileSystemLoader
-from datetime import datetime
-from pydantic import BaseModel
-from typing import Optional
-from utils.model import model_pipeline
+import asyncio
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional
+from utils.model import agenerate_structured, generate_structured
+from utils.prompts import prompts
 from utils.logging_utils import logger
+from utils.tracing import traced
+from utils.knowledge_base import get_knowledge_base
+from utils.capacity import DATE_FORMAT, get_capacity_index, parse_date_time
 
-env = Environment(loader=FileSystemLoader("templates"))
+EXTRACTION_KWARGS = {"max_new_tokens": 60, "do_sample": False, "temperature": 0.1}
 
 
 class AvailabilityQuery(BaseModel):
@@ -22,61 +23,40 @@ class AvailabilityResponse(BaseModel):
     num_people: int
     available: bool
     message: str
+    next_available: Optional[str] = None
+    restaurants: Optional[List[str]] = None
 
 
 class CheckAvailabilityService:
-    def __init__(self, filename="knowledge_base/reservations.json"):
-        self.filename = filename
-        self._load_reservations()
-
-    def _load_reservations(self):
-        try:
-            with open(self.filename, "r") as file:
-                self.reservations = json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.reservations = []
+    def __init__(self, capacity=None):
+        self.capacity = capacity or get_capacity_index()
 
     @staticmethod
+    @traced("extraction")
     def extract_availability_details(user_message: str) -> Optional[AvailabilityQuery]:
-        template = env.get_template("check_availability.jinja2")
-        prompt = template.render(user_message=user_message)
-
-        model_output = model_pipeline(
-            prompt, max_new_tokens=30, do_sample=False, temperature=0.1
-        )[0]["generated_text"]
+        template, prompt = prompts.render("check_availability.jinja2", user_message=user_message)
 
-        logger.info(f"Raw Model Output: {model_output}")
-
-        try:
-            matches = re.findall(r"\{(?:[^{}]*|\"[^\"]*\"|\{(?:[^{}]*|\"[^\"]*\")*\})*\}", model_output)
-            if not matches:
-                raise ValueError("No JSON object found in model output.")
+        return generate_structured(
+            prompt, AvailabilityQuery, template=template, **EXTRACTION_KWARGS
+        )
 
-            json_str = matches[-1].strip()
-            query_dict = json.loads(json_str)
+    @staticmethod
+    @traced("extraction")
+    async def aextract_availability_details(user_message: str) -> Optional[AvailabilityQuery]:
+        template, prompt = prompts.render("check_availability.jinja2", user_message=user_message)
 
-            return AvailabilityQuery(**query_dict)
-        except Exception as e:
-            logger.error(
-                f"Failed to parse availability details: {e}\nModel output: {model_output}"
-            )
-            return None
+        return await agenerate_structured(
+            prompt, AvailabilityQuery, template=template, **EXTRACTION_KWARGS
+        )
 
     def check_availability(
-        self, restaurant_name: str, date_time: str, num_people: int
+        self, restaurant: dict, date_time: str, num_people: int
     ) -> AvailabilityResponse:
-        requested_time = datetime.strptime(date_time, "%Y-%m-%d %H:%M")
-
-        # Assuming the restaurant has a max capacity of 10 per time slot
-        max_capacity = 10
-        booked_seats = sum(
-            res["num_people"]
-            for res in self.reservations
-            if res["restaurant"] == restaurant_name and res["date_time"] == date_time
-        )
+        requested_time = parse_date_time(date_time)
+        restaurant_name = restaurant["name"]
+        restaurant_id = restaurant["restaurant_id"]
 
-        available_seats = max_capacity - booked_seats
-        if available_seats >= num_people:
+        if self.capacity.is_available(restaurant_id, num_people, requested_time):
             return AvailabilityResponse(
                 restaurant_name=restaurant_name,
                 date_time=date_time,
@@ -84,17 +64,75 @@ class CheckAvailabilityService:
                 available=True,
                 message=f"Yes! {restaurant_name} has {num_people} seats available on {date_time}.",
             )
+
+        message = f"Sorry, {restaurant_name} does not have {num_people} seats available on {date_time}."
+        next_slot = self.capacity.next_available(restaurant_id, num_people, requested_time)
+        if next_slot:
+            message += f" The next available slot is {next_slot.strftime(DATE_FORMAT)}."
+        return AvailabilityResponse(
+            restaurant_name=restaurant_name,
+            date_time=date_time,
+            num_people=num_people,
+            available=False,
+            next_available=next_slot.strftime(DATE_FORMAT) if next_slot else None,
+            message=message,
+        )
+
+    def find_available_restaurants(
+        self, date_time: str, num_people: int
+    ) -> AvailabilityResponse:
+        knowledge_base = get_knowledge_base()
+        restaurants = [
+            knowledge_base.restaurant(restaurant_id)["name"]
+            for restaurant_id in self.capacity.available_restaurants(
+                num_people, parse_date_time(date_time)
+            )
+        ]
+        if restaurants:
+            message = f"Restaurants with {num_people} seats available on {date_time}: {', '.join(restaurants)}."
         else:
-            return AvailabilityResponse(
-                restaurant_name=restaurant_name,
-                date_time=date_time,
-                num_people=num_people,
-                available=False,
-                message=f"Sorry, {restaurant_name} does not have {num_people} seats available on {date_time}.",
+            message = f"Sorry, no restaurant has {num_people} seats available on {date_time}."
+        return AvailabilityResponse(
+            restaurant_name="Any",
+            date_time=date_time,
+            num_people=num_people,
+            available=bool(restaurants),
+            restaurants=restaurants,
+            message=message,
+        )
+
+    @staticmethod
+    def from_slots(slots: dict) -> Optional[AvailabilityQuery]:
+        try:
+            return AvailabilityQuery(
+                restaurant_name=slots.get("restaurant_name"),
+                date_time=slots.get("date_time"),
+                num_people=slots.get("num_people"),
             )
+        except ValidationError as e:
+            logger.error("Invalid availability slots: %s", e)
+            return None
+
+    def process_request(
+        self, user_message: str, slots: Optional[dict] = None
+    ) -> AvailabilityResponse:
+        if slots is not None:
+            details = self.from_slots(slots)
+        else:
+            details = self.extract_availability_details(user_message)
+        return self.respond(details)
 
-    def process_request(self, user_message: str) -> AvailabilityResponse:
-        details = self.extract_availability_details(user_message)
+    async def aprocess_request(
+        self, user_message: str, slots: Optional[dict] = None
+    ) -> AvailabilityResponse:
+        if slots is not None:
+            details = self.from_slots(slots)
+        else:
+            details = await self.aextract_availability_details(user_message)
+        return await asyncio.to_thread(self.respond, details)
+
+    @traced("kb_lookup")
+    def respond(self, details: Optional[AvailabilityQuery]) -> AvailabilityResponse:
         if not details:
             return AvailabilityResponse(
                 restaurant_name="Unknown",
@@ -104,12 +142,13 @@ class CheckAvailabilityService:
                 message="Could not extract availability details. Please provide restaurant name, date-time, and number of people.",
             )
 
+        # Without a restaurant name, list every restaurant with room at that time
         missing_fields = []
-        if not details.restaurant_name:
-            missing_fields.append("restaurant name")
         if not details.date_time:
             missing_fields.append("date and time")
-        if not details.num_people:
+        if not details.num_people or details.num_people < 1:
+            # A zero or negative party size is asked for again like a missing one
+            details.num_people = None
             missing_fields.append("number of people")
 
         if missing_fields:
@@ -121,6 +160,28 @@ class CheckAvailabilityService:
                 message=f"Please provide the {', '.join(missing_fields)} to check availability.",
             )
 
-        # return self.check_availability(
-        #     details.restaurant_name, formatted_date_time, details.num_people
-        # )
+        try:
+            parse_date_time(details.date_time)
+        except ValueError:
+            return AvailabilityResponse(
+                restaurant_name=details.restaurant_name or "Unknown",
+                date_time=details.date_time,
+                num_people=details.num_people,
+                available=False,
+                message="Invalid date format. Please use YYYY-MM-DD HH:MM.",
+            )
+
+        if not details.restaurant_name:
+            return self.find_available_restaurants(details.date_time, details.num_people)
+
+        restaurant = get_knowledge_base().resolve_restaurant(details.restaurant_name)
+        if restaurant is None:
+            return AvailabilityResponse(
+                restaurant_name=details.restaurant_name,
+                date_time=details.date_time,
+                num_people=details.num_people,
+                available=False,
+                message=get_knowledge_base().not_found_message(details.restaurant_name),
+            )
+
+        return self.check_availability(restaurant, details.date_time, details.num_people)
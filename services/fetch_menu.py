@@ -1,12 +1,15 @@
+import asyncio
 import re
-from jinja2 import Environment, FileSystemLoader
 from pydantic import BaseModel, Field
 from typing import Optional
-from utils.knowledge_base import restaurant_kb, menu_kb
+from utils.knowledge_base import get_knowledge_base
 from utils.model import model_pipeline
+from utils.prompts import prompts
 from utils.logging_utils import logger
+from utils.tracing import traced
 
-env = Environment(loader=FileSystemLoader("templates"))
+# The answer is a single line right after the prompt's "Assistant: "
+EXTRACTION_KWARGS = {"max_new_tokens": 24, "do_sample": False, "stop": ["\n"]}
 
 
 class ModelMenuResponse(BaseModel):
@@ -25,36 +28,43 @@ class MenuResponse(BaseModel):
 class FetchMenuService:
     @staticmethod
     def fetch_restaurant_id(restaurant_name):
-        for restaurant in restaurant_kb:
-            if restaurant["name"].lower() == restaurant_name.lower():
-                return restaurant["restaurant_id"]
-
-        return None
+        return get_knowledge_base().restaurant_id(restaurant_name)
 
     @staticmethod
     def fetch_menu(restaurant_id):
-        for items in menu_kb:
-            if items["restaurant_id"] == restaurant_id:
-                return items["menu"]
-
-        return None
+        return get_knowledge_base().menu(restaurant_id)
 
     @staticmethod
+    @traced("extraction")
     def call_model(user_message):
-        template = env.get_template("fetch_menu.jinja2")
-        prompt = template.render(user_message=user_message)
+        template, prompt = prompts.render("fetch_menu.jinja2", user_message=user_message)
 
-        model_response = model_pipeline(prompt)[0]["generated_text"]
+        model_response = model_pipeline(
+            prompt, template=template, return_full_text=False, **EXTRACTION_KWARGS
+        )[0]["generated_text"]
+        return FetchMenuService.parse_model_response(model_response)
 
-        matches = re.findall(
-            r"Assistant:\s*(.+?)\s*\(confidence:\s*([\d.]+)\)", model_response
-        )
-        if matches:
-            restaurant_name, confidence_score = matches[-1]
+    @staticmethod
+    @traced("extraction")
+    async def acall_model(user_message):
+        template, prompt = prompts.render("fetch_menu.jinja2", user_message=user_message)
+
+        model_response = (
+            await model_pipeline.agenerate(
+                prompt, template=template, return_full_text=False, **EXTRACTION_KWARGS
+            )
+        )[0]["generated_text"]
+        return FetchMenuService.parse_model_response(model_response)
+
+    @staticmethod
+    def parse_model_response(model_response):
+        match = re.match(r"\s*(.+?)\s*\(confidence:\s*([\d.]+)\)", model_response)
+        if match:
+            restaurant_name, confidence_score = match.groups()
             confidence_score = float(confidence_score)
 
             logger.info(
-                f"Extracted Restaurant Name: {restaurant_name}, Confidence: {confidence_score}"
+                "Extracted Restaurant Name: %s, Confidence: %s", restaurant_name, confidence_score
             )
 
             return ModelMenuResponse(
@@ -65,16 +75,43 @@ class FetchMenuService:
             error="Could not extract restaurant name", confidence=0.0
         )
 
+    @staticmethod
+    def from_slots(slots):
+        if not slots.get("restaurant_name"):
+            return ModelMenuResponse(
+                error="Could not extract restaurant name", confidence=0.0
+            )
+        return ModelMenuResponse(restaurant_name=slots["restaurant_name"], confidence=1.0)
+
     @classmethod
-    def process_request(self, user_message):
-        model_response = self.call_model(user_message)
+    def process_request(self, user_message, slots=None):
+        if slots is not None:
+            model_response = self.from_slots(slots)
+        else:
+            model_response = self.call_model(user_message)
+        return self.respond(model_response)
 
+    @classmethod
+    async def aprocess_request(self, user_message, slots=None):
+        if slots is not None:
+            model_response = self.from_slots(slots)
+        else:
+            model_response = await self.acall_model(user_message)
+        return await asyncio.to_thread(self.respond, model_response)
+
+    @classmethod
+    @traced("kb_lookup")
+    def respond(self, model_response):
         if model_response.error:
             return {"error": model_response.error}
 
         restaurant_id = self.fetch_restaurant_id(model_response.restaurant_name)
         if not restaurant_id:
-            return {"error": "Restaurant not found in database"}
+            return {
+                "error": get_knowledge_base().not_found_message(model_response.restaurant_name)
+            }
 
         menu = self.fetch_menu(restaurant_id)
-        return MenuResponse(restaurant_name=model_response.restaurant_name, menu=menu)
+        return MenuResponse(
+            restaurant_name=get_knowledge_base().restaurant(restaurant_id)["name"], menu=menu
+        )
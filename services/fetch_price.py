@@ -1,81 +1,149 @@
-import json
-import re
-from jinja2 import Environment, FileSystemLoader
-from pydantic import BaseModel
+import asyncio
+from pydantic import BaseModel, ValidationError
 from typing import Optional, List
-from utils.model import model_pipeline
+from utils import config
+from utils.menu_store import MOST_EXPENSIVE, get_menu_store, parse_order
+from utils.model import agenerate_structured, generate_structured
+from utils.prompts import prompts
 from utils.logging_utils import logger
-from utils.knowledge_base import menu_kb
+from utils.tracing import traced
+from utils.knowledge_base import get_knowledge_base
 
-env = Environment(loader=FileSystemLoader("templates"))
+EXTRACTION_KWARGS = {"max_new_tokens": 40, "do_sample": False, "temperature": 0.1}
 
 
 class PriceQuery(BaseModel):
     dish_name: str
     restaurant_name: Optional[str] = None
+    location: Optional[str] = None
+    food_choice: Optional[str] = None
+    price_range: Optional[str] = None
+    order: Optional[str] = None
+
+
+class DishPrice(BaseModel):
+    dish_name: str
+    price: Optional[float] = None
+    restaurant_name: str
+    category: Optional[str] = None
+    is_veg: bool
 
 
 class FetchPriceResponse(BaseModel):
     dish_name: str
     price: Optional[float] = None
     restaurant_name: Optional[str] = None
+    results: List[DishPrice] = []
     message: Optional[str] = None
 
 
 class FetchPriceService:
 
     @staticmethod
+    @traced("extraction")
     def extract_dish_query(user_message: str) -> Optional[PriceQuery]:
-        template = env.get_template("fetch_price.jinja2")
-        prompt = template.render(user_message=user_message)
+        template, prompt = prompts.render("fetch_price.jinja2", user_message=user_message)
+
+        return generate_structured(
+            prompt, PriceQuery, template=template, **EXTRACTION_KWARGS
+        )
+
+    @staticmethod
+    @traced("extraction")
+    async def aextract_dish_query(user_message: str) -> Optional[PriceQuery]:
+        template, prompt = prompts.render("fetch_price.jinja2", user_message=user_message)
 
-        model_output = model_pipeline(
-            prompt, max_new_tokens=30, do_sample=False, temperature=0.1
-        )[0]["generated_text"]
+        return await agenerate_structured(
+            prompt, PriceQuery, template=template, **EXTRACTION_KWARGS
+        )
 
+    @staticmethod
+    def from_slots(slots: dict) -> Optional[PriceQuery]:
         try:
-            matches = re.findall(r"\{[\s\S]*?\}", model_output)
-            if not matches:
-                raise ValueError("No JSON object found.")
-            json_str = matches[-1].strip()
-            query_dict = json.loads(json_str)
-            return PriceQuery(**query_dict)
-        except Exception as e:
-            logger.error(
-                f"Failed to parse dish price query: {e}\nModel output: {model_output}"
+            return PriceQuery(
+                dish_name=slots.get("dish_name"),
+                restaurant_name=slots.get("restaurant_name"),
+                location=slots.get("location"),
+                food_choice=slots.get("food_choice"),
+                price_range=slots.get("price_range"),
+                order=slots.get("order"),
             )
+        except ValidationError as e:
+            logger.error("Invalid dish price slots: %s", e)
             return None
 
-    def process_request(self, user_message: str) -> FetchPriceResponse:
-        query = self.extract_dish_query(user_message)
+    def process_request(
+        self, user_message: str, slots: Optional[dict] = None
+    ) -> FetchPriceResponse:
+        if slots is not None:
+            query = self.from_slots(slots)
+        else:
+            query = self.extract_dish_query(user_message)
+        return self.respond(query)
+
+    async def aprocess_request(
+        self, user_message: str, slots: Optional[dict] = None
+    ) -> FetchPriceResponse:
+        if slots is not None:
+            query = self.from_slots(slots)
+        else:
+            query = await self.aextract_dish_query(user_message)
+        return await asyncio.to_thread(self.respond, query)
+
+    @traced("kb_lookup")
+    def respond(self, query: Optional[PriceQuery]) -> FetchPriceResponse:
         if not query:
             return FetchPriceResponse(
                 dish_name="", message="Could not extract dish details from query."
             )
 
-        found = []
-        for restaurant in menu_kb:
-            restaurant_name = restaurant.get("name", "")
-            for dish in restaurant.get("menu", []):
-                if query.dish_name.lower() in dish.get("dish_name", "").lower():
-                    found.append(
-                        {
-                            "restaurant_name": restaurant_name,
-                            "dish_name": dish.get("dish_name"),
-                            "price": dish.get("price"),
-                        }
-                    )
+        kb = get_knowledge_base()
+        restaurant = None
+        restaurant_ids = None
+        if query.restaurant_name:
+            restaurant = kb.resolve_restaurant(query.restaurant_name)
+            if restaurant is None:
+                return FetchPriceResponse(
+                    dish_name=query.dish_name,
+                    message=kb.not_found_message(query.restaurant_name),
+                )
+            restaurant_ids = [restaurant["restaurant_id"]]
+        elif query.location:
+            # An unknown area doesn't filter
+            nearby = kb.search_restaurants(location=query.location)
+            restaurant_ids = [restaurant["restaurant_id"] for restaurant in nearby] or None
 
+        filters = {
+            "dish_name": query.dish_name,
+            "food_choice": query.food_choice,
+            "price_range": query.price_range,
+            "order": query.order,
+            "limit": config.PRICE_RESULTS_LIMIT,
+        }
+        menu_store = get_menu_store()
+        found = menu_store.find(restaurant_ids=restaurant_ids, **filters)
+        if not found and restaurant is not None:
+            # Not answered with another restaurant's dish
+            return FetchPriceResponse(
+                dish_name=query.dish_name,
+                message=f"{query.dish_name} is not on the menu at {restaurant['name']}.",
+            )
         if not found:
             return FetchPriceResponse(
                 dish_name=query.dish_name, message="Dish not found in any restaurant."
             )
 
-        # TODO: for simplicity first price is returned
-        result = found[0]
+        results = [DishPrice(**dish) for dish in found]
+        best = results[0]
+        if len(results) == 1:
+            message = "Dish found."
+        else:
+            ranking = "most expensive" if parse_order(query.order) == MOST_EXPENSIVE else "cheapest"
+            message = f"Found {len(results)} dishes, {ranking} first."
         return FetchPriceResponse(
-            dish_name=result["dish_name"],
-            price=result["price"],
-            restaurant_name=result["restaurant_name"],
-            message="Dish found.",
+            dish_name=best.dish_name,
+            price=best.price,
+            restaurant_name=best.restaurant_name,
+            results=results,
+            message=message,
         )
@@ -1,14 +1,16 @@
-import json
-import re
-from jinja2 import Environment, FileSystemLoader
+import asyncio
 from datetime import datetime
 from pydantic import BaseModel, ValidationError
 from typing import Optional
-from utils.model import model_pipeline
+from utils.model import agenerate_structured, generate_structured
+from utils.prompts import prompts
 from utils.logging_utils import logger
-from utils.knowledge_base import reservation_kb
+from utils.tracing import traced
+from utils.knowledge_base import get_knowledge_base
+from utils.reservation_store import get_reservation_store
+from utils.capacity import DATE_FORMAT, get_capacity_index
 
-env = Environment(loader=FileSystemLoader("templates"))
+EXTRACTION_KWARGS = {"max_new_tokens": 60, "do_sample": False, "temperature": 0.1}
 
 
 class ReservationQuery(BaseModel):
@@ -26,61 +28,58 @@ class ReservationResponse(BaseModel):
 
 
 class ReserveRestaurantService:
-    # TODO: filename is temporary to mock the service flow
-    def __init__(self, filename="knowledge_base/reservations.json"):
-        self.filename = filename
-        self._load_reservations()
+    def __init__(self, store=None, capacity=None):
+        self.store = store or get_reservation_store()
+        self.capacity = capacity or get_capacity_index()
 
     @staticmethod
+    @traced("extraction")
     def extract_reservation_details(user_message: str) -> Optional[ReservationQuery]:
-        template = env.get_template("reserve_restaurant.jinja2")
-        prompt = template.render(user_message=user_message)
+        template, prompt = prompts.render("reserve_restaurant.jinja2", user_message=user_message)
 
-        model_output = model_pipeline(
-            prompt, max_new_tokens=30, do_sample=False, temperature=0.1
-        )[0]["generated_text"]
-
-        logger.info(f"Raw Model Output: {model_output}")
-
-        try:
-            matches = re.findall(r"\{(?:[^{}]*|\"[^\"]*\"|\{(?:[^{}]*|\"[^\"]*\")*\})*\}", model_output)
-            if not matches:
-                raise ValueError("No JSON object found in model output.")
-
-            json_str = matches[-1].strip()
-            query_dict = json.loads(json_str)
-
-            return ReservationQuery(**query_dict)
-        except (json.JSONDecodeError, ValidationError) as e:
-            logger.error(
-                f"Failed to parse reservation details: {e}\nModel output: {model_output}"
-            )
-            return None
+        return generate_structured(
+            prompt, ReservationQuery, template=template, **EXTRACTION_KWARGS
+        )
 
-    def _load_reservations(self):
-        try:
-            with open(self.filename, "r") as file:
-                self.reservations = json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.reservations = []
+    @staticmethod
+    @traced("extraction")
+    async def aextract_reservation_details(user_message: str) -> Optional[ReservationQuery]:
+        template, prompt = prompts.render("reserve_restaurant.jinja2", user_message=user_message)
 
-    def _save_reservations(self):
-        with open(self.filename, "w") as file:
-            json.dump(self.reservations, file, indent=4)
+        return await agenerate_structured(
+            prompt, ReservationQuery, template=template, **EXTRACTION_KWARGS
+        )
 
-    def reserve_table(self, restaurant_name: str, num_people: int, date_time: str):
+    def reserve_table(self, restaurant: dict, num_people: int, date_time: str):
+        restaurant_name = restaurant["name"]
         try:
-            booking_time = datetime.strptime(date_time, "%Y-%m-%d %H:%M")
-
-            reservation = {
-                "restaurant": restaurant_name,
-                "num_people": num_people,
-                "date_time": booking_time.strftime("%Y-%m-%d %H:%M"),
-                "booking_id": len(self.reservations) + 1,
-            }
-
-            self.reservations.append(reservation)
-            self._save_reservations()
+            booking_time = datetime.strptime(date_time, DATE_FORMAT)
+
+            # Other processes book against the same store: under its lock,
+            # catch up with their bookings before checking
+            with self.capacity.lock, self.store.exclusive():
+                self.capacity.refresh(self.store)
+                if not self.capacity.is_available(
+                    restaurant["restaurant_id"], num_people, booking_time
+                ):
+                    message = f"Sorry, {restaurant_name} does not have {num_people} seats available on {date_time}."
+                    next_slot = self.capacity.next_available(
+                        restaurant["restaurant_id"], num_people, booking_time
+                    )
+                    if next_slot:
+                        message += f" The next available slot is {next_slot.strftime(DATE_FORMAT)}."
+                    return ReservationResponse(message=message)
+
+                reservation = self.store.add(
+                    restaurant_name, num_people, booking_time.strftime(DATE_FORMAT)
+                )
+                self.capacity.add(
+                    restaurant["restaurant_id"],
+                    num_people,
+                    booking_time,
+                    reservation["booking_id"],
+                )
+            logger.info("Stored booking %s at %s", reservation["booking_id"], restaurant_name)
 
             return ReservationResponse(
                 restaurant_name=restaurant_name,
@@ -91,9 +90,38 @@ class ReserveRestaurantService:
         except Exception as e:
             return ReservationResponse(message=f"Error: {str(e)}")
 
-    def process_request(self, user_message: str) -> ReservationResponse:
-        details = self.extract_reservation_details(user_message)
+    @staticmethod
+    def from_slots(slots: dict) -> Optional[ReservationQuery]:
+        try:
+            return ReservationQuery(
+                restaurant_name=slots.get("restaurant_name"),
+                num_people=slots.get("num_people"),
+                date_time=slots.get("date_time"),
+            )
+        except ValidationError as e:
+            logger.error("Invalid reservation slots: %s", e)
+            return None
 
+    def process_request(
+        self, user_message: str, slots: Optional[dict] = None
+    ) -> ReservationResponse:
+        if slots is not None:
+            details = self.from_slots(slots)
+        else:
+            details = self.extract_reservation_details(user_message)
+        return self.respond(details)
+
+    async def aprocess_request(
+        self, user_message: str, slots: Optional[dict] = None
+    ) -> ReservationResponse:
+        if slots is not None:
+            details = self.from_slots(slots)
+        else:
+            details = await self.aextract_reservation_details(user_message)
+        return await asyncio.to_thread(self.respond, details)
+
+    @traced("kb_lookup")
+    def respond(self, details: Optional[ReservationQuery]) -> ReservationResponse:
         if not details:
             return ReservationResponse(
                 message="Could not extract reservation details. Please provide restaurant name, number of people, and date-time."
@@ -104,7 +132,8 @@ class ReserveRestaurantService:
             details.restaurant_name = None
             missing_fields.append("restaurant name")
             logger.info("Reserve Restaurant missing restaurant name")
-        if not details.num_people:
+        # A zero or negative party size is asked for again like a missing one
+        if not details.num_people or details.num_people < 1:
             details.num_people = None
             missing_fields.append("number of people")
             logger.info("Reserve Restaurant missing number of people")
@@ -118,6 +147,12 @@ class ReserveRestaurantService:
                 message=f"Please provide the {', '.join(missing_fields)} to proceed with the reservation."
             )
 
+        restaurant = get_knowledge_base().resolve_restaurant(details.restaurant_name)
+        if restaurant is None:
+            return ReservationResponse(
+                message=get_knowledge_base().not_found_message(details.restaurant_name)
+            )
+
         try:
             booking_time = datetime.strptime(
                 details.date_time, "%Y-%m-%d %H:%M"
@@ -127,6 +162,4 @@ class ReserveRestaurantService:
                 message="Invalid date format. Please use YYYY-MM-DD HH:MM."
             )
 
-        return self.reserve_table(
-            details.restaurant_name, details.num_people, booking_time
-        )
+        return self.reserve_table(restaurant, details.num_people, booking_time)
@@ -1,13 +1,14 @@
-import json
-import re
-from jinja2 import Environment, FileSystemLoader
-from utils.knowledge_base import restaurant_kb
+import asyncio
+from utils.embedding_index import get_embedding_index
+from utils.knowledge_base import get_knowledge_base
 from utils.logging_utils import logger
-from pydantic import BaseModel
+from utils.tracing import traced
+from pydantic import BaseModel, ValidationError
 from typing import Optional, List
-from utils.model import model_pipeline
+from utils.model import agenerate_structured, generate_structured
+from utils.prompts import prompts
 
-env = Environment(loader=FileSystemLoader("templates"))
+EXTRACTION_KWARGS = {"max_new_tokens": 80, "do_sample": False, "temperature": 0.1}
 
 
 class SearchCriteria(BaseModel):
@@ -25,76 +26,101 @@ class SearchRestaurantResponse(BaseModel):
 
 class SearchRestaurantService:
 
-    @staticmethod
-    def extract_json(model_output: str):
-        try:
-            matches = re.findall(r"\{[\s\S]*?\}", model_output)
-            if not matches:
-                raise ValueError("No JSON object found in model output.")
-
-            json_str = matches[-1].strip()  # Take the last JSON block
-            return json.loads(json_str)  # Parse JSON
-
-        except Exception as e:
-            logger.error(
-                f"Failed to parse JSON from model output: {e}\nModel output: {model_output}"
-            )
-            return None
-
+    @traced("extraction")
     def extract_search_criteria(self, user_message: str) -> Optional[SearchCriteria]:
-        template = env.get_template("search_criteria.jinja2")
-        prompt = template.render(user_message=user_message)
+        template, prompt = prompts.render("search_criteria.jinja2", user_message=user_message)
         # logger.info(f"Extract Search Criteria Prompt:\n{prompt}")
 
-        model_output = model_pipeline(
-            prompt, max_new_tokens=50, do_sample=False, temperature=0.1
-        )[0]["generated_text"]
-        # logger.info(f"Raw search criteria output: {model_output}")
-
-        json_data = self.extract_json(model_output)
-        if json_data is None:
-            return None
+        criteria = generate_structured(
+            prompt, SearchCriteria, template=template, **EXTRACTION_KWARGS
+        )
+        if criteria is not None:
+            logger.info("Extracted Search Criteria: %s", criteria)
+        return criteria
+
+    @traced("extraction")
+    async def aextract_search_criteria(
+        self, user_message: str
+    ) -> Optional[SearchCriteria]:
+        template, prompt = prompts.render("search_criteria.jinja2", user_message=user_message)
+
+        criteria = await agenerate_structured(
+            prompt, SearchCriteria, template=template, **EXTRACTION_KWARGS
+        )
+        if criteria is not None:
+            logger.info("Extracted Search Criteria: %s", criteria)
+        return criteria
+
+    def filter_restaurants(
+        self, criteria: SearchCriteria, user_message: Optional[str] = None
+    ) -> List[dict]:
+        """Best matches for the message and criteria, ranked by embedding similarity.
+
+        Criteria the catalogue recognises are hard filters; the rest only
+        contribute to the query text.
+        """
+        index = get_embedding_index()
+        kb = get_knowledge_base()
+        fields = {
+            "cuisine": criteria.cuisine,
+            "location": criteria.location,
+            "ambience": criteria.ambience,
+            "food_choice": criteria.food_choice,
+            "price_range": criteria.price_range,
+        }
+        query = " ".join(filter(None, [user_message, *fields.values()]))
+        matches = index.search(query, mask=index.filter_mask(**fields))
+        logger.debug("Semantic search for %r: %s", query, matches)
+        return [kb.restaurant(restaurant_id) for restaurant_id, _ in matches]
 
+    @staticmethod
+    def from_slots(slots: dict) -> Optional[SearchCriteria]:
         try:
-            criteria = SearchCriteria(**json_data)
-            logger.info(f"Extracted Search Criteria: {criteria.json()}")
-            return criteria
-        except Exception as e:
-            logger.error(f"Failed to parse search criteria: {e}")
+            return SearchCriteria(
+                cuisine=slots.get("cuisine"),
+                location=slots.get("location"),
+                ambience=slots.get("ambience"),
+                food_choice=slots.get("food_choice"),
+                price_range=slots.get("price_range"),
+            )
+        except ValidationError as e:
+            logger.error("Invalid search criteria slots: %s", e)
             return None
 
-    def filter_restaurants(self, criteria: SearchCriteria) -> List[dict]:
-        results = []
-        for restaurant in restaurant_kb:
-            matched = False
-
-            if criteria.cuisine:
-                if criteria.cuisine.lower() in restaurant.get("cuisine", "").lower():
-                    matched = True
-
-            if criteria.location:
-                if criteria.location.lower() in restaurant.get("location", "").lower():
-                    matched = True
-
-            if criteria.ambience:
-                if criteria.ambience.lower() in restaurant.get("ambience", "").lower():
-                    matched = True
-
-            if matched:
-                results.append(restaurant)
-
-        return results
-
-    def process_request(self, user_message: str) -> SearchRestaurantResponse:
-
-        criteria = self.extract_search_criteria(user_message)
+    def process_request(
+        self, user_message: str, slots: Optional[dict] = None
+    ) -> SearchRestaurantResponse:
+        if slots is not None:
+            criteria = self.from_slots(slots)
+        else:
+            criteria = self.extract_search_criteria(user_message)
+        return self.respond(criteria, user_message)
+
+    async def aprocess_request(
+        self, user_message: str, slots: Optional[dict] = None
+    ) -> SearchRestaurantResponse:
+        if slots is not None:
+            criteria = self.from_slots(slots)
+        else:
+            criteria = await self.aextract_search_criteria(user_message)
+        return await asyncio.to_thread(self.respond, criteria, user_message)
+
+    @traced("kb_lookup")
+    def respond(
+        self, criteria: Optional[SearchCriteria], user_message: Optional[str] = None
+    ) -> SearchRestaurantResponse:
+        if criteria is None and user_message:
+            # The message alone is still a usable query
+            criteria = SearchCriteria(
+                cuisine=None, location=None, ambience=None, food_choice=None, price_range=None
+            )
         if criteria is None:
             return SearchRestaurantResponse(
                 restaurants=[],
                 message="Could not extract search criteria from your query.",
             )
 
-        results = self.filter_restaurants(criteria)
+        results = self.filter_restaurants(criteria, user_message)
         if not results:
             return SearchRestaurantResponse(
                 restaurants=[], message="Sorry, no restaurants match your criteria."
@@ -0,0 +1,108 @@
+import threading
+import time
+from concurrent.futures import Future
+from utils.logging_utils import logger
+
+
+def batch_key(generate_kwargs):
+    # Only prompts with identical generation settings can share a padded batch
+    return tuple(sorted((k, repr(v)) for k, v in generate_kwargs.items()))
+
+
+class _Batch:
+    def __init__(self, generate_kwargs, deadline):
+        self.generate_kwargs = generate_kwargs
+        self.deadline = deadline
+        self.prompts = []
+        self.futures = []
+
+
+class BatchScheduler:
+    """Groups concurrent prompts into batches for a single model worker thread.
+
+    A batch is dispatched once it holds max_batch_size prompts or its oldest
+    prompt has waited max_wait_ms, whichever comes first.
+    """
+
+    def __init__(self, generate_fn, max_batch_size=8, max_wait_ms=10):
+        self.generate_fn = generate_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._worker = None
+        self.batches_run = 0
+        self.prompts_run = 0
+
+    def submit(self, prompt, **generate_kwargs):
+        future = Future()
+        key = batch_key(generate_kwargs)
+        with self._condition:
+            self._ensure_worker()
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = _Batch(generate_kwargs, time.monotonic() + self.max_wait)
+                self._pending[key] = batch
+            batch.prompts.append(prompt)
+            batch.futures.append(future)
+            self._condition.notify()
+        return future
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(
+                target=self._run, name="model-batch-scheduler", daemon=True
+            )
+            self._worker.start()
+
+    def _next_batch(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                ready = None
+                next_deadline = None
+                for key, batch in self._pending.items():
+                    if len(batch.prompts) >= self.max_batch_size or batch.deadline <= now:
+                        if ready is None or batch.deadline < self._pending[ready].deadline:
+                            ready = key
+                    elif next_deadline is None or batch.deadline < next_deadline:
+                        next_deadline = batch.deadline
+
+                if ready is not None:
+                    batch = self._pending.pop(ready)
+                    if len(batch.prompts) > self.max_batch_size:
+                        # The overflow stays queued under the same deadline: its prompts
+                        # have waited as long, so it goes out on the next pass
+                        overflow = _Batch(batch.generate_kwargs, batch.deadline)
+                        overflow.prompts = batch.prompts[self.max_batch_size :]
+                        overflow.futures = batch.futures[self.max_batch_size :]
+                        self._pending[ready] = overflow
+                        batch.prompts = batch.prompts[: self.max_batch_size]
+                        batch.futures = batch.futures[: self.max_batch_size]
+                    return batch
+
+                timeout = None if next_deadline is None else max(next_deadline - now, 0)
+                self._condition.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                completions = self.generate_fn(batch.prompts, **batch.generate_kwargs)
+            except Exception as e:
+                logger.error("Batched generation failed for %s prompts: %s", len(batch.prompts), e)
+                for future in batch.futures:
+                    future.set_exception(e)
+                continue
+
+            self.batches_run += 1
+            self.prompts_run += len(batch.prompts)
+            for future, completion in zip(batch.futures, completions):
+                future.set_result(completion)
+            if len(completions) < len(batch.futures):
+                error = RuntimeError(
+                    f"Backend returned {len(completions)} completions for {len(batch.prompts)} prompts"
+                )
+                logger.error("Batched generation failed: %s", error)
+                for future in batch.futures[len(completions) :]:
+                    future.set_exception(error)
@@ -0,0 +1,164 @@
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from utils import config
+from utils.knowledge_base import get_knowledge_base
+from utils.logging_utils import logger
+from utils.reservation_store import get_reservation_store
+
+DATE_FORMAT = "%Y-%m-%d %H:%M"
+EPOCH = datetime(2000, 1, 1)
+
+
+def parse_date_time(date_time):
+    return datetime.strptime(date_time, DATE_FORMAT)
+
+
+def check_party_size(num_people):
+    # A non-positive count would free seats in the index instead of taking them
+    if num_people < 1:
+        raise ValueError(f"Party size must be at least 1, got {num_people}")
+
+
+class CapacityIndex:
+    """Seats booked per (restaurant_id, slot), kept up to date as bookings are made.
+
+    Time is cut into `slot_minutes` slots and a booking holds its table for
+    `duration_minutes`, so it counts against every slot its window overlaps: a
+    19:00 booking still occupies 20:00 with the default 90 minute duration.
+    """
+
+    def __init__(self, capacities, slot_minutes=None, duration_minutes=None):
+        self.capacities = dict(capacities)
+        self.slot_minutes = slot_minutes or config.SLOT_MINUTES
+        self.duration_minutes = duration_minutes or config.BOOKING_DURATION_MINUTES
+        self.booked = defaultdict(int)
+        self.booking_ids = set()
+        self.cursor = None
+        # Held by callers that check and then book, so two bookings can't both
+        # take the last seats
+        self.lock = threading.RLock()
+
+    @classmethod
+    def build(cls, knowledge_base, store):
+        index = cls(
+            {
+                restaurant["restaurant_id"]: restaurant.get("seating_capacity")
+                or config.DEFAULT_SEATING_CAPACITY
+                for restaurant in knowledge_base.all_restaurants()
+            }
+        )
+        index.refresh(store, knowledge_base)
+        return index
+
+    def refresh(self, store, knowledge_base=None):
+        """Index bookings added to `store` since the last refresh (by any process)."""
+        with self.lock:
+            reservations, self.cursor = store.read_since(self.cursor)
+            skipped = 0
+            for reservation in reservations:
+                booking_id = reservation.get("booking_id")
+                if booking_id in self.booking_ids:
+                    continue
+                if not self.add_reservation(reservation, knowledge_base):
+                    # Remembered so a re-read doesn't report it again
+                    self.booking_ids.add(booking_id)
+                    skipped += 1
+        if skipped:
+            logger.warning(
+                "Skipped %s reservations with an unknown restaurant, date or party size", skipped
+            )
+
+    def _minutes(self, when):
+        return int((when - EPOCH).total_seconds() // 60)
+
+    def slot_time(self, slot):
+        return EPOCH + timedelta(minutes=slot * self.slot_minutes)
+
+    def window(self, when):
+        minutes = self._minutes(when)
+        first = minutes // self.slot_minutes
+        last = -(-(minutes + self.duration_minutes) // self.slot_minutes)
+        return range(first, last)
+
+    def add(self, restaurant_id, num_people, when, booking_id=None):
+        check_party_size(num_people)
+        with self.lock:
+            if booking_id is not None:
+                if booking_id in self.booking_ids:
+                    return
+                self.booking_ids.add(booking_id)
+            for slot in self.window(when):
+                self.booked[(restaurant_id, slot)] += num_people
+
+    def add_reservation(self, reservation, knowledge_base=None):
+        knowledge_base = knowledge_base or get_knowledge_base()
+        restaurant_id = knowledge_base.restaurant_id(reservation["restaurant"])
+        try:
+            when = parse_date_time(reservation["date_time"])
+        except (TypeError, ValueError):
+            when = None
+        num_people = reservation.get("num_people")
+        if restaurant_id is None or when is None or not isinstance(num_people, int) or num_people < 1:
+            return False
+        self.add(restaurant_id, num_people, when, reservation.get("booking_id"))
+        return True
+
+    def free_seats(self, restaurant_id, when):
+        capacity = self.capacities.get(restaurant_id, 0)
+        booked = max(
+            self.booked.get((restaurant_id, slot), 0) for slot in self.window(when)
+        )
+        return capacity - booked
+
+    def is_available(self, restaurant_id, num_people, when):
+        check_party_size(num_people)
+        return self.free_seats(restaurant_id, when) >= num_people
+
+    def next_available(self, restaurant_id, num_people, after, until=None):
+        """Earliest slot start at or after `after` with room for num_people for a
+        whole booking, or None if there is none before `until` (default: end of day)."""
+        check_party_size(num_people)
+        if until is None:
+            until = after.replace(hour=23, minute=59)
+        capacity = self.capacities.get(restaurant_id, 0)
+        slots_per_booking = -(-self.duration_minutes // self.slot_minutes)
+        start = -(-self._minutes(after) // self.slot_minutes)
+        last = self._minutes(until) // self.slot_minutes
+        while start <= last:
+            for slot in range(start, start + slots_per_booking):
+                if self.booked.get((restaurant_id, slot), 0) + num_people > capacity:
+                    # No window containing this slot fits; restart past it
+                    start = slot + 1
+                    break
+            else:
+                return self.slot_time(start)
+        return None
+
+    def available_restaurants(self, num_people, when):
+        return [
+            restaurant_id
+            for restaurant_id in self.capacities
+            if self.is_available(restaurant_id, num_people, when)
+        ]
+
+
+_capacity_index = None
+_capacity_index_lock = threading.Lock()
+
+
+def get_capacity_index():
+    global _capacity_index
+    if _capacity_index is None:
+        with _capacity_index_lock:
+            if _capacity_index is None:
+                _capacity_index = CapacityIndex.build(
+                    get_knowledge_base(), get_reservation_store()
+                )
+    return _capacity_index
+
+
+def reset_capacity_index():
+    global _capacity_index
+    with _capacity_index_lock:
+        _capacity_index = None
@@ -0,0 +1,66 @@
+import json
+from http import HTTPStatus
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from utils.logging_utils import logger
+
+
+class ChatClient:
+    """Minimal client for server.py, used by app.py when CHAT_SERVER_URL is set.
+
+    Holds one conversation: the server session is opened on the first message,
+    and reopened when the server has expired it (SESSION_TTL_SECONDS).
+    """
+
+    def __init__(self, base_url, session_id=None, timeout=300):
+        self.base_url = base_url.rstrip("/")
+        self.session_id = session_id
+        self.timeout = timeout
+
+    def _request(self, method, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = Request(
+            self.base_url + path,
+            data=data,
+            method=method,
+            headers={"Content-Type": "application/json"},
+        )
+        return urlopen(request, timeout=self.timeout)
+
+    def create_session(self):
+        with self._request("POST", "/sessions") as response:
+            return json.load(response)["session_id"]
+
+    def _send(self, path, message):
+        if self.session_id is None:
+            self.session_id = self.create_session()
+        try:
+            return self._request("POST", path, {"session_id": self.session_id, "message": message})
+        except HTTPError as e:
+            if e.code != HTTPStatus.NOT_FOUND:
+                raise
+        # Expired on the server (its history is gone with it): retry once in a new session
+        logger.warning("Chat session %s expired; starting a new one", self.session_id)
+        self.session_id = self.create_session()
+        return self._request("POST", path, {"session_id": self.session_id, "message": message})
+
+    def chat(self, message):
+        with self._send("/chat", message) as response:
+            return json.load(response)["response"]
+
+    def stream(self, message):
+        """Yields the response text as the server decodes it."""
+        with self._send("/chat/stream", message) as response:
+            event = None
+            for line in response:
+                line = line.decode().rstrip("\n")
+                if line.startswith("event:"):
+                    event = line[len("event:") :].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:") :])
+                    if event == "error":
+                        raise RuntimeError(data["error"])
+                    if event is None:
+                        yield data["text"]
+                elif not line:
+                    event = None
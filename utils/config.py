@@ -0,0 +1,167 @@
+import os
+import tempfile
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# MODEL BACKEND
+# One of the names registered in utils.model.BACKENDS: "hf", "cpu_quantized", "scripted",
+# or "pool" to send generations to a model worker pool (see below)
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "hf")
+MODEL_ID = os.environ.get("MODEL_ID", "meta-llama/Llama-3.1-8B")
+MODEL_DTYPE = os.environ.get("MODEL_DTYPE", "bfloat16")
+MODEL_DEVICE_MAP = os.environ.get("MODEL_DEVICE_MAP", "auto")
+CPU_MODEL_ID = os.environ.get("CPU_MODEL_ID", MODEL_ID)
+MAX_NEW_TOKENS = int(os.environ.get("MAX_NEW_TOKENS", 256))
+# JSON file with [[pattern, reply], ...] rules for the scripted backend
+SCRIPTED_BACKEND_FILE = os.environ.get("SCRIPTED_BACKEND_FILE")
+
+# SPECULATIVE DECODING
+# Small draft model sharing MODEL_ID's tokenizer: it proposes tokens that the main model
+# verifies in one forward pass. Used by single-prompt calls passing speculative=True
+# (the final response); off when unset
+DRAFT_MODEL_ID = os.environ.get("DRAFT_MODEL_ID")
+# Tokens drafted per verification pass; "heuristic" grows/shrinks it with the acceptance rate
+SPECULATIVE_LOOKAHEAD = int(os.environ.get("SPECULATIVE_LOOKAHEAD", 5))
+SPECULATIVE_SCHEDULE = os.environ.get("SPECULATIVE_SCHEDULE", "heuristic")
+
+# MODEL WORKER POOL
+# `python -m utils.model_pool` loads MODEL_POOL_BACKEND once and forks MODEL_POOL_WORKERS
+# inference processes sharing its weights; front ends use it with MODEL_BACKEND=pool
+MODEL_POOL_ADDRESS = os.environ.get(
+    "MODEL_POOL_ADDRESS", os.path.join(tempfile.gettempdir(), "restaurant-agent-model.sock")
+)
+MODEL_POOL_AUTHKEY = os.environ.get("MODEL_POOL_AUTHKEY", "").encode() or None
+MODEL_POOL_BACKEND = os.environ.get("MODEL_POOL_BACKEND", "hf")
+MODEL_POOL_WORKERS = int(os.environ.get("MODEL_POOL_WORKERS", 2))
+# Torch threads per worker; the CPU cores divided among the workers when 0
+MODEL_POOL_THREADS = int(os.environ.get("MODEL_POOL_THREADS", 0))
+# One worker per device (e.g. "cuda:0,cuda:1"), each loading its own weights; when
+# unset the workers run on CPU and share the weights loaded before forking
+MODEL_POOL_DEVICES = [
+    device.strip() for device in os.environ.get("MODEL_POOL_DEVICES", "").split(",") if device.strip()
+]
+MODEL_POOL_HEALTH_CHECK_SECONDS = float(os.environ.get("MODEL_POOL_HEALTH_CHECK_SECONDS", 1.0))
+# A worker whose heartbeat is older than this is killed and restarted. Workers
+# beat while idle, when a request starts and after each streamed chunk, so this
+# is also the longest a generate request (a whole batch) or a chunk may take
+MODEL_POOL_HEARTBEAT_TIMEOUT = float(os.environ.get("MODEL_POOL_HEARTBEAT_TIMEOUT", 120.0))
+
+# MICRO-BATCHING
+# Concurrent model_pipeline calls with matching generation kwargs share one padded batch
+BATCHING_ENABLED = env_bool("BATCHING_ENABLED", True)
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 10))
+
+# INTENT CLASSIFICATION
+# Keyword scores at or above the threshold (and ahead of the runner-up by the margin) skip the LLM
+INTENT_RULE_THRESHOLD = float(os.environ.get("INTENT_RULE_THRESHOLD", 0.7))
+INTENT_RULE_MARGIN = float(os.environ.get("INTENT_RULE_MARGIN", 0.3))
+# One generation for intent + slots when the keyword rules can't decide, instead of classify then extract
+FUSED_EXTRACTION = env_bool("FUSED_EXTRACTION", True)
+
+# PROMPT TEMPLATES
+# Loaded and compiled once by utils.prompts; resolved from the package, not the working directory
+TEMPLATES_DIR = os.environ.get("TEMPLATES_DIR", os.path.join(PACKAGE_DIR, "templates"))
+
+# PREFIX KV CACHE
+# KV cache of each template's static instruction/few-shot prefix is computed once and reused
+PREFIX_CACHE_ENABLED = env_bool("PREFIX_CACHE_ENABLED", True)
+PREFIX_CACHE_MAX_ENTRIES = int(os.environ.get("PREFIX_CACHE_MAX_ENTRIES", 8))
+
+# GENERATION CACHE
+# Greedy (do_sample=False) generations are cached by (template, prompt hash, generation kwargs)
+GENERATION_CACHE_ENABLED = env_bool("GENERATION_CACHE_ENABLED", True)
+GENERATION_CACHE_MAX_ENTRIES = int(os.environ.get("GENERATION_CACHE_MAX_ENTRIES", 1024))
+GENERATION_CACHE_TTL_SECONDS = float(os.environ.get("GENERATION_CACHE_TTL_SECONDS", 86400))
+# SQLite file to persist the cache across restarts; in-memory only when unset
+GENERATION_CACHE_PATH = os.environ.get("GENERATION_CACHE_PATH")
+
+# FUZZY NAME MATCHING
+# Minimum similarity for a misspelt/partial restaurant or dish name to resolve on its own
+FUZZY_MATCH_THRESHOLD = float(os.environ.get("FUZZY_MATCH_THRESHOLD", 0.8))
+# ...and only when it beats every other restaurant by this much ("Tiffin Room" names two)
+FUZZY_MATCH_MARGIN = float(os.environ.get("FUZZY_MATCH_MARGIN", 0.05))
+# Minimum similarity for a name to be offered as a "did you mean" suggestion
+FUZZY_SUGGEST_THRESHOLD = float(os.environ.get("FUZZY_SUGGEST_THRESHOLD", 0.5))
+
+# KNOWLEDGE BASE
+KNOWLEDGE_BASE_DIR = os.environ.get(
+    "KNOWLEDGE_BASE_DIR", os.path.join(PACKAGE_DIR, "knowledge_base")
+)
+# "json" loads and indexes the JSON files in memory, "sqlite" queries KB_SQLITE_PATH
+# (imported from the JSON files on first use when missing)
+KB_STORAGE = os.environ.get("KB_STORAGE", "json")
+KB_SQLITE_PATH = os.environ.get(
+    "KB_SQLITE_PATH", os.path.join(KNOWLEDGE_BASE_DIR, "restaurant.db")
+)
+# How often the service registry stats the knowledge base files for changes
+KB_RELOAD_CHECK_SECONDS = float(os.environ.get("KB_RELOAD_CHECK_SECONDS", 2.0))
+# Dishes returned by a price lookup, cheapest (or most expensive) first
+PRICE_RESULTS_LIMIT = int(os.environ.get("PRICE_RESULTS_LIMIT", 5))
+
+# RESERVATIONS
+# JSON storage: snapshot file plus an append-only log folded into it once it
+# reaches RESERVATIONS_COMPACT_BYTES. SQLite storage uses KB_SQLITE_PATH.
+RESERVATIONS_PATH = os.environ.get(
+    "RESERVATIONS_PATH", os.path.join(KNOWLEDGE_BASE_DIR, "reservations.json")
+)
+RESERVATIONS_LOG_PATH = os.environ.get(
+    "RESERVATIONS_LOG_PATH", os.path.join(KNOWLEDGE_BASE_DIR, "reservations.jsonl")
+)
+RESERVATIONS_COMPACT_BYTES = int(os.environ.get("RESERVATIONS_COMPACT_BYTES", 1 << 20))
+
+# AVAILABILITY
+# A booking holds its table for BOOKING_DURATION_MINUTES, counted in SLOT_MINUTES slots
+SLOT_MINUTES = int(os.environ.get("SLOT_MINUTES", 15))
+BOOKING_DURATION_MINUTES = int(os.environ.get("BOOKING_DURATION_MINUTES", 90))
+# Used for restaurants without a seating_capacity
+DEFAULT_SEATING_CAPACITY = 10
+
+# CHAT SERVER
+CHAT_SERVER_HOST = os.environ.get("CHAT_SERVER_HOST", "127.0.0.1")
+CHAT_SERVER_PORT = int(os.environ.get("CHAT_SERVER_PORT", 8000))
+# When set (e.g. http://127.0.0.1:8000), app.py is a client of that server
+CHAT_SERVER_URL = os.environ.get("CHAT_SERVER_URL")
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 10000))
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", 3600))
+
+# OFFLINE BATCH RUNS
+# Conversations batch.py keeps in flight; their prompts fill the micro-batches above
+OFFLINE_CONCURRENCY = int(os.environ.get("OFFLINE_CONCURRENCY", 32))
+# Threads for knowledge base lookups and reservation I/O
+OFFLINE_TOOL_THREADS = int(os.environ.get("OFFLINE_TOOL_THREADS", 8))
+
+# CONVERSATION HISTORY
+# Tokens of history in the final-response prompt; older turns are summarized
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 512))
+HISTORY_SUMMARY_TOKENS = int(os.environ.get("HISTORY_SUMMARY_TOKENS", 128))
+HISTORY_SUMMARY_WORDS = int(os.environ.get("HISTORY_SUMMARY_WORDS", 12))
+
+# TRACING AND METRICS
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Per-turn spans (duration, model tokens, cache hits) feeding utils.metrics
+TRACING_ENABLED = env_bool("TRACING_ENABLED", True)
+# Finished turn traces kept in memory for the chat server's /traces endpoint
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", 100))
+# When set, app.py serves Prometheus metrics on this port (server.py has /metrics)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+
+# SEMANTIC SEARCH
+# Sentence-transformers model for restaurant profile embeddings; the built-in
+# hashing embedder (no extra dependencies) when unset
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL")
+EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIM", 256))
+# Rebuilt whenever the restaurant profiles or the embedder change
+EMBEDDING_INDEX_PATH = os.environ.get(
+    "EMBEDDING_INDEX_PATH", os.path.join(KNOWLEDGE_BASE_DIR, "restaurant_embeddings.npy")
+)
+SEMANTIC_TOP_K = int(os.environ.get("SEMANTIC_TOP_K", 5))
+SEMANTIC_MIN_SCORE = float(os.environ.get("SEMANTIC_MIN_SCORE", 0.1))
@@ -0,0 +1,366 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import zlib
+from collections import Counter, defaultdict
+import numpy as np
+from utils import config
+from utils.fuzzy_index import STOPWORDS, trigrams
+from utils.knowledge_base import get_knowledge_base, tokenize
+from utils.logging_utils import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent builds are not serialized
+    fcntl = None
+
+# Words that say nothing about which restaurant is meant
+QUERY_STOPWORDS = STOPWORDS | {
+    "i", "me", "my", "we", "us", "need", "want", "like", "something", "some",
+    "any", "place", "places", "restaurant", "restaurants", "food", "find",
+    "recommend", "suggest", "good", "best", "nice", "near", "nearby", "around",
+    "looking", "for", "to", "with", "where", "can", "get", "show", "please",
+    "is", "are", "there", "serves", "serving", "cuisine", "ambience", "dishes",
+}
+# Vague terms spelled out in generic food words, which is all the hashing
+# embedder can match on; menu categories among them are spelled out further
+# in the catalogue's own dish words (see catalogue_vocabulary)
+QUERY_SYNONYMS = {
+    "spicy": "chili chilli pepper masala",
+    "seafood": "fish prawn crab coastal",
+    "fish": "seafood prawn crab coastal",
+    "sweet": "dessert",
+    "drinks": "beverage bar",
+    "drink": "beverage bar",
+    "beer": "brewery bar",
+    "veg": "vegetarian",
+    "vegetarian": "veg",
+}
+# Dish words kept per menu category
+VOCABULARY_WORDS = 8
+# PRICE RANGE WORD -> (MIN, MAX) average dish price
+PRICE_LEVELS = {
+    "budget": (0, 200),
+    "cheap": (0, 200),
+    "affordable": (0, 200),
+    "inexpensive": (0, 200),
+    "moderate": (200, 400),
+    "mid": (200, 400),
+    "medium": (200, 400),
+    "expensive": (400, math.inf),
+    "premium": (400, math.inf),
+    "luxury": (400, math.inf),
+    "fine": (400, math.inf),
+    "high": (400, math.inf),
+}
+_PRICE_BELOW = re.compile(r"(?:under|below|less than|up ?to|within|<)\D*(\d+)")
+_PRICE_ABOVE = re.compile(r"(?:over|above|more than|>)\D*(\d+)")
+_PRICE_BETWEEN = re.compile(r"(\d+)\s*(?:-|to|and)\s*(\d+)")
+FIELD_MASK_CACHE_SIZE = 256
+NON_VEG_WORDS = {"non", "nonveg", "meat", "chicken", "mutton", "pork", "fish", "seafood"}
+
+
+def parse_price_range(price_range):
+    """(min, max) average dish price for a free-text price range, or None."""
+    if not price_range:
+        return None
+    text = price_range.casefold()
+    match = _PRICE_BETWEEN.search(text)
+    if match:
+        low, high = sorted(float(value) for value in match.groups())
+        return low, high
+    match = _PRICE_BELOW.search(text)
+    if match:
+        return 0, float(match.group(1))
+    match = _PRICE_ABOVE.search(text)
+    if match:
+        return float(match.group(1)), math.inf
+    for word in tokenize(text):
+        if word in PRICE_LEVELS:
+            return PRICE_LEVELS[word]
+    return None
+
+
+def parse_food_choice(food_choice):
+    """"veg", "non_veg" or None for a free-text food preference."""
+    if not food_choice:
+        return None
+    words = set(tokenize(food_choice.replace("-", " ")))
+    if words & NON_VEG_WORDS:
+        return "non_veg"
+    if words & {"veg", "vegetarian", "vegan", "veggie"}:
+        return "veg"
+    return None
+
+
+def restaurant_profile(restaurant, menu):
+    parts = [
+        restaurant.get("name", ""),
+        f"{restaurant.get('cuisine', '')} cuisine",
+        f"{restaurant.get('ambience', '')} ambience in {restaurant.get('location', '')}",
+    ]
+    if restaurant.get("is_veg"):
+        parts.append("pure veg vegetarian")
+    dish_names = [dish.get("dish_name", "") for dish in menu or []]
+    if dish_names:
+        parts.append("dishes: " + ", ".join(dish_names))
+    return ". ".join(parts)
+
+
+def catalogue_vocabulary(menus, words=VOCABULARY_WORDS):
+    """CATEGORY WORD -> the commonest dish-name words of that menu category, so
+    a query for "dessert" also finds menus that only name their desserts."""
+    counts = defaultdict(Counter)
+    for menu in menus:
+        for dish in menu or []:
+            category_words = set(tokenize(dish.get("category") or "")) - QUERY_STOPWORDS
+            for word in category_words:
+                counts[word].update(
+                    dish_word
+                    for dish_word in tokenize(dish.get("dish_name") or "")
+                    if dish_word not in QUERY_STOPWORDS and dish_word not in category_words
+                )
+    return {
+        word: " ".join(dish_word for dish_word, _ in dish_words.most_common(words))
+        for word, dish_words in counts.items()
+    }
+
+
+class HashingEmbedder:
+    """Signed feature hashing of words and their character trigrams, L2-normalized.
+
+    crc32 (unlike hash()) is stable across processes, so stored matrices stay
+    valid. Trigrams let "pizzas" still match "pizza".
+    """
+
+    trigram_weight = 0.3
+
+    def __init__(self, dim=None):
+        self.dim = dim or config.EMBEDDING_DIM
+        self.name = f"hashing-{self.dim}"
+
+    def _features(self, text):
+        for word in tokenize(text):
+            if word in QUERY_STOPWORDS:
+                continue
+            yield word, 1.0
+            for gram in trigrams(word):
+                yield "#" + gram, self.trigram_weight
+
+    def embed(self, texts):
+        rows, columns, values = [], [], []
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                hashed = zlib.crc32(feature.encode())
+                rows.append(row)
+                columns.append(hashed % self.dim)
+                values.append(-weight if hashed & 0x80000000 else weight)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (rows, columns), values)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def embed_query(self, text, vocabulary=None):
+        """Embeds text with its vague terms spelled out; `vocabulary` (from
+        catalogue_vocabulary) adds the dish words of menu categories."""
+        words = []
+        for word in tokenize(text):
+            if word in QUERY_STOPWORDS:
+                continue
+            for term in [word, *QUERY_SYNONYMS.get(word, "").split()]:
+                words.append(term)
+                if vocabulary:
+                    # "desserts" as well as "dessert"
+                    words.append(vocabulary.get(term) or vocabulary.get(term.rstrip("s"), ""))
+        return self.embed([" ".join(words)])[0]
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.name = f"sentence-transformers:{model_name}"
+
+    def embed(self, texts):
+        return self.model.encode(
+            list(texts), normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+
+    def embed_query(self, text, vocabulary=None):
+        # Learned embeddings need no spelled-out vocabulary
+        return self.embed([text])[0]
+
+
+def create_embedder():
+    if config.EMBEDDING_MODEL:
+        return SentenceTransformerEmbedder(config.EMBEDDING_MODEL)
+    return HashingEmbedder()
+
+
+class EmbeddingIndex:
+    """Restaurant profile embeddings (name, cuisine, ambience, location, dish
+    names) as one contiguous float32 matrix memory-mapped from `path`.
+
+    A query is embedded once and scored against every restaurant with a
+    single vector-matrix product; hard filters mask the scores before the
+    top-k partition. The matrix is stored dimension-major (dim x restaurants),
+    so a sparse query (the hashing embedder's) only reads its own rows.
+    """
+
+    def __init__(self, kb, embedder, path=None):
+        self.kb = kb
+        self.embedder = embedder
+        self.path = path or config.EMBEDDING_INDEX_PATH
+
+        restaurants = kb.all_restaurants()
+        menus = {items["restaurant_id"]: items.get("menu", []) for items in kb.all_menus()}
+        self.restaurant_ids = [restaurant["restaurant_id"] for restaurant in restaurants]
+        self.position_by_id = {rid: position for position, rid in enumerate(self.restaurant_ids)}
+        profiles = [
+            restaurant_profile(restaurant, menus.get(restaurant["restaurant_id"]))
+            for restaurant in restaurants
+        ]
+        self.vocabulary = catalogue_vocabulary(menus.values())
+
+        # Filter columns
+        self.is_veg = np.array([bool(r.get("is_veg")) for r in restaurants], dtype=bool)
+        self.has_veg = self.is_veg.copy()
+        self.has_non_veg = np.zeros(len(restaurants), dtype=bool)
+        self.average_price = np.full(len(restaurants), np.nan, dtype=np.float32)
+        for position, restaurant_id in enumerate(self.restaurant_ids):
+            menu = menus.get(restaurant_id) or []
+            prices = [dish["price"] for dish in menu if dish.get("price") is not None]
+            if prices:
+                self.average_price[position] = sum(prices) / len(prices)
+            self.has_veg[position] |= any(dish.get("is_veg") for dish in menu)
+            self.has_non_veg[position] = any(not dish.get("is_veg", True) for dish in menu)
+
+        self.matrix = self._load_or_build(profiles)
+        self._field_masks = {}
+
+    def _fingerprint(self, profiles):
+        digest = hashlib.sha1(f"{self.embedder.name}\x00dim-major".encode())
+        for restaurant_id, profile in zip(self.restaurant_ids, profiles):
+            digest.update(f"{restaurant_id}\x00{profile}\x00".encode())
+        return digest.hexdigest()
+
+    def _load_or_build(self, profiles):
+        fingerprint = self._fingerprint(profiles)
+        meta_path = self.path + ".json"
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # The matrix and its metadata are two files; the lock keeps another
+        # process (e.g. one with changed profiles) from pairing either with
+        # the other's between the check and the load
+        with open(self.path + ".lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(meta_path, "r") as f:
+                        stored = json.load(f).get("fingerprint")
+                    if stored == fingerprint:
+                        return np.load(self.path, mmap_mode="r")
+                except (OSError, ValueError):
+                    pass
+
+                logger.info("Embedding %s restaurant profiles with %s", len(profiles), self.embedder.name)
+                matrix = np.ascontiguousarray(self.embedder.embed(profiles).T, dtype=np.float32)
+                # Written aside and renamed, so readers never map a partial file
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    np.save(f, matrix)
+                os.replace(tmp_path, self.path)
+                tmp_meta_path = f"{meta_path}.{os.getpid()}.tmp"
+                with open(tmp_meta_path, "w") as f:
+                    json.dump({"fingerprint": fingerprint, "embedder": self.embedder.name}, f)
+                os.replace(tmp_meta_path, meta_path)
+                return np.load(self.path, mmap_mode="r")
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __len__(self):
+        return len(self.restaurant_ids)
+
+    def _field_mask(self, field, value):
+        # Only a value the catalogue knows is a hard filter; anything else
+        # ("cosy", "near me") is left to the embedding
+        key = (field, value.casefold())
+        if key not in self._field_masks:
+            matches = self.kb.search_restaurants(**{field: value})
+            mask = None
+            if matches:
+                mask = np.zeros(len(self), dtype=bool)
+                mask[[self.position_by_id[r["restaurant_id"]] for r in matches]] = True
+            if len(self._field_masks) >= FIELD_MASK_CACHE_SIZE:
+                self._field_masks.clear()
+            self._field_masks[key] = mask
+        return self._field_masks[key]
+
+    def filter_mask(self, cuisine=None, location=None, ambience=None, food_choice=None, price_range=None):
+        masks = [
+            self._field_mask(field, value)
+            for field, value in (("cuisine", cuisine), ("location", location), ("ambience", ambience))
+            if value
+        ]
+        choice = parse_food_choice(food_choice)
+        if choice == "veg":
+            masks.append(self.has_veg)
+        elif choice == "non_veg":
+            masks.append(self.has_non_veg)
+        price = parse_price_range(price_range)
+        if price is not None:
+            low, high = price
+            masks.append((self.average_price >= low) & (self.average_price <= high))
+
+        masks = [mask for mask in masks if mask is not None]
+        if not masks:
+            return None
+        return np.logical_and.reduce(masks)
+
+    def search(self, query, k=None, min_score=None, mask=None):
+        """[(restaurant_id, score)] of the k best-scoring restaurants, best first."""
+        k = min(k or config.SEMANTIC_TOP_K, len(self))
+        min_score = config.SEMANTIC_MIN_SCORE if min_score is None else min_score
+        if k == 0:
+            return []
+        vector = self.embedder.embed_query(query, self.vocabulary)
+        dims = np.flatnonzero(vector)
+        if len(dims) * 2 < len(vector):
+            scores = vector[dims] @ self.matrix[dims]
+        else:
+            scores = vector @ self.matrix
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (self.restaurant_ids[position], float(scores[position]))
+            for position in top
+            if scores[position] >= min_score
+        ]
+
+
+_embedding_index = None
+_embedding_index_lock = threading.Lock()
+
+
+def get_embedding_index():
+    """The process-wide index over the current knowledge base, built or mapped on first use."""
+    global _embedding_index
+    if _embedding_index is None:
+        with _embedding_index_lock:
+            if _embedding_index is None:
+                _embedding_index = EmbeddingIndex(get_knowledge_base(), create_embedder())
+    return _embedding_index
+
+
+def reset_embedding_index():
+    global _embedding_index
+    with _embedding_index_lock:
+        _embedding_index = None
@@ -0,0 +1,159 @@
+import math
+import re
+import numpy as np
+from collections import defaultdict
+from difflib import SequenceMatcher
+from typing import NamedTuple
+
+STOPWORDS = {"the", "a", "an", "and", "of", "at", "in"}
+_NON_WORD = re.compile(r"[^\w\s]")
+
+
+def normalize(name):
+    """Case-, punctuation- and article-insensitive form used for matching."""
+    text = _NON_WORD.sub(" ", name.casefold().replace("&", " and "))
+    return " ".join(word for word in text.split() if word not in STOPWORDS)
+
+
+def trigrams(text):
+    padded = f" {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyMatch(NamedTuple):
+    value: object
+    name: str
+    score: float
+
+
+class FuzzyIndex:
+    """Trigram index returning ranked approximate matches for short names.
+
+    Candidates come from the postings of the query's rarest trigrams (prefix
+    filtering: any entry reaching `candidate_threshold` Dice similarity must
+    share one of them), capped at `candidate_budget` postings so frequent
+    trigrams from words like "cafe" or "house" don't flood the candidate set.
+    Overlap with the remaining trigrams comes from one per-entry tally of their
+    postings, and the best candidates are re-ranked by edit similarity, with
+    SequenceMatcher's cheap upper bounds skipping those that can't reach
+    `min_score`.
+    """
+
+    def __init__(self, candidate_threshold=0.3, shortlist_size=20, candidate_budget=4096):
+        self.candidate_threshold = candidate_threshold
+        self.shortlist_size = shortlist_size
+        self.candidate_budget = candidate_budget
+        self.names = []
+        self.values = []
+        self.normalized = []
+        self.exact = defaultdict(list)
+        self.postings = defaultdict(list)
+        self._gram_counts = []
+        self._arrays = None
+
+    def add(self, name, value):
+        entry = len(self.names)
+        normalized = normalize(name)
+        grams = trigrams(normalized)
+        self.names.append(name)
+        self.values.append(value)
+        self.normalized.append(normalized)
+        self.exact[normalized].append(entry)
+        self._gram_counts.append(len(grams))
+        for gram in grams:
+            self.postings[gram].append(entry)
+        self._arrays = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def _posting_arrays(self):
+        # Frozen lazily so bulk loading stays append-only; entries are appended
+        # in increasing order, so every posting array is sorted
+        if self._arrays is None:
+            self._arrays = (
+                {
+                    gram: np.array(entries, dtype=np.int32)
+                    for gram, entries in self.postings.items()
+                },
+                np.array(self._gram_counts, dtype=np.float32),
+            )
+        return self._arrays
+
+    def _shortlist(self, query_grams):
+        postings, gram_counts = self._posting_arrays()
+        ranked = sorted(
+            (postings[gram] for gram in query_grams if gram in postings), key=len
+        )
+        if not ranked:
+            return []
+
+        t = self.candidate_threshold
+        needed = max(1, math.ceil(t * len(query_grams) / (2 - t)))
+        probe = [ranked[0]]
+        size = len(ranked[0])
+        for posting in ranked[1 : len(ranked) - needed + 1]:
+            if size + len(posting) > self.candidate_budget:
+                break
+            probe.append(posting)
+            size += len(posting)
+
+        # Overlap with the probed postings is how often a candidate occurs in
+        # them; the other postings are tallied per entry and looked up once
+        candidates, overlap = np.unique(np.concatenate(probe), return_counts=True)
+        rest = ranked[len(probe) :]
+        if rest:
+            tally = np.zeros(len(self.names), dtype=np.uint16)
+            for posting in rest:
+                tally[posting] += 1
+            overlap += tally[candidates]
+
+        dice = 2 * overlap / (len(query_grams) + gram_counts[candidates])
+        keep = min(self.shortlist_size, len(candidates))
+        top = np.argpartition(-dice, keep - 1)[:keep]
+        # Short queries naming a longer entry ("CTR") score low on Dice but are
+        # recovered by the word-containment check when re-ranking
+        return [int(candidates[i]) for i in top]
+
+    def _score(self, matcher, query_tokens, entry, min_score):
+        """Edit similarity of the entry to the query in `matcher` (its seq1), or
+        0.0 when it can't reach min_score."""
+        candidate = self.normalized[entry]
+        matcher.set_seq2(candidate)
+        # "CTR" names "CTR (Central Tiffin Room)": every query word present
+        if query_tokens and query_tokens <= set(candidate.split()):
+            return max(matcher.ratio(), 0.85)
+        # Cheap upper bounds first; most shortlisted entries stop here
+        if matcher.real_quick_ratio() < min_score or matcher.quick_ratio() < min_score:
+            return 0.0
+        return matcher.ratio()
+
+    def search(self, name, limit=5, min_score=0.0):
+        query = normalize(name)
+        if not query:
+            return []
+
+        exact = self.exact.get(query)
+        if exact:
+            return [FuzzyMatch(self.values[e], self.names[e], 1.0) for e in exact[:limit]]
+
+        query_tokens = set(query.split())
+        matcher = SequenceMatcher(None, query, "")
+        matches = []
+        for entry in self._shortlist(trigrams(query)):
+            score = self._score(matcher, query_tokens, entry, min_score)
+            if score >= min_score:
+                matches.append(FuzzyMatch(self.values[entry], self.names[entry], score))
+        matches.sort(key=lambda match: match.score, reverse=True)
+        return matches[:limit]
+
+    def best(self, name, min_score, margin=0.0):
+        """The top match, or None when an entry with another value scores within margin of it."""
+        matches = self.search(name, limit=self.shortlist_size, min_score=min_score - margin)
+        if not matches or matches[0].score < min_score:
+            return None
+        top = matches[0]
+        for match in matches[1:]:
+            if match.value != top.value:
+                return top if top.score - match.score >= margin else None
+        return top
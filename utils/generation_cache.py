@@ -0,0 +1,123 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from utils.logging_utils import logger
+
+
+class GenerationCache:
+    """LRU + TTL cache of deterministic completions, optionally persisted to SQLite.
+
+    The in-memory LRU holds at most max_entries completions. With a path, every
+    completion is also written through to disk, so a restarted process serves
+    earlier prompts from the file and warms the LRU as it goes. Disk writes
+    happen on a background thread, not on the caller's (the model's) thread.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=86400, path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._writer = None
+        if path:
+            self._open(path)
+
+    @staticmethod
+    def make_key(model, template_name, prompt, generate_kwargs):
+        """`model` names the backend and model (ModelBackend.identity), so a
+        persisted cache never serves another model's completions."""
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        kwargs = json.dumps(generate_kwargs, sort_keys=True, default=repr)
+        return f"{model}:{template_name}:{prompt_hash}:{kwargs}"
+
+    def _open(self, path):
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="generation-cache-writer")
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS generations "
+            "(key TEXT PRIMARY KEY, completion TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "DELETE FROM generations WHERE created_at < ?",
+            (time.time() - self.ttl_seconds,),
+        )
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT key, completion, created_at FROM generations "
+            "ORDER BY created_at DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        for key, completion, created_at in reversed(rows):
+            self._entries[key] = (created_at, completion)
+        logger.info("Generation cache warmed with %s entries from %s", len(rows), path)
+
+    def _expired(self, created_at):
+        return time.time() - created_at > self.ttl_seconds
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                entry = self._db.execute(
+                    "SELECT created_at, completion FROM generations WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if entry is not None:
+                    self._remember(key, tuple(entry))
+
+            if entry is None or self._expired(entry[0]):
+                if entry is not None:
+                    self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, completion):
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, (created_at, completion))
+        if self._db is not None:
+            self._writer.submit(self._write, key, completion, created_at)
+
+    def _write(self, key, completion, created_at):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO generations (key, completion, created_at) "
+                "VALUES (?, ?, ?)",
+                (key, completion, created_at),
+            )
+            self._db.commit()
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM generations")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
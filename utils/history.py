@@ -0,0 +1,154 @@
+from collections import deque
+from utils import config
+
+# Tool result fields remembered across turns, and how they are shown to the model
+SLOT_LABELS = {
+    "restaurant_name": "restaurant",
+    "num_people": "party size",
+    "date_time": "time",
+    "dish_name": "dish",
+}
+# num_people is 0 when the party size is unknown
+UNKNOWN_VALUES = {None, "", "Unknown", "Any", 0}
+
+
+def format_message(message):
+    return f"{message['role'].capitalize()}: {message['content']}"
+
+
+def default_count_tokens(text):
+    from utils.model import get_backend
+
+    return get_backend().count_tokens(text)
+
+
+class ConversationMemory:
+    """Conversation context for the final-response prompt, held under a token budget.
+
+    Recent messages are kept verbatim. When they no longer fit in
+    `token_budget`, the oldest are folded into a running summary (their first
+    `summary_words` words, no model call) capped at `summary_budget` tokens,
+    and the restaurant, party size, time and dish from tool results are kept
+    as slot memory. When the last `min_recent_messages` alone don't fit, the
+    summary is dropped and the oldest of them is cut short. Each message is
+    tokenized once, when it is added, so the cost of a turn doesn't grow with
+    the length of the conversation.
+    """
+
+    def __init__(
+        self,
+        token_budget=None,
+        summary_budget=None,
+        summary_words=None,
+        min_recent_messages=2,
+        count_tokens=None,
+    ):
+        self.token_budget = token_budget or config.HISTORY_TOKEN_BUDGET
+        self.summary_budget = summary_budget or config.HISTORY_SUMMARY_TOKENS
+        self.summary_words = summary_words or config.HISTORY_SUMMARY_WORDS
+        self.min_recent_messages = min_recent_messages
+        self.count_tokens = count_tokens or default_count_tokens
+        self.recent = deque()  # (message, tokens)
+        self.recent_tokens = 0
+        self.summary = deque()  # (line, tokens)
+        self.summary_tokens = 0
+        self.slots = {}
+        self.slot_tokens = 0
+
+    @classmethod
+    def from_messages(cls, messages, **kwargs):
+        memory = cls(**kwargs)
+        for message in messages:
+            memory.add(message["role"], message["content"])
+        return memory
+
+    def add(self, role, content):
+        message = {"role": role, "content": content}
+        tokens = self.count_tokens(format_message(message))
+        self.recent.append((message, tokens))
+        self.recent_tokens += tokens
+        self._compact()
+
+    def add_turn(self, user_message, response, tool_result=None):
+        self.update_slots(tool_result)
+        self.add("user", user_message)
+        self.add("assistant", response)
+
+    def update_slots(self, tool_result):
+        if tool_result is None:
+            return
+        fields = tool_result if isinstance(tool_result, dict) else vars(tool_result)
+        changed = False
+        for field in SLOT_LABELS:
+            value = fields.get(field)
+            if value not in UNKNOWN_VALUES and self.slots.get(field) != value:
+                self.slots[field] = value
+                changed = True
+        if changed:
+            self.slot_tokens = self.count_tokens(self._slot_line())
+            self._compact()
+
+    def _slot_line(self):
+        details = "; ".join(
+            f"{SLOT_LABELS[field]}: {value}" for field, value in self.slots.items()
+        )
+        return f"Known details: {details}"
+
+    def _excess_tokens(self):
+        return self.recent_tokens + self.summary_tokens + self.slot_tokens - self.token_budget
+
+    def _compact(self):
+        while len(self.recent) > self.min_recent_messages and self._excess_tokens() > 0:
+            message, tokens = self.recent.popleft()
+            self.recent_tokens -= tokens
+            self._summarize(message)
+        # The messages always kept verbatim are over budget on their own: drop
+        # the summary, then cut the oldest of them short
+        while self.summary and self._excess_tokens() > 0:
+            _, dropped = self.summary.popleft()
+            self.summary_tokens -= dropped
+        for position in range(len(self.recent)):
+            if self._excess_tokens() <= 0:
+                break
+            self._truncate(position, self._excess_tokens())
+
+    def _truncate(self, position, excess):
+        message, tokens = self.recent[position]
+        original_tokens = tokens
+        words = message["content"].split()
+        while excess > 0 and words:
+            keep = min(len(words) - 1, len(words) * max(tokens - excess, 0) // max(tokens, 1))
+            words = words[:keep]
+            message = {"role": message["role"], "content": " ".join(words + ["..."])}
+            shortened = self.count_tokens(format_message(message))
+            excess -= tokens - shortened
+            tokens = shortened
+        self.recent[position] = (message, tokens)
+        self.recent_tokens += tokens - original_tokens
+
+    def _summarize(self, message):
+        words = message["content"].split()
+        content = " ".join(words[: self.summary_words])
+        if len(words) > self.summary_words:
+            content += " ..."
+        line = f"- {format_message({'role': message['role'], 'content': content})}"
+        tokens = self.count_tokens(line)
+        self.summary.append((line, tokens))
+        self.summary_tokens += tokens
+        while self.summary and self.summary_tokens > self.summary_budget:
+            _, dropped = self.summary.popleft()
+            self.summary_tokens -= dropped
+
+    @property
+    def messages(self):
+        return [message for message, _ in self.recent]
+
+    def render(self):
+        lines = []
+        if self.summary:
+            lines.append("Earlier in the conversation:")
+            lines.extend(line for line, _ in self.summary)
+        if self.slots:
+            lines.append(self._slot_line())
+        lines.extend(format_message(message) for message in self.messages)
+        return "\n".join(lines)
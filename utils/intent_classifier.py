@@ -0,0 +1,126 @@
+import re
+import threading
+from collections import Counter
+from utils import config
+from utils.logging_utils import logger
+from utils.metrics import registry
+
+INTENT_TIERS = registry.counter(
+    "agent_intent_tier_total", "Intent classifications by the tier that answered them", ["tier"]
+)
+
+# INTENT -> [(PATTERN, WEIGHT)], mirroring the keyword rules of classify_intent.jinja2
+INTENT_RULES = {
+    "reserve_restaurant": [
+        (r"\bbook(ing)?\b", 0.7),
+        (r"\breserv(e|ation|ations)\b", 0.8),
+        (r"\btable for (\d+|one|two|three|four|five|six|seven|eight|nine|ten)\b", 0.3),
+    ],
+    "check_availability": [
+        (r"\bavailab(le|ility)\b", 0.8),
+        (r"\bis there (a |any )?(table|space|room|seats?)\b", 0.5),
+        (r"\bfree (table|seats?)\b", 0.5),
+    ],
+    "fetch_menu": [
+        (r"\bmenu\b", 0.8),
+        (r"\bwhat does .+ (serve|have)\b", 0.5),
+    ],
+    "fetch_price": [
+        (r"\bhow much\b", 0.8),
+        (r"\b(price|cost|rate) of\b", 0.8),
+        (r"\b(price|prices|cost|costs)\b", 0.5),
+        (r"\b(cheapest|priciest|most expensive)\b", 0.4),
+    ],
+    "search_restaurant": [
+        (r"\brecommend(ation|ations)?\b", 0.8),
+        (r"\b(find|search|suggest)\b", 0.7),
+        (r"\blooking for\b", 0.6),
+        (r"\b(places?|restaurants?) (near|in|around)\b", 0.5),
+    ],
+}
+
+
+class IntentClassifier:
+    """Keyword/regex scoring tier with the LLM as fallback for ambiguous messages.
+
+    Each matching rule adds evidence for its intent (noisy-OR of the rule
+    weights). A message is resolved by the rules tier when the best intent
+    scores at least `threshold` and beats the runner-up by `margin`.
+    """
+
+    def __init__(
+        self,
+        model_fallback,
+        rules=None,
+        threshold=None,
+        margin=None,
+        async_model_fallback=None,
+    ):
+        self.model_fallback = model_fallback
+        self.async_model_fallback = async_model_fallback
+        self.threshold = config.INTENT_RULE_THRESHOLD if threshold is None else threshold
+        self.margin = config.INTENT_RULE_MARGIN if margin is None else margin
+        self.rules = {
+            intent: [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in patterns]
+            for intent, patterns in (rules or INTENT_RULES).items()
+        }
+        self.tier_hits = Counter()
+        self._lock = threading.Lock()
+
+    def score(self, user_message):
+        scores = {}
+        for intent, patterns in self.rules.items():
+            miss = 1.0
+            for pattern, weight in patterns:
+                if pattern.search(user_message):
+                    miss *= 1.0 - weight
+            if miss < 1.0:
+                scores[intent] = 1.0 - miss
+        return scores
+
+    def classify_by_rules(self, user_message):
+        scores = self.score(user_message)
+        if not scores:
+            return None
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        intent, best = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        if best >= self.threshold and best - runner_up >= self.margin:
+            return intent
+        return None
+
+    def rules_tier(self, user_message):
+        """classify_by_rules, counting the message towards the tier that answers it."""
+        intent = self.classify_by_rules(user_message)
+        if intent is not None:
+            self.record("rules")
+            logger.info("Rule Intent: %s", intent)
+        else:
+            self.record("model")
+        return intent
+
+    def classify(self, user_message):
+        intent = self.rules_tier(user_message)
+        if intent is not None:
+            return intent
+        return self.model_fallback(user_message)
+
+    async def aclassify(self, user_message):
+        intent = self.rules_tier(user_message)
+        if intent is not None:
+            return intent
+        return await self.async_model_fallback(user_message)
+
+    def record(self, tier):
+        with self._lock:
+            self.tier_hits[tier] += 1
+        INTENT_TIERS.inc(tier=tier)
+
+    def hit_rates(self):
+        with self._lock:
+            total = sum(self.tier_hits.values())
+            return {
+                tier: (self.tier_hits[tier] / total if total else 0.0)
+                for tier in ("rules", "model")
+            }
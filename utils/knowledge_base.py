@@ -1,21 +1,190 @@
 import json
+import os
+import re
+import threading
+from collections import defaultdict
+from utils import config
+from utils.fuzzy_index import FuzzyIndex
 
+TOKEN_PATTERN = re.compile(r"\w+")
+SEARCH_FIELDS = ("cuisine", "location", "ambience")
 
-def load_restaurant_kb():
-    with open("knowledge_base/restaurant_db.json", "r") as f:
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.casefold())
+
+
+def read_json(filename):
+    with open(os.path.join(config.KNOWLEDGE_BASE_DIR, filename), "r") as f:
         return json.load(f)
 
 
+def load_restaurant_kb():
+    if config.KB_STORAGE == "sqlite":
+        return get_knowledge_base().all_restaurants()
+    return read_json("restaurant_db.json")
+
+
 def load_menu_kb():
-    with open("knowledge_base/menu.json", "r") as f:
-        return json.load(f)
+    if config.KB_STORAGE == "sqlite":
+        return get_knowledge_base().all_menus()
+    return read_json("menu.json")
 
 
 def load_reservation_kb():
-    with open("knowledge_base/reservations.json", "r") as f:
-        return json.load(f)
+    from utils.reservation_store import get_reservation_store
+
+    return get_reservation_store().all()
+
+
+class KnowledgeBase:
+    """Restaurant and menu data with lookup indexes built once at load time."""
+
+    def __init__(self, restaurants, menus):
+        self.restaurants = restaurants
+        self.menus = menus
+        self._build_indexes()
+
+    @classmethod
+    def load(cls):
+        return cls(read_json("restaurant_db.json"), read_json("menu.json"))
+
+    def all_restaurants(self):
+        return self.restaurants
+
+    def all_menus(self):
+        return self.menus
+
+    def _build_indexes(self):
+        self.restaurant_by_id = {}
+        self.position_by_id = {}
+        self.id_by_name = {}
+        self.name_index = FuzzyIndex()
+        # FIELD -> TOKEN -> RESTAURANT IDS
+        self.field_index = {field: defaultdict(set) for field in SEARCH_FIELDS}
+        for position, restaurant in enumerate(self.restaurants):
+            restaurant_id = restaurant["restaurant_id"]
+            self.restaurant_by_id[restaurant_id] = restaurant
+            self.position_by_id[restaurant_id] = position
+            self.id_by_name[restaurant["name"].casefold()] = restaurant_id
+            self.name_index.add(restaurant["name"], restaurant_id)
+            for field in SEARCH_FIELDS:
+                for token in tokenize(restaurant.get(field, "")):
+                    self.field_index[field][token].add(restaurant_id)
+
+        # Dish lookups are served by utils.menu_store
+        self.menu_by_id = {items["restaurant_id"]: items["menu"] for items in self.menus}
+
+    @staticmethod
+    def _lookup_all(index, tokens):
+        # Entries carrying every token: intersect postings, smallest first
+        postings = sorted((index.get(token, set()) for token in tokens), key=len)
+        if not postings:
+            return set()
+        matches = set(postings[0])
+        for posting in postings[1:]:
+            matches &= posting
+            if not matches:
+                break
+        return matches
+
+    def match_restaurants(self, restaurant_name, limit=5, min_score=0.0):
+        """Ranked FuzzyMatch(value=restaurant_id, name, score) candidates."""
+        return self.name_index.search(restaurant_name, limit=limit, min_score=min_score)
+
+    def restaurant_id(self, restaurant_name):
+        restaurant_id = self.id_by_name.get(restaurant_name.casefold())
+        if restaurant_id is None:
+            restaurant_id = self._closest_restaurant_id(restaurant_name)
+        return restaurant_id
+
+    def _closest_restaurant_id(self, restaurant_name):
+        # Ambiguous names resolve to nothing, so not_found_message offers the candidates
+        match = self.name_index.best(
+            restaurant_name, config.FUZZY_MATCH_THRESHOLD, config.FUZZY_MATCH_MARGIN
+        )
+        return match.value if match else None
+
+    def restaurant(self, restaurant_id):
+        return self.restaurant_by_id.get(restaurant_id)
+
+    def resolve_restaurant(self, restaurant_name):
+        restaurant_id = self.restaurant_id(restaurant_name)
+        return self.restaurant(restaurant_id) if restaurant_id else None
+
+    def not_found_message(self, restaurant_name):
+        message = f"Restaurant '{restaurant_name}' not found in database."
+        suggestions = [
+            match.name
+            for match in self.match_restaurants(
+                restaurant_name, limit=3, min_score=config.FUZZY_SUGGEST_THRESHOLD
+            )
+        ]
+        if suggestions:
+            message += f" Did you mean: {', '.join(suggestions)}?"
+        return message
+
+    def menu(self, restaurant_id):
+        return self.menu_by_id.get(restaurant_id)
+
+    def search_restaurants(self, cuisine=None, location=None, ambience=None):
+        """Restaurants matching any given criterion, in catalogue order.
+
+        A criterion matches when every one of its words appears in the field.
+        """
+        matched = set()
+        for field, value in zip(SEARCH_FIELDS, (cuisine, location, ambience)):
+            if value:
+                matched |= self._lookup_all(self.field_index[field], tokenize(value))
+        return [
+            self.restaurant_by_id[restaurant_id]
+            for restaurant_id in sorted(matched, key=self.position_by_id.get)
+        ]
+
+
+_knowledge_base = None
+_knowledge_base_lock = threading.Lock()
+
+
+def get_knowledge_base():
+    """The process-wide knowledge base for the configured KB_STORAGE, loaded on first use."""
+    global _knowledge_base
+    if _knowledge_base is None:
+        with _knowledge_base_lock:
+            if _knowledge_base is None:
+                if config.KB_STORAGE == "sqlite":
+                    from utils.sqlite_knowledge_base import SQLiteKnowledgeBase, ensure_database
+
+                    ensure_database(config.KB_SQLITE_PATH, config.KNOWLEDGE_BASE_DIR)
+                    _knowledge_base = SQLiteKnowledgeBase(config.KB_SQLITE_PATH)
+                elif config.KB_STORAGE == "json":
+                    _knowledge_base = KnowledgeBase.load()
+                else:
+                    raise ValueError(f"Unknown knowledge base storage '{config.KB_STORAGE}'")
+    return _knowledge_base
+
+
+def reset_knowledge_base():
+    """Drop the loaded knowledge base so the next access reloads it."""
+    global _knowledge_base
+    with _knowledge_base_lock:
+        _knowledge_base = None
+        for name in _LAZY_GLOBALS:
+            globals().pop(name, None)
+
+
+_LAZY_GLOBALS = {
+    "restaurant_kb": load_restaurant_kb,
+    "menu_kb": load_menu_kb,
+}
 
 
-restaurant_kb = load_restaurant_kb()
-menu_kb = load_menu_kb()
-reservation_kb = load_reservation_kb()
+def __getattr__(name):
+    # restaurant_kb and menu_kb are read on first access, not at import;
+    # reservation_kb is read from the reservation store on every access
+    if name in _LAZY_GLOBALS:
+        value = globals()[name] = _LAZY_GLOBALS[name]()
+        return value
+    if name == "reservation_kb":
+        return load_reservation_kb()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
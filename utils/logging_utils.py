@@ -1,12 +1,14 @@
 import logging
+from utils import config
 
 
 def setup_logging():
     logging.basicConfig(
-        format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
+        format="%(asctime)s - %(levelname)s - %(message)s", level=config.LOG_LEVEL
     )
     return logging.getLogger("RestaurantAssistant")
 
 
-# Initialize logger
+# Initialize logger; pass values as arguments ("%s") so messages below
+# LOG_LEVEL are never formatted
 logger = setup_logging()
@@ -0,0 +1,215 @@
+import threading
+from collections import defaultdict
+import numpy as np
+from utils import config
+from utils.embedding_index import parse_food_choice, parse_price_range
+from utils.fuzzy_index import FuzzyIndex
+from utils.knowledge_base import get_knowledge_base, tokenize
+
+# Result orders: by price, cheapest or most expensive first
+CHEAPEST = "cheapest"
+MOST_EXPENSIVE = "most_expensive"
+_MOST_EXPENSIVE_WORDS = {"most", "expensive", "priciest", "costliest", "premium", "highest"}
+
+
+def parse_order(order):
+    if order and set(tokenize(order.replace("_", " "))) & _MOST_EXPENSIVE_WORDS:
+        return MOST_EXPENSIVE
+    return CHEAPEST
+
+
+class MenuStore:
+    """Every menu entry flattened into parallel NumPy columns at load time.
+
+    Dish names and categories are interned: the `name` and `category`
+    columns hold codes into `dish_names` and `categories`, and `restaurant`
+    holds positions in `restaurant_ids`. Queries are boolean masks over the
+    columns, ranked by price.
+    """
+
+    def __init__(self, kb):
+        self.kb = kb
+        self.restaurant_ids = []
+        self.restaurant_names = []
+        position_by_id = {}
+        for restaurant in kb.all_restaurants():
+            position_by_id[restaurant["restaurant_id"]] = len(self.restaurant_ids)
+            self.restaurant_ids.append(restaurant["restaurant_id"])
+            self.restaurant_names.append(restaurant.get("name", ""))
+
+        self.dish_names = []
+        self.categories = []
+        name_codes = {}
+        category_codes = {}
+        # DISH NAME TOKEN -> NAME CODES, and the names for misspelled queries
+        self.name_words = defaultdict(set)
+        self.name_index = FuzzyIndex()
+        restaurant, name, category, price, is_veg = [], [], [], [], []
+        for items in kb.all_menus():
+            restaurant_id = items["restaurant_id"]
+            if restaurant_id not in position_by_id:
+                position_by_id[restaurant_id] = len(self.restaurant_ids)
+                self.restaurant_ids.append(restaurant_id)
+                self.restaurant_names.append("")
+            for dish in items.get("menu", []):
+                dish_name = dish.get("dish_name") or ""
+                if dish_name not in name_codes:
+                    name_codes[dish_name] = len(self.dish_names)
+                    self.dish_names.append(dish_name)
+                    for token in tokenize(dish_name):
+                        self.name_words[token].add(name_codes[dish_name])
+                    if dish_name:
+                        self.name_index.add(dish_name, dish_name)
+                dish_category = dish.get("category") or ""
+                if dish_category not in category_codes:
+                    category_codes[dish_category] = len(self.categories)
+                    self.categories.append(dish_category)
+                restaurant.append(position_by_id[restaurant_id])
+                name.append(name_codes[dish_name])
+                category.append(category_codes[dish_category])
+                price.append(np.nan if dish.get("price") is None else dish["price"])
+                is_veg.append(bool(dish.get("is_veg")))
+
+        self.restaurant = np.array(restaurant, dtype=np.int32)
+        self.name = np.array(name, dtype=np.int32)
+        self.category = np.array(category, dtype=np.int32)
+        self.price = np.array(price, dtype=np.float32)
+        self.is_veg = np.array(is_veg, dtype=bool)
+        self.position_by_id = position_by_id
+        self.category_codes = {value.casefold(): code for value, code in category_codes.items()}
+
+    def __len__(self):
+        return len(self.price)
+
+    def _name_codes(self, dish_name):
+        # Names containing the query, found through the names sharing all its words
+        query = dish_name.casefold()
+        postings = sorted(
+            (self.name_words.get(token, set()) for token in tokenize(dish_name)), key=len
+        )
+        if not postings:
+            return []
+        codes = set(postings[0]).intersection(*postings[1:])
+        return [code for code in codes if query in self.dish_names[code].casefold()]
+
+    def dish_name_codes(self, dish_name):
+        """Codes of the dish names containing dish_name, else of the closest dish name."""
+        codes = self._name_codes(dish_name)
+        if not codes:
+            match = self.name_index.best(dish_name, config.FUZZY_MATCH_THRESHOLD)
+            if match:
+                codes = self._name_codes(match.value)
+        return codes
+
+    @staticmethod
+    def _lookup(codes, size):
+        table = np.zeros(size, dtype=bool)
+        table[list(codes)] = True
+        return table
+
+    def mask(
+        self,
+        dish_name=None,
+        restaurant_ids=None,
+        veg=None,
+        price_range=None,
+        category=None,
+    ):
+        """Boolean mask over menu entries; `price_range` is (min, max), either may be None."""
+        mask = np.ones(len(self), dtype=bool)
+        if dish_name:
+            mask &= self._lookup(self.dish_name_codes(dish_name), len(self.dish_names))[self.name]
+        if restaurant_ids is not None:
+            positions = [
+                self.position_by_id[rid]
+                for rid in restaurant_ids
+                if rid in self.position_by_id
+            ]
+            mask &= self._lookup(positions, len(self.restaurant_ids))[self.restaurant]
+        if veg is not None:
+            mask &= self.is_veg == veg
+        if price_range is not None:
+            low, high = price_range
+            if low is not None:
+                mask &= self.price >= low
+            if high is not None:
+                mask &= self.price <= high
+        if category:
+            code = self.category_codes.get(category.casefold())
+            if code is None:
+                mask[:] = False
+            else:
+                mask &= self.category == code
+        return mask
+
+    def rank(self, mask, order=CHEAPEST, limit=None):
+        """Positions of the masked entries by price (stable, unpriced last)."""
+        positions = np.flatnonzero(mask)
+        prices = self.price[positions]
+        if order == MOST_EXPENSIVE:
+            prices = -prices
+        if limit and len(positions) > limit:
+            # Only entries priced within the limit-th best need sorting
+            kth = np.partition(prices, limit - 1)[limit - 1]
+            if not np.isnan(kth):
+                keep = prices <= kth
+                positions, prices = positions[keep], prices[keep]
+        positions = positions[np.argsort(prices, kind="stable")]
+        return positions[:limit] if limit else positions
+
+    def row(self, position):
+        restaurant = self.restaurant[position]
+        price = self.price[position]
+        return {
+            "restaurant_id": self.restaurant_ids[restaurant],
+            "restaurant_name": self.restaurant_names[restaurant],
+            "dish_name": self.dish_names[self.name[position]],
+            "category": self.categories[self.category[position]],
+            "price": None if np.isnan(price) else float(price),
+            "is_veg": bool(self.is_veg[position]),
+        }
+
+    def find(
+        self,
+        dish_name=None,
+        restaurant_ids=None,
+        food_choice=None,
+        price_range=None,
+        category=None,
+        order=None,
+        limit=None,
+    ):
+        """Ranked menu entries joined to their restaurant's name.
+
+        food_choice, price_range and order are free text ("veg", "under 300",
+        "cheapest"); unrecognised values don't filter.
+        """
+        choice = parse_food_choice(food_choice)
+        mask = self.mask(
+            dish_name=dish_name,
+            restaurant_ids=restaurant_ids,
+            veg=None if choice is None else choice == "veg",
+            price_range=parse_price_range(price_range),
+            category=category,
+        )
+        return [self.row(position) for position in self.rank(mask, parse_order(order), limit)]
+
+
+_menu_store = None
+_menu_store_lock = threading.Lock()
+
+
+def get_menu_store():
+    """The process-wide menu columns for the current knowledge base, built on first use."""
+    global _menu_store
+    if _menu_store is None:
+        with _menu_store_lock:
+            if _menu_store is None:
+                _menu_store = MenuStore(get_knowledge_base())
+    return _menu_store
+
+
+def reset_menu_store():
+    global _menu_store
+    with _menu_store_lock:
+        _menu_store = None
@@ -1,15 +1,856 @@
-import torch
-from transformers import pipeline
+import asyncio
+import copy
+import itertools
+import json
+import queue
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import partial
+from utils import config
+from utils.batching import BatchScheduler
+from utils.generation_cache import GenerationCache
+from utils import tracing
+from utils.logging_utils import logger
+from utils.metrics import registry
+from utils.streaming import iterate_in_thread
+from utils.structured_output import parse_structured, truncate_completion
+
+# BACKEND NAME -> BACKEND CLASS
+BACKENDS = {}
+
+SPECULATIVE_DRAFTED = registry.counter(
+    "agent_speculative_draft_tokens_total", "Tokens proposed by the draft model"
+)
+SPECULATIVE_ACCEPTED = registry.counter(
+    "agent_speculative_accepted_tokens_total", "Draft tokens accepted by the main model"
+)
+SPECULATIVE_PASSES = registry.counter(
+    "agent_speculative_verify_passes_total", "Main model forward passes in speculative decoding"
+)
+
+
+def register_backend(name):
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+
+    return decorator
+
+
+class ModelBackend:
+    """Generates completions for a batch of prompts; completions exclude the prompt.
+
+    `prefix` and `suffix`, when given, are static texts every prompt in the batch
+    starts and ends with (see utils.prompts); backends may reuse work done for
+    them across calls.
+    Completions end at the first of the `stop` strings, and with
+    `stop_at_json_close` right after the first complete JSON object.
+    `speculative` asks for draft-model decoding where the backend has one.
+    """
+
+    name = None
+
+    @property
+    def identity(self):
+        """The backend and model producing the completions, e.g. for generation cache keys."""
+        return self.name
+
+    def load(self):
+        pass
+
+    def load_tokenizer(self):
+        """Loads only what count_tokens needs (load() does too)."""
+        pass
+
+    def generate(self, prompts, **generate_kwargs):
+        raise NotImplementedError
+
+    def stream(self, prompt, **generate_kwargs):
+        """Yields the completion of a single prompt piece by piece."""
+        yield self.generate([prompt], **generate_kwargs)[0]
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+
+@register_backend("hf")
+class HFTransformersBackend(ModelBackend):
+    def __init__(self, model_id=None, torch_dtype=None, device_map=None):
+        self.model_id = model_id or config.MODEL_ID
+        self.torch_dtype = torch_dtype or config.MODEL_DTYPE
+        self.device_map = device_map or config.MODEL_DEVICE_MAP
+        self.model = None
+        self.tokenizer = None
+        # PREFIX TEXT -> (PREFIX TOKEN IDS, KV CACHE), least recently used first
+        self.prefix_cache = OrderedDict()
+        self._prefix_lock = threading.Lock()
+        # (TEXT, ADD SPECIAL TOKENS) -> TOKEN IDS of template prefixes and suffixes
+        self.segment_ids = {}
+        # (PREFIX, SUFFIX) -> whether prompts split on them tokenize as a whole
+        self._stable_segments = {}
+        self.draft_model = None
+        # Forward pass counts of the speculative generate() running on this thread
+        self._speculation = threading.local()
+
+    def _load_tokenizer(self):
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        # decoder-only models must be left padded for batched generation
+        tokenizer.padding_side = "left"
+        return tokenizer
+
+    @property
+    def identity(self):
+        return f"{self.name}:{self.model_id}"
+
+    def load_tokenizer(self):
+        if self.tokenizer is None:
+            self.tokenizer = self._load_tokenizer()
+
+    def load(self):
+        import torch
+        from transformers import AutoModelForCausalLM
+
+        self.tokenizer = self._load_tokenizer()
+        self.model = AutoModelForCausalLM.from_pretrained(
+            self.model_id,
+            torch_dtype=getattr(torch, self.torch_dtype),
+            device_map=self.device_map,
+        )
+        self.model.eval()
+        if config.DRAFT_MODEL_ID:
+            self.load_draft_model(
+                AutoModelForCausalLM.from_pretrained(
+                    config.DRAFT_MODEL_ID,
+                    torch_dtype=getattr(torch, self.torch_dtype),
+                    device_map=self.device_map,
+                )
+            )
+
+    def load_draft_model(self, draft_model):
+        """Enables speculative decoding with draft_model, which must share the tokenizer."""
+        if draft_model.config.vocab_size != self.model.config.vocab_size:
+            raise ValueError(
+                f"Draft model vocabulary ({draft_model.config.vocab_size}) differs from "
+                f"the main model's ({self.model.config.vocab_size})"
+            )
+        draft_model.eval()
+        draft_model.generation_config.num_assistant_tokens = config.SPECULATIVE_LOOKAHEAD
+        draft_model.generation_config.num_assistant_tokens_schedule = config.SPECULATIVE_SCHEDULE
+        # Every forward pass of the draft proposes one token; every pass of the
+        # main model verifies a draft and adds one token of its own
+        self.model.register_forward_pre_hook(self._counting_hook("passes"))
+        draft_model.register_forward_pre_hook(self._counting_hook("drafted"))
+        self.draft_model = draft_model
+
+    def _counting_hook(self, key):
+        def hook(module, args):
+            counts = getattr(self._speculation, "counts", None)
+            if counts is not None:
+                counts[key] += 1
+
+        return hook
+
+    def _run_generate(self, inputs, generation_config, speculative=False, **kwargs):
+        import torch
+
+        if not speculative:
+            with torch.inference_mode():
+                return self.model.generate(**inputs, **generation_config, **kwargs)
+
+        counts = self._speculation.counts = {"passes": 0, "drafted": 0}
+        try:
+            with torch.inference_mode():
+                output_ids = self.model.generate(
+                    **inputs, **generation_config, assistant_model=self.draft_model, **kwargs
+                )
+        finally:
+            self._speculation.counts = None
+        new_tokens = output_ids.shape[1] - inputs["input_ids"].shape[1]
+        accepted = max(0, new_tokens - counts["passes"])
+        SPECULATIVE_DRAFTED.inc(counts["drafted"])
+        SPECULATIVE_ACCEPTED.inc(accepted)
+        SPECULATIVE_PASSES.inc(counts["passes"])
+        logger.debug(
+            "Speculative decoding: %s tokens in %s passes, %s of %s drafted tokens accepted",
+            new_tokens,
+            counts["passes"],
+            accepted,
+            counts["drafted"],
+        )
+        return output_ids
+
+    def _use_draft(self, prompts, speculative):
+        return speculative and self.draft_model is not None and len(prompts) == 1
+
+    def _generation_config(self, max_new_tokens=None, do_sample=False, temperature=None, **kwargs):
+        generation_config = {
+            "max_new_tokens": max_new_tokens or config.MAX_NEW_TOKENS,
+            "do_sample": do_sample,
+            "pad_token_id": self.tokenizer.pad_token_id,
+        }
+        # temperature is ignored (and warned about) by greedy decoding
+        if do_sample and temperature is not None:
+            generation_config["temperature"] = temperature
+        generation_config.update(kwargs)
+        return generation_config
+
+    def _prefix_entry(self, prefix):
+        import torch
+        from transformers import DynamicCache
+
+        with self._prefix_lock:
+            entry = self.prefix_cache.get(prefix)
+            if entry is not None:
+                self.prefix_cache.move_to_end(prefix)
+                return entry
+
+            prefix_ids = self._segment_ids(prefix, add_special_tokens=True)
+            cache = DynamicCache()
+            with torch.inference_mode():
+                self.model(
+                    input_ids=torch.tensor([prefix_ids], device=self.model.device),
+                    past_key_values=cache,
+                    use_cache=True,
+                )
+            entry = (prefix_ids, cache)
+            self.prefix_cache[prefix] = entry
+            if len(self.prefix_cache) > config.PREFIX_CACHE_MAX_ENTRIES:
+                self.prefix_cache.popitem(last=False)
+            return entry
+
+    def _segment_ids(self, text, add_special_tokens):
+        key = (text, add_special_tokens)
+        ids = self.segment_ids.get(key)
+        if ids is None:
+            ids = self.tokenizer(text, add_special_tokens=add_special_tokens)["input_ids"]
+            self.segment_ids[key] = ids
+        return ids
+
+    def _seam_stable(self, left, right, window=16):
+        """Whether left + right tokenizes as left's tokens then right's, judged
+        on `window` characters either side of the seam."""
+        left, right = left[-window:], right[:window]
+        ids = self.tokenizer([left + right, left, right], add_special_tokens=False)["input_ids"]
+        return ids[0] == ids[1] + ids[2]
+
+    def _split_encode(self, prompts, prefix, suffix):
+        middles = []
+        for prompt in prompts:
+            middle = prompt[len(prefix) : len(prompt) - len(suffix)]
+            if (
+                len(prompt) <= len(prefix) + len(suffix)
+                or not prompt.startswith(prefix)
+                or not prompt.endswith(suffix)
+                or middle[0].isspace()
+                # Tokens merging across a seam depend on this prompt's text
+                # (e.g. trailing whitespace), not only on the template
+                or not self._seam_stable(prefix, middle)
+                or (suffix and not self._seam_stable(middle, suffix))
+            ):
+                return None
+            middles.append(middle)
+        prefix_ids = self._segment_ids(prefix, add_special_tokens=True)
+        suffix_ids = self._segment_ids(suffix, add_special_tokens=False) if suffix else []
+        return [
+            prefix_ids + ids + suffix_ids
+            for ids in self.tokenizer(middles, add_special_tokens=False)["input_ids"]
+        ]
+
+    def _encode(self, prompts, prefix=None, suffix=None):
+        """Token ids of each prompt. With a template's prefix/suffix only the
+        per-request text between them is tokenized; the static parts come from
+        segment_ids.
+
+        Whether a split tokenizes like the whole prompt depends on the
+        tokenizer, so each (prefix, suffix) pair is checked once against full
+        tokenization, retried without the suffix, and otherwise not split.
+        Every prompt's seams are also checked, as merges there depend on the
+        text next to them.
+        """
+        if not prefix:
+            return self.tokenizer(prompts)["input_ids"]
+        for candidate in ((prefix, suffix or ""), (prefix, "")):
+            if self._stable_segments.get(candidate) is False:
+                continue
+            encoded = self._split_encode(prompts, *candidate)
+            if encoded is None:
+                continue
+            if candidate not in self._stable_segments:
+                stable = encoded == self.tokenizer(prompts)["input_ids"]
+                self._stable_segments[candidate] = stable
+                if not stable:
+                    logger.info("Template segments don't tokenize like the whole prompt")
+                    continue
+            return encoded
+        return self.tokenizer(prompts)["input_ids"]
+
+    def _prefix_cached_inputs(self, encoded, prefix):
+        import torch
+
+        prefix_ids, prefix_cache = self._prefix_entry(prefix)
+        # Tokens can merge across the prefix boundary; such prompts take the plain path
+        if any(
+            len(ids) <= len(prefix_ids) or ids[: len(prefix_ids)] != prefix_ids
+            for ids in encoded
+        ):
+            return None
+
+        suffixes = [ids[len(prefix_ids) :] for ids in encoded]
+        width = max(len(suffix) for suffix in suffixes)
+        pad_token_id = self.tokenizer.pad_token_id
+        # Padding sits between the cached prefix and each suffix; the attention
+        # mask hides it and position ids are derived from the mask
+        input_ids = [
+            prefix_ids + [pad_token_id] * (width - len(suffix)) + suffix
+            for suffix in suffixes
+        ]
+        attention_mask = [
+            [1] * len(prefix_ids) + [0] * (width - len(suffix)) + [1] * len(suffix)
+            for suffix in suffixes
+        ]
+
+        cache = copy.deepcopy(prefix_cache)
+        if len(encoded) > 1:
+            cache.batch_repeat_interleave(len(encoded))
+        return {
+            "input_ids": torch.tensor(input_ids, device=self.model.device),
+            "attention_mask": torch.tensor(attention_mask, device=self.model.device),
+            "past_key_values": cache,
+        }
+
+    def _model_inputs(self, prompts, prefix=None, suffix=None, prefix_cache=True):
+        encoded = self._encode(prompts, prefix, suffix)
+        if prefix and prefix_cache and config.PREFIX_CACHE_ENABLED:
+            inputs = self._prefix_cached_inputs(encoded, prefix)
+            if inputs is not None:
+                return inputs
+        return self.tokenizer.pad({"input_ids": encoded}, return_tensors="pt").to(
+            self.model.device
+        )
+
+    def generate(
+        self,
+        prompts,
+        prefix=None,
+        suffix=None,
+        stop=None,
+        stop_at_json_close=False,
+        speculative=False,
+        **generate_kwargs,
+    ):
+        speculative = self._use_draft(prompts, speculative)
+        # Assisted generation resumed from a prefilled KV cache doesn't
+        # reproduce plain decoding, so speculative calls skip the prefix cache
+        inputs = self._model_inputs(prompts, prefix, suffix, prefix_cache=not speculative)
+        generation_config = self._generation_config(**generate_kwargs)
+        if stop:
+            generation_config["stop_strings"] = list(stop)
+            generation_config["tokenizer"] = self.tokenizer
+        if stop_at_json_close:
+            from transformers import StoppingCriteriaList
+            from utils.stopping_criteria import JsonObjectStoppingCriteria
+
+            generation_config["stopping_criteria"] = StoppingCriteriaList(
+                [JsonObjectStoppingCriteria(self.tokenizer, len(prompts))]
+            )
+
+        output_ids = self._run_generate(inputs, generation_config, speculative)
+        new_tokens = output_ids[:, inputs["input_ids"].shape[1] :]
+        completions = self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+        return [
+            truncate_completion(completion, stop, stop_at_json_close)
+            for completion in completions
+        ]
+
+    def stream(self, prompt, prefix=None, suffix=None, speculative=False, **generate_kwargs):
+        from transformers import TextIteratorStreamer
+
+        speculative = self._use_draft([prompt], speculative)
+        inputs = self._model_inputs([prompt], prefix, suffix, prefix_cache=not speculative)
+        streamer = TextIteratorStreamer(
+            self.tokenizer, skip_prompt=True, skip_special_tokens=True
+        )
+        generation_config = self._generation_config(**generate_kwargs)
+        errors = []
+
+        def run():
+            try:
+                self._run_generate(inputs, generation_config, speculative, streamer=streamer)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=run, name="model-stream", daemon=True)
+        thread.start()
+        yield from streamer
+        thread.join()
+        if errors:
+            raise errors[0]
+
+    def count_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+
+@register_backend("cpu_quantized")
+class CPUQuantizedBackend(HFTransformersBackend):
+    """Float32 weights on CPU with int8 dynamic quantization of every Linear layer."""
+
+    def __init__(self, model_id=None):
+        super().__init__(
+            model_id=model_id or config.CPU_MODEL_ID,
+            torch_dtype="float32",
+            device_map="cpu",
+        )
+
+    def load(self):
+        import torch
+        from transformers import AutoModelForCausalLM
+
+        self.tokenizer = self._load_tokenizer()
+        model = AutoModelForCausalLM.from_pretrained(
+            self.model_id, torch_dtype=torch.float32
+        )
+        model.eval()
+        self.model = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        if config.DRAFT_MODEL_ID:
+            draft_model = AutoModelForCausalLM.from_pretrained(
+                config.DRAFT_MODEL_ID, torch_dtype=torch.float32
+            )
+            self.load_draft_model(
+                torch.ao.quantization.quantize_dynamic(
+                    draft_model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            )
+
+
+@register_backend("scripted")
+class ScriptedBackend(ModelBackend):
+    """Deterministic stub: the first rule whose pattern matches the prompt answers it.
+
+    Replies may reference pattern groups (e.g. "\\1"), as in re.Match.expand.
+    """
+
+    def __init__(self, script=None, default_reply=""):
+        self.script = script
+        self.default_reply = default_reply
+        self.rules = []
+
+    def load(self):
+        script = self.script
+        if script is None and config.SCRIPTED_BACKEND_FILE:
+            with open(config.SCRIPTED_BACKEND_FILE, "r") as f:
+                script = json.load(f)
+        self.rules = [
+            (re.compile(pattern, re.DOTALL), reply) for pattern, reply in script or []
+        ]
+
+    def reply(self, prompt):
+        for pattern, reply in self.rules:
+            match = pattern.search(prompt)
+            if match:
+                return match.expand(reply)
+        return self.default_reply
+
+    def generate(
+        self,
+        prompts,
+        max_new_tokens=None,
+        stop=None,
+        stop_at_json_close=False,
+        **generate_kwargs,
+    ):
+        completions = []
+        for prompt in prompts:
+            words = self.reply(prompt).split(" ")
+            completion = " ".join(words[: max_new_tokens or config.MAX_NEW_TOKENS])
+            completions.append(truncate_completion(completion, stop, stop_at_json_close))
+        return completions
+
+    def stream(self, prompt, **generate_kwargs):
+        words = self.generate([prompt], **generate_kwargs)[0].split(" ")
+        for index, word in enumerate(words):
+            yield word if index == 0 else " " + word
+
+
+class ModelPoolError(RuntimeError):
+    pass
+
+
+@register_backend("pool")
+class ModelPoolBackend(ModelBackend):
+    """Client of a `python -m utils.model_pool` server listening on `address`.
+
+    Calls from every thread share one connection; a reader thread hands each
+    reply to the call waiting for it. A lost connection fails the calls in
+    flight and is reopened by the next call.
+    """
+
+    token_count_cache_size = 4096
+
+    def __init__(self, address=None, authkey=None):
+        self.address = address or config.MODEL_POOL_ADDRESS
+        self.authkey = authkey if authkey is not None else config.MODEL_POOL_AUTHKEY
+        self._conn = None
+        self._lock = threading.Lock()
+        # REQUEST ID -> queue of (KIND, PAYLOAD) replies
+        self._replies = {}
+        self._request_ids = itertools.count()
+        self._token_counts = {}
+        self._identity = None
+
+    @property
+    def identity(self):
+        # Whatever backend and model the pool serves
+        if self._identity is None:
+            self._identity = f"pool:{self.health()['identity']}"
+        return self._identity
+
+    def load(self):
+        with self._lock:
+            self._connection()
+
+    def _connection(self):
+        if self._conn is None:
+            from multiprocessing.connection import Client
+
+            try:
+                conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            except OSError as e:
+                raise ModelPoolError(f"Model pool at {self.address} is unavailable: {e}") from e
+            threading.Thread(
+                target=self._read, args=(conn,), name="model-pool-reader", daemon=True
+            ).start()
+            self._conn = conn
+        return self._conn
+
+    def _read(self, conn):
+        try:
+            while True:
+                request_id, kind, payload = conn.recv()
+                replies = self._replies.get(request_id)
+                if replies is not None:
+                    replies.put((kind, payload))
+        except (EOFError, OSError):
+            pass
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+            for replies in list(self._replies.values()):
+                replies.put(("error", "Model pool connection closed"))
+        conn.close()
+
+    def _request(self, op, *args, **kwargs):
+        """Yields the (kind, payload) replies to one request, raising on "error"."""
+        replies = queue.Queue()
+        with self._lock:
+            conn = self._connection()
+            request_id = next(self._request_ids)
+            self._replies[request_id] = replies
+            try:
+                conn.send((request_id, op, args, kwargs))
+            except OSError as e:
+                self._replies.pop(request_id)
+                raise ModelPoolError(f"Model pool at {self.address} is unavailable: {e}") from e
+        try:
+            while True:
+                kind, payload = replies.get()
+                if kind == "error":
+                    raise ModelPoolError(payload)
+                yield kind, payload
+                if kind != "chunk":
+                    return
+        finally:
+            with self._lock:
+                self._replies.pop(request_id, None)
+
+    def _call(self, op, *args, **kwargs):
+        for _, payload in self._request(op, *args, **kwargs):
+            return payload
+
+    def generate(self, prompts, **generate_kwargs):
+        return self._call("generate", prompts, **generate_kwargs)
+
+    def stream(self, prompt, **generate_kwargs):
+        for _, chunk in self._request("stream", prompt, **generate_kwargs):
+            if chunk is not None:
+                yield chunk
+
+    def count_tokens(self, text):
+        count = self._token_counts.get(text)
+        if count is None:
+            count = self._call("count_tokens", text)
+            if len(self._token_counts) >= self.token_count_cache_size:
+                self._token_counts.clear()
+            self._token_counts[text] = count
+        return count
+
+    def health(self):
+        """Worker states of the pool (see ModelPool.health)."""
+        return self._call("health")
+
+
+def create_backend(name=None, **kwargs):
+    name = name or config.MODEL_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown model backend '{name}'. Available: {', '.join(sorted(BACKENDS))}"
+        )
+    return BACKENDS[name](**kwargs)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend = create_backend()
+                logger.info("Loading model backend: %s", backend.name)
+                backend.load()
+                _backend = backend
+    return _backend
+
+
+def set_backend(backend):
+    global _backend
+    if isinstance(backend, str):
+        backend = create_backend(backend)
+        backend.load()
+    with _backend_lock:
+        _backend = backend
 
 
 def load_model():
-    model_id = "meta-llama/Llama-3.1-8B"
-    return pipeline(
-        "text-generation",
-        model=model_id,
-        model_kwargs={"torch_dtype": torch.bfloat16},
-        device_map="auto",
-    )
+    return get_backend()
+
+
+def generate_batch(prompts, **generate_kwargs):
+    return get_backend().generate(prompts, **generate_kwargs)
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _backend_lock:
+            if _scheduler is None:
+                _scheduler = BatchScheduler(
+                    generate_batch,
+                    max_batch_size=config.BATCH_MAX_SIZE,
+                    max_wait_ms=config.BATCH_MAX_WAIT_MS,
+                )
+    return _scheduler
+
+
+_generation_cache = None
+
+
+def get_generation_cache():
+    global _generation_cache
+    if _generation_cache is None:
+        with _backend_lock:
+            if _generation_cache is None:
+                _generation_cache = GenerationCache(
+                    max_entries=config.GENERATION_CACHE_MAX_ENTRIES,
+                    ttl_seconds=config.GENERATION_CACHE_TTL_SECONDS,
+                    path=config.GENERATION_CACHE_PATH,
+                )
+    return _generation_cache
+
+
+def _cache_completion(cache_key, future):
+    if future.exception() is None:
+        get_generation_cache().put(cache_key, future.result())
+
+
+_static_token_counts = {}
+
+
+def count_prompt_tokens(prompt, template=None):
+    """Token count of a prompt, reusing the counts of its template's static text.
+
+    Only used for metrics, so tokens merging across segment boundaries are
+    not accounted for.
+    """
+    backend = get_backend()
+    if (
+        template is None
+        or not prompt.startswith(template.prefix)
+        or not prompt.endswith(template.suffix)
+    ):
+        return backend.count_tokens(prompt)
+    key = (backend.name, template.name)
+    static_tokens = _static_token_counts.get(key)
+    if static_tokens is None:
+        static_tokens = backend.count_tokens(template.prefix) + backend.count_tokens(
+            template.suffix
+        )
+        _static_token_counts[key] = static_tokens
+    middle = prompt[len(template.prefix) : len(prompt) - len(template.suffix)]
+    return static_tokens + backend.count_tokens(middle)
+
+
+def record_model_call(span, prompt, template, completion, cached=False):
+    if span is not None:
+        backend = get_backend()
+        span.record_model_call(
+            count_prompt_tokens(prompt, template), backend.count_tokens(completion), cached
+        )
+
+
+class ModelPipeline:
+    """Drop-in for the transformers text-generation pipeline call convention.
+
+    The backend is only resolved (and its weights loaded) on the first call.
+    """
+
+    def submit(self, prompt, template=None, **generate_kwargs):
+        """Returns a Future resolving to the completion text (without the prompt).
+
+        Passing the PromptTemplate the prompt was rendered from (see
+        utils.prompts) lets the backend reuse the tokens and KV cache of its
+        static prefix and suffix.
+        """
+        cache_key = None
+        # Sampled generations differ on every call, so only greedy ones are cached
+        if config.GENERATION_CACHE_ENABLED and not generate_kwargs.get("do_sample"):
+            cache = get_generation_cache()
+            cache_key = cache.make_key(
+                get_backend().identity,
+                template.name if template is not None else None,
+                prompt,
+                generate_kwargs,
+            )
+            completion = cache.get(cache_key)
+            if completion is not None:
+                future = Future()
+                future.set_result(completion)
+                future.cache_hit = True
+                return future
+
+        if template is not None:
+            generate_kwargs["prefix"] = template.prefix
+            generate_kwargs["suffix"] = template.suffix
+
+        if config.BATCHING_ENABLED:
+            future = get_scheduler().submit(prompt, **generate_kwargs)
+        else:
+            future = Future()
+            try:
+                future.set_result(generate_batch([prompt], **generate_kwargs)[0])
+            except Exception as e:
+                future.set_exception(e)
+
+        if cache_key is not None:
+            future.add_done_callback(partial(_cache_completion, cache_key))
+        return future
+
+    def stream(self, prompt, template=None, **generate_kwargs):
+        """Yields completion text as it is decoded; bypasses batching and caching."""
+        if template is not None:
+            generate_kwargs["prefix"] = template.prefix
+            generate_kwargs["suffix"] = template.suffix
+        chunks = get_backend().stream(prompt, **generate_kwargs)
+        span = tracing.current_span()
+        if span is None:
+            return chunks
+        return self._traced_stream(span, prompt, template, chunks)
+
+    @staticmethod
+    def _traced_stream(span, prompt, template, chunks):
+        completion = []
+        for chunk in chunks:
+            completion.append(chunk)
+            yield chunk
+        record_model_call(span, prompt, template, "".join(completion))
+
+    def __call__(self, prompt, return_full_text=True, template=None, **generate_kwargs):
+        future = self.submit(prompt, template=template, **generate_kwargs)
+        completion = future.result()
+        record_model_call(
+            tracing.current_span(), prompt, template, completion, hasattr(future, "cache_hit")
+        )
+        generated_text = prompt + completion if return_full_text else completion
+        return [{"generated_text": generated_text}]
+
+    async def agenerate(
+        self, prompt, return_full_text=True, template=None, **generate_kwargs
+    ):
+        """Awaitable __call__: the event loop is free while the model runs."""
+        # submit() may read the persisted generation cache, load the backend or,
+        # without batching, run the model itself
+        future = await asyncio.to_thread(
+            self.submit, prompt, template=template, **generate_kwargs
+        )
+        completion = await asyncio.wrap_future(future)
+        record_model_call(
+            tracing.current_span(), prompt, template, completion, hasattr(future, "cache_hit")
+        )
+        generated_text = prompt + completion if return_full_text else completion
+        return [{"generated_text": generated_text}]
+
+    def astream(self, prompt, template=None, **generate_kwargs):
+        """Async iterator version of stream()."""
+
+        def chunks():
+            # Resolving the backend may load the weights, so it happens on the
+            # producer thread too
+            yield from self.stream(prompt, template=template, **generate_kwargs)
+
+        return iterate_in_thread(chunks())
+
+
+model_pipeline = ModelPipeline()
+
+
+def generate_structured(prompt, schema, template=None, **generate_kwargs):
+    """Generates a single JSON object and validates it against a pydantic schema.
+
+    Decoding stops as soon as the object closes and only the new tokens are
+    parsed. Returns None (after logging) when the output doesn't fit the schema.
+    """
+    completion = model_pipeline(
+        prompt,
+        template=template,
+        return_full_text=False,
+        stop_at_json_close=True,
+        **generate_kwargs,
+    )[0]["generated_text"]
+    return _parse_or_log(completion, schema)
+
+
+async def agenerate_structured(prompt, schema, template=None, **generate_kwargs):
+    completion = (
+        await model_pipeline.agenerate(
+            prompt,
+            template=template,
+            return_full_text=False,
+            stop_at_json_close=True,
+            **generate_kwargs,
+        )
+    )[0]["generated_text"]
+    return _parse_or_log(completion, schema)
 
 
-model_pipeline = load_model()
+def _parse_or_log(completion, schema):
+    try:
+        return parse_structured(completion, schema)
+    except ValueError as e:
+        logger.error(
+            "Failed to parse %s: %s\nModel output: %s", schema.__name__, e, completion
+        )
+        return None
@@ -0,0 +1,402 @@
+"""Model server: one copy of the weights, several inference processes.
+
+    python -m utils.model_pool --workers 4
+    MODEL_BACKEND=pool streamlit run app.py     # any number of front ends
+
+The pool loads MODEL_POOL_BACKEND once and forks its workers afterwards, so
+they map the same weight pages (safetensors checkpoints are memory-mapped by
+from_pretrained, and nothing writes to the weights after loading) instead of
+each holding a copy. Front ends send requests over a local socket
+(the "pool" backend in utils.model); the pool hands each one to an idle
+worker, checks worker heartbeats and restarts workers that exit or hang.
+Forking makes this Linux/macOS only.
+"""
+import argparse
+import inspect
+import itertools
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from collections import deque
+from functools import partial
+from multiprocessing.connection import Listener, wait
+from utils import config
+from utils.logging_utils import logger
+from utils.metrics import registry, start_metrics_server
+from utils.model import BACKENDS, create_backend
+
+WORKER_RESTARTS = registry.counter(
+    "agent_model_worker_restarts_total", "Model pool workers restarted after exiting or hanging"
+)
+POOL_REQUESTS = registry.counter(
+    "agent_model_pool_requests_total", "Requests handled by the model pool", ["op", "outcome"]
+)
+# Messages ending a request; "chunk" messages of a stream precede "done"
+FINAL_KINDS = ("result", "done", "error")
+
+
+def run_worker(index, conn, heartbeats, backend, backend_factory, threads):
+    """Worker process loop: run each task received on conn and send back its messages.
+
+    The loop itself beats (while idle, when a task starts and after each
+    streamed chunk), so a task stuck in native code lets the heartbeat lapse.
+    """
+    if threads:
+        import torch
+
+        torch.set_num_threads(threads)
+    if backend is None:
+        # Loading the weights may outlast the heartbeat timeout; beat meanwhile
+        loaded = threading.Event()
+
+        def beat():
+            while True:
+                heartbeats[index] = time.monotonic()
+                if loaded.wait(config.MODEL_POOL_HEALTH_CHECK_SECONDS / 2):
+                    return
+
+        threading.Thread(target=beat, name="heartbeat", daemon=True).start()
+        try:
+            backend = backend_factory()
+            backend.load()
+        finally:
+            loaded.set()
+    while True:
+        heartbeats[index] = time.monotonic()
+        try:
+            if not conn.poll(config.MODEL_POOL_HEALTH_CHECK_SECONDS / 2):
+                continue
+            client_id, request_id, op, args, kwargs = conn.recv()
+        except EOFError:
+            return
+        heartbeats[index] = time.monotonic()
+        try:
+            if op == "generate":
+                conn.send((client_id, request_id, "result", backend.generate(*args, **kwargs)))
+            elif op == "stream":
+                for chunk in backend.stream(*args, **kwargs):
+                    conn.send((client_id, request_id, "chunk", chunk))
+                    heartbeats[index] = time.monotonic()
+                conn.send((client_id, request_id, "done", None))
+            else:
+                raise ValueError(f"Unknown model pool operation '{op}'")
+        except Exception as e:
+            conn.send((client_id, request_id, "error", f"{type(e).__name__}: {e}"))
+
+
+class Worker:
+    def __init__(self, index, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        # (CLIENT ID, REQUEST ID, OP, ARGS, KWARGS) being run, or None when idle
+        self.task = None
+        self.started = time.monotonic()
+
+
+class ModelPool:
+    """Forked inference workers behind a Listener on `address`.
+
+    Requests wait in one queue and go to whichever worker is idle; a worker
+    runs one request (a whole micro-batch from a front end) at a time.
+    """
+
+    def __init__(
+        self,
+        backend_name=None,
+        workers=None,
+        address=None,
+        devices=None,
+        threads=None,
+        authkey=None,
+    ):
+        self.backend_name = backend_name or config.MODEL_POOL_BACKEND
+        self.devices = config.MODEL_POOL_DEVICES if devices is None else devices
+        self.size = len(self.devices) if self.devices else workers or config.MODEL_POOL_WORKERS
+        self.address = address or config.MODEL_POOL_ADDRESS
+        self.authkey = authkey if authkey is not None else config.MODEL_POOL_AUTHKEY
+        threads = config.MODEL_POOL_THREADS if threads is None else threads
+        # CPU workers split the cores between them
+        if not threads and not self.devices:
+            threads = max(1, (os.cpu_count() or 1) // self.size)
+        self.threads = threads or None
+        self.context = multiprocessing.get_context("fork")
+        self.heartbeats = self.context.Array("d", self.size, lock=False)
+        self.backend = None
+        # Answers count_tokens in this process instead of queueing it behind generations
+        self.token_counter = None
+        self._count_lock = threading.Lock()
+        self.identity = None
+        self.workers = []
+        self.restarts = 0
+        self.pending = deque()
+        self.clients = {}
+        self._client_ids = itertools.count()
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self.listener = None
+
+    def _placement(self, device):
+        """create_backend arguments putting the backend's weights on device."""
+        backend_class = BACKENDS.get(self.backend_name)
+        if backend_class is None:
+            # create_backend reports the unknown name
+            return {}
+        if "device_map" not in inspect.signature(backend_class).parameters:
+            if self.devices:
+                raise ValueError(
+                    f"Model backend '{self.backend_name}' can't be placed on "
+                    f"MODEL_POOL_DEVICES; unset it to share CPU weights instead"
+                )
+            return {}
+        return {"device_map": device}
+
+    def start(self):
+        if not self.devices:
+            # Loaded once here; every forked worker shares these pages. On CPU,
+            # as CUDA state doesn't survive the fork
+            self.backend = create_backend(self.backend_name, **self._placement("cpu"))
+            logger.info("Loading model backend %s for the pool", self.backend.name)
+            self.backend.load()
+            self.token_counter = self.backend
+        else:
+            # Rejects a backend that can't be placed before anything loads
+            self._placement(self.devices[0])
+            # The workers load the weights onto their devices; only the tokenizer here
+            self.token_counter = create_backend(self.backend_name)
+            self.token_counter.load_tokenizer()
+        self.identity = self.token_counter.identity
+        self.workers = [self._spawn(index) for index in range(self.size)]
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        self.listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        for target, name in (
+            (self._accept, "model-pool-accept"),
+            (self._route, "model-pool-router"),
+            (self._monitor, "model-pool-monitor"),
+        ):
+            threading.Thread(target=target, name=name, daemon=True).start()
+        logger.info(
+            "Model pool listening on %s with %s workers (%s)",
+            self.address,
+            self.size,
+            ", ".join(self.devices) if self.devices else f"cpu, {self.threads} threads each",
+        )
+
+    def _spawn(self, index):
+        parent_conn, child_conn = self.context.Pipe()
+        factory = None
+        if self.devices:
+            factory = partial(
+                create_backend, self.backend_name, **self._placement(self.devices[index])
+            )
+        self.heartbeats[index] = time.monotonic()
+        process = self.context.Process(
+            target=run_worker,
+            args=(index, child_conn, self.heartbeats, self.backend, factory, self.threads),
+            name=f"model-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        return Worker(index, process, parent_conn)
+
+    def submit(self, task):
+        with self._lock:
+            self.pending.append(task)
+            self._dispatch()
+
+    def _dispatch(self):
+        for worker in self.workers:
+            if not self.pending:
+                return
+            if worker.task is None and worker.process.is_alive():
+                worker.task = self.pending.popleft()
+                try:
+                    worker.conn.send(worker.task)
+                except OSError:
+                    # The worker died meanwhile; the task waits for another
+                    # worker or the replacement the monitor starts
+                    self.pending.appendleft(worker.task)
+                    worker.task = None
+
+    def _reply(self, client_id, message):
+        client = self.clients.get(client_id)
+        if client is None:
+            return
+        conn, send_lock = client
+        try:
+            with send_lock:
+                conn.send(message)
+        except OSError:
+            pass
+
+    def _route(self):
+        while not self._closed.is_set():
+            with self._lock:
+                connections = {worker.conn: worker for worker in self.workers}
+            try:
+                ready = wait(list(connections), timeout=0.5)
+            except (OSError, ValueError):
+                # A connection was closed by a restart meanwhile
+                continue
+            for conn in ready:
+                worker = connections[conn]
+                try:
+                    client_id, request_id, kind, payload = conn.recv()
+                except (EOFError, OSError):
+                    worker.process.join(1)
+                    if not worker.process.is_alive():
+                        self._restart(worker, f"exited with code {worker.process.exitcode}")
+                    continue
+                self._reply(client_id, (request_id, kind, payload))
+                if kind in FINAL_KINDS:
+                    with self._lock:
+                        if worker.task is not None:
+                            POOL_REQUESTS.inc(
+                                op=worker.task[2], outcome="error" if kind == "error" else "ok"
+                            )
+                        worker.task = None
+                        self._dispatch()
+
+    def _monitor(self):
+        while not self._closed.wait(config.MODEL_POOL_HEALTH_CHECK_SECONDS):
+            now = time.monotonic()
+            for worker in list(self.workers):
+                if not worker.process.is_alive():
+                    self._restart(worker, f"exited with code {worker.process.exitcode}")
+                elif now - self.heartbeats[worker.index] > config.MODEL_POOL_HEARTBEAT_TIMEOUT:
+                    # Replaced before the kill, which the router would report as an exit
+                    self._restart(worker, "stopped sending heartbeats")
+                    worker.process.kill()
+                    worker.process.join(5)
+
+    def _restart(self, worker, reason):
+        with self._lock:
+            if self._closed.is_set() or self.workers[worker.index] is not worker:
+                # Already replaced (by the router or the monitor), or shutting down
+                return
+            logger.error(
+                "Model worker %s (pid %s) %s; restarting", worker.index, worker.process.pid, reason
+            )
+            WORKER_RESTARTS.inc()
+            self.restarts += 1
+            worker.conn.close()
+            if worker.task is not None:
+                client_id, request_id, op = worker.task[:3]
+                POOL_REQUESTS.inc(op=op, outcome="error")
+                self._reply(client_id, (request_id, "error", f"Model worker {reason}"))
+            self.workers[worker.index] = self._spawn(worker.index)
+            self._dispatch()
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                if self._closed.is_set():
+                    return
+                logger.exception("Model pool failed to accept a connection")
+                continue
+            client_id = next(self._client_ids)
+            self.clients[client_id] = (conn, threading.Lock())
+            threading.Thread(
+                target=self._serve_client,
+                args=(client_id, conn),
+                name=f"model-pool-client-{client_id}",
+                daemon=True,
+            ).start()
+
+    def _serve_client(self, client_id, conn):
+        try:
+            while True:
+                request_id, op, args, kwargs = conn.recv()
+                if op == "health":
+                    self._reply(client_id, (request_id, "result", self.health()))
+                elif op == "count_tokens":
+                    self._reply(client_id, (request_id, *self._count_tokens(*args)))
+                else:
+                    self.submit((client_id, request_id, op, args, kwargs))
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._lock:
+                self.clients.pop(client_id, None)
+                # Running requests finish; their results are dropped
+                self.pending = deque(task for task in self.pending if task[0] != client_id)
+            conn.close()
+
+    def _count_tokens(self, text):
+        try:
+            with self._count_lock:
+                count = self.token_counter.count_tokens(text)
+        except Exception as e:
+            POOL_REQUESTS.inc(op="count_tokens", outcome="error")
+            return "error", f"{type(e).__name__}: {e}"
+        POOL_REQUESTS.inc(op="count_tokens", outcome="ok")
+        return "result", count
+
+    def health(self):
+        now = time.monotonic()
+        with self._lock:
+            workers = [
+                {
+                    "index": worker.index,
+                    "pid": worker.process.pid,
+                    "alive": worker.process.is_alive(),
+                    "busy": worker.task is not None,
+                    "uptime_seconds": round(now - worker.started, 1),
+                    "heartbeat_age_seconds": round(now - self.heartbeats[worker.index], 3),
+                }
+                for worker in self.workers
+            ]
+            return {
+                "backend": self.backend_name,
+                "identity": self.identity,
+                "workers": workers,
+                "pending": len(self.pending),
+                "restarts": self.restarts,
+            }
+
+    def close(self):
+        self._closed.set()
+        if self.listener is not None:
+            self.listener.close()
+        with self._lock:
+            for conn, _ in self.clients.values():
+                # EOF for both the client and the thread serving it, which closes conn
+                with socket.fromfd(conn.fileno(), socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.shutdown(socket.SHUT_RDWR)
+        for worker in self.workers:
+            worker.conn.close()
+            worker.process.terminate()
+        for worker in self.workers:
+            worker.process.join(5)
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FoodieSpot model worker pool")
+    parser.add_argument("--backend", default=config.MODEL_POOL_BACKEND)
+    parser.add_argument("--workers", type=int, default=config.MODEL_POOL_WORKERS)
+    parser.add_argument("--address", default=config.MODEL_POOL_ADDRESS)
+    args = parser.parse_args()
+
+    pool = ModelPool(args.backend, args.workers, args.address)
+    pool.start()
+    if config.METRICS_PORT:
+        start_metrics_server(config.METRICS_PORT)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
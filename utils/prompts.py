@@ -0,0 +1,65 @@
+from jinja2 import Environment, FileSystemLoader, meta
+from utils import config
+
+_SENTINEL = "\x00PROMPT_VARIABLE\x00"
+
+
+def static_segments(template):
+    """The text a template renders before its first and after its last variable.
+
+    The prefix is cut back to a line end and the suffix starts at the line
+    break before its first non-blank line, so the per-request text between them
+    sits on line boundaries and usually tokenizes the same alone as in the full
+    prompt (backends check this before relying on it).
+    """
+    env = template.environment
+    source = env.loader.get_source(env, template.name)[0]
+    variables = meta.find_undeclared_variables(env.parse(source))
+    rendered = template.render(**{name: _SENTINEL for name in variables})
+    if _SENTINEL not in rendered:
+        return rendered, ""
+
+    head = rendered.split(_SENTINEL, 1)[0]
+    prefix = head[: head.rfind("\n") + 1]
+
+    tail = rendered.rsplit(_SENTINEL, 1)[1]
+    newline = tail.find("\n")
+    if newline == -1:
+        return prefix, ""
+    rest = tail[newline:]
+    blank = rest[: len(rest) - len(rest.lstrip())]
+    return prefix, rest[blank.rfind("\n") :]
+
+
+class PromptTemplate:
+    """A compiled template and its static prefix/suffix, computed once."""
+
+    def __init__(self, template):
+        self.template = template
+        self.name = template.name
+        self.prefix, self.suffix = static_segments(template)
+
+    def render(self, **variables):
+        return self.template.render(**variables)
+
+
+class PromptRegistry:
+    """Every template under `directory`, loaded and compiled once at startup."""
+
+    def __init__(self, directory=None):
+        self.env = Environment(loader=FileSystemLoader(directory or config.TEMPLATES_DIR))
+        self.templates = {
+            name: PromptTemplate(self.env.get_template(name))
+            for name in self.env.list_templates(extensions=["jinja2"])
+        }
+
+    def get(self, name):
+        return self.templates[name]
+
+    def render(self, name, **variables):
+        """(PromptTemplate, prompt text); pass both on to model_pipeline."""
+        template = self.get(name)
+        return template, template.render(**variables)
+
+
+prompts = PromptRegistry()
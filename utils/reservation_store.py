@@ -0,0 +1,280 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from utils import config
+from utils.knowledge_base import get_knowledge_base
+from utils.logging_utils import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of this process are serialized
+    fcntl = None
+
+
+def unique_bookings(reservations):
+    """reservations without repeated booking_ids, first occurrence kept."""
+    seen = set()
+    unique = []
+    for reservation in reservations:
+        booking_id = reservation.get("booking_id")
+        if booking_id is not None:
+            if booking_id in seen:
+                continue
+            seen.add(booking_id)
+        unique.append(reservation)
+    return unique
+
+
+class ReservationStore:
+    """Where bookings are kept. `add` assigns the booking_id and persists the row."""
+
+    def add(self, restaurant, num_people, date_time, special_requests=None):
+        raise NotImplementedError
+
+    def all(self):
+        raise NotImplementedError
+
+    def exclusive(self):
+        """Context in which no other thread or process adds bookings, for a
+        check-then-add; add() and read_since() may be called inside it."""
+        raise NotImplementedError
+
+    def read_since(self, cursor=None):
+        """Reservations added after `cursor` and the cursor to pass next time.
+
+        May return rows the caller has already seen (e.g. everything, after a
+        compaction), so callers dedupe on booking_id.
+        """
+        raise NotImplementedError
+
+
+class JSONLReservationStore(ReservationStore):
+    """Append-only bookings log on top of a compacted JSON snapshot.
+
+    A booking appends one line to `log_path` and bumps the counter in
+    `<log_path>.lock` while holding an exclusive file lock, so its cost does not
+    depend on how many reservations exist and concurrent writers (threads or
+    processes) never share an ID. Once the log grows past `compact_bytes` it is
+    folded into `snapshot_path` (the original reservations.json layout).
+    """
+
+    def __init__(self, snapshot_path, log_path=None, compact_bytes=1 << 20):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path or os.path.splitext(snapshot_path)[0] + ".jsonl"
+        self.lock_path = self.log_path + ".lock"
+        self.compact_bytes = compact_bytes
+        self._thread_lock = threading.RLock()
+        # The open lock file while this thread holds the lock
+        self._held = threading.local()
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            lock_file = getattr(self._held, "lock_file", None)
+            if lock_file is not None:
+                # Nested in exclusive()
+                yield lock_file
+                return
+            with open(self.lock_path, "a+") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._held.lock_file = lock_file
+                try:
+                    yield lock_file
+                finally:
+                    self._held.lock_file = None
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def exclusive(self):
+        return self._locked()
+
+    def _read_snapshot(self):
+        try:
+            with open(self.snapshot_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+
+    def _read_log(self, offset=0):
+        # Complete lines from byte `offset` on, and the offset just past them
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        data = data[: data.rfind(b"\n") + 1]
+        reservations = []
+        for line in data.splitlines():
+            try:
+                reservations.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Torn line from a writer that died mid-append
+                logger.warning("Skipping unreadable reservation log line in %s", self.log_path)
+        return reservations, offset + len(data)
+
+    def all(self):
+        # Lock-free: the log is read before the snapshot, so a compaction in
+        # between shows its bookings twice (deduped) rather than not at all.
+        # A crash between compaction's two renames also leaves them in both.
+        log = self._read_log()[0]
+        return unique_bookings(self._read_snapshot() + log)
+
+    def read_since(self, cursor=None):
+        # The cursor is (log inode, byte offset); compaction swaps in a new log file
+        with self._locked():
+            try:
+                inode = os.stat(self.log_path).st_ino
+            except FileNotFoundError:
+                inode = None
+            if cursor and inode is not None and cursor[0] == inode:
+                reservations, offset = self._read_log(cursor[1])
+            else:
+                reservations, offset = self._read_log()
+                reservations = unique_bookings(self._read_snapshot() + reservations)
+        return reservations, (inode, offset)
+
+    def _last_booking_id(self, lock_file):
+        lock_file.seek(0)
+        counter = lock_file.read().strip()
+        if counter:
+            return int(counter)
+        # First booking against this log: seed the counter from existing rows
+        return max((r.get("booking_id") or 0 for r in self.all()), default=0)
+
+    def add(self, restaurant, num_people, date_time, special_requests=None):
+        with self._locked() as lock_file:
+            booking_id = self._last_booking_id(lock_file) + 1
+            reservation = {
+                "restaurant": restaurant,
+                "num_people": num_people,
+                "date_time": date_time,
+                "special_requests": special_requests,
+                "booking_id": booking_id,
+            }
+            with open(self.log_path, "a") as log:
+                log.write(json.dumps(reservation) + "\n")
+                log.flush()
+                os.fsync(log.fileno())
+
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write(str(booking_id))
+            lock_file.flush()
+
+            if os.path.getsize(self.log_path) >= self.compact_bytes:
+                self._compact()
+        return reservation
+
+    def compact(self):
+        with self._locked():
+            self._compact()
+
+    def _compact(self):
+        reservations = self.all()
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(reservations, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        open(tmp_path, "w").close()
+        os.replace(tmp_path, self.log_path)
+        logger.info("Compacted %s reservations into %s", len(reservations), self.snapshot_path)
+
+
+class SQLiteReservationStore(ReservationStore):
+    """Bookings in the knowledge base's `reservations` table (AUTOINCREMENT IDs)."""
+
+    def __init__(self, path):
+        from utils.sqlite_knowledge_base import connect
+
+        self.path = path
+        self._connect = connect
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect(self.path)
+            connection.execute("PRAGMA busy_timeout = 5000")
+        return connection
+
+    @contextmanager
+    def exclusive(self):
+        connection = self.connection
+        if connection.in_transaction:
+            yield
+            return
+        # Takes the database's write lock up front, so reads inside see every booking
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            connection.rollback()
+            raise
+        connection.commit()
+
+    def all(self):
+        rows = self.connection.execute(
+            "SELECT restaurant, num_people, date_time, special_requests, booking_id "
+            "FROM reservations ORDER BY booking_id"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def read_since(self, cursor=None):
+        rows = self.connection.execute(
+            "SELECT restaurant, num_people, date_time, special_requests, booking_id "
+            "FROM reservations WHERE booking_id > ? ORDER BY booking_id",
+            (cursor or 0,),
+        ).fetchall()
+        reservations = [dict(row) for row in rows]
+        if reservations:
+            cursor = reservations[-1]["booking_id"]
+        return reservations, cursor
+
+    def add(self, restaurant, num_people, date_time, special_requests=None):
+        with self.exclusive():
+            cursor = self.connection.execute(
+                "INSERT INTO reservations (restaurant, num_people, date_time, special_requests) "
+                "VALUES (?, ?, ?, ?)",
+                (restaurant, num_people, date_time, special_requests),
+            )
+        return {
+            "restaurant": restaurant,
+            "num_people": num_people,
+            "date_time": date_time,
+            "special_requests": special_requests,
+            "booking_id": cursor.lastrowid,
+        }
+
+
+_reservation_store = None
+_reservation_store_lock = threading.Lock()
+
+
+def get_reservation_store():
+    global _reservation_store
+    if _reservation_store is None:
+        with _reservation_store_lock:
+            if _reservation_store is None:
+                if config.KB_STORAGE == "sqlite":
+                    # Imports the JSON knowledge base into KB_SQLITE_PATH if needed
+                    get_knowledge_base()
+                    _reservation_store = SQLiteReservationStore(config.KB_SQLITE_PATH)
+                else:
+                    _reservation_store = JSONLReservationStore(
+                        config.RESERVATIONS_PATH,
+                        config.RESERVATIONS_LOG_PATH,
+                        config.RESERVATIONS_COMPACT_BYTES,
+                    )
+    return _reservation_store
+
+
+def reset_reservation_store():
+    global _reservation_store
+    with _reservation_store_lock:
+        _reservation_store = None
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from utils import config
+from utils.capacity import get_capacity_index, reset_capacity_index
+from utils.embedding_index import reset_embedding_index
+from utils.knowledge_base import get_knowledge_base, reset_knowledge_base
+from utils.logging_utils import logger
+from utils.menu_store import reset_menu_store
+from utils.reservation_store import get_reservation_store, reset_reservation_store
+
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def watched_files():
+    """(knowledge base files, reservation files) for the configured KB_STORAGE."""
+    if config.KB_STORAGE == "sqlite":
+        # Bookings write to the same database, so only a rebuilt database (a new
+        # inode) reloads the knowledge base; other changes just pick up bookings
+        return [config.KB_SQLITE_PATH], [config.KB_SQLITE_PATH]
+    return (
+        [
+            os.path.join(config.KNOWLEDGE_BASE_DIR, "restaurant_db.json"),
+            os.path.join(config.KNOWLEDGE_BASE_DIR, "menu.json"),
+        ],
+        [config.RESERVATIONS_PATH, config.RESERVATIONS_LOG_PATH],
+    )
+
+
+class ServiceRegistry:
+    """One long-lived instance per service, shared by every session.
+
+    Backing files are stat'ed at most every `check_interval` seconds: a changed
+    knowledge base file drops the knowledge base, the capacity index and the
+    service instances so they are rebuilt on next use, and changed reservation
+    files only index the new bookings. `invalidate()` forces the full reload.
+    """
+
+    def __init__(self, services, check_interval=None):
+        self.services = services
+        self.check_interval = (
+            config.KB_RELOAD_CHECK_SECONDS if check_interval is None else check_interval
+        )
+        self._instances = {}
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._kb_signature = None
+        self._reservations_signature = None
+
+    def get(self, name):
+        self.check_for_changes()
+        service = self._instances.get(name)
+        if service is None:
+            with self._lock:
+                service = self._instances.get(name)
+                if service is None:
+                    service = self._instances[name] = self.services[name]()
+                    logger.info("Created service %s", name)
+        return service
+
+    def invalidate(self):
+        with self._lock:
+            self._instances.clear()
+            reset_knowledge_base()
+            reset_reservation_store()
+            reset_capacity_index()
+            reset_embedding_index()
+            reset_menu_store()
+        logger.info("Service registry invalidated; knowledge base will be reloaded")
+
+    def _signatures(self):
+        kb_files, reservation_files = watched_files()
+        kb_signature = [file_signature(path) for path in kb_files]
+        if config.KB_STORAGE == "sqlite":
+            kb_signature = [signature and signature[0] for signature in kb_signature]
+        return kb_signature, [file_signature(path) for path in reservation_files]
+
+    def check_for_changes(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        if self._kb_signature is None:
+            # Load first, so the baseline includes an SQLite file imported on load
+            get_knowledge_base()
+
+        kb_signature, reservations_signature = self._signatures()
+        kb_changed = self._kb_signature is not None and kb_signature != self._kb_signature
+        reservations_changed = (
+            self._reservations_signature is not None
+            and reservations_signature != self._reservations_signature
+        )
+        self._kb_signature = kb_signature
+        self._reservations_signature = reservations_signature
+
+        if kb_changed:
+            logger.info("Knowledge base files changed on disk")
+            self.invalidate()
+        elif reservations_changed:
+            get_capacity_index().refresh(get_reservation_store())
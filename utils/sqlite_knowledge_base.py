@@ -0,0 +1,305 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from utils import config
+from utils.fuzzy_index import FuzzyIndex
+from utils.knowledge_base import SEARCH_FIELDS, KnowledgeBase, tokenize
+from utils.logging_utils import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent first starts are not serialized
+    fcntl = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS restaurants (
+    restaurant_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    location TEXT,
+    ambience TEXT,
+    cuisine TEXT,
+    is_veg INTEGER,
+    seating_capacity INTEGER
+);
+CREATE INDEX IF NOT EXISTS restaurants_name_key ON restaurants (name_key);
+
+CREATE TABLE IF NOT EXISTS restaurant_tokens (
+    field TEXT NOT NULL,
+    token TEXT NOT NULL,
+    restaurant_id TEXT NOT NULL,
+    PRIMARY KEY (field, token, restaurant_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS menu_items (
+    item_id INTEGER PRIMARY KEY,
+    restaurant_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    dish_name TEXT NOT NULL,
+    category TEXT,
+    price NUMERIC,
+    is_veg INTEGER
+);
+CREATE INDEX IF NOT EXISTS menu_items_restaurant ON menu_items (restaurant_id, position);
+
+CREATE TABLE IF NOT EXISTS reservations (
+    booking_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    restaurant TEXT NOT NULL,
+    num_people INTEGER NOT NULL,
+    date_time TEXT NOT NULL,
+    special_requests TEXT
+);
+CREATE INDEX IF NOT EXISTS reservations_slot ON reservations (restaurant, date_time);
+"""
+
+RESTAURANT_COLUMNS = (
+    "restaurant_id, name, location, ambience, cuisine, is_veg, seating_capacity"
+)
+MENU_COLUMNS = "dish_name, category, price, is_veg"
+
+
+def connect(path):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.row_factory = sqlite3.Row
+    return connection
+
+
+def import_json(db_path, kb_dir):
+    """One-shot import of restaurant_db.json, menu.json and the reservations.
+
+    The database is built aside and renamed over db_path, so an interrupted
+    import leaves no partial file behind.
+    """
+    from utils.reservation_store import JSONLReservationStore
+
+    def read(filename):
+        try:
+            with open(os.path.join(kb_dir, filename), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    restaurants = read("restaurant_db.json")
+    menus = read("menu.json")
+    reservations = JSONLReservationStore(os.path.join(kb_dir, "reservations.json")).all()
+
+    tmp_path = f"{db_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = connect(tmp_path)
+    try:
+        _import(connection, restaurants, menus, reservations)
+    except BaseException:
+        connection.close()
+        os.remove(tmp_path)
+        raise
+    connection.close()
+    os.replace(tmp_path, db_path)
+    logger.info(
+        "Imported %s restaurants, %s menus and %s reservations into %s",
+        len(restaurants),
+        len(menus),
+        len(reservations),
+        db_path,
+    )
+
+
+def ensure_database(db_path, kb_dir):
+    """Imports the JSON knowledge base into db_path unless it already exists.
+
+    Processes starting together serialize on `<db_path>.lock`; only the first
+    imports, the others find the database once they hold the lock.
+    """
+    if os.path.exists(db_path):
+        return
+    with open(db_path + ".lock", "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(db_path):
+                import_json(db_path, kb_dir)
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _import(connection, restaurants, menus, reservations):
+    with connection:
+        connection.executescript(SCHEMA)
+        for position, restaurant in enumerate(restaurants):
+            connection.execute(
+                "INSERT OR REPLACE INTO restaurants VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    restaurant["restaurant_id"],
+                    position,
+                    restaurant["name"],
+                    restaurant["name"].casefold(),
+                    restaurant.get("location"),
+                    restaurant.get("ambience"),
+                    restaurant.get("cuisine"),
+                    restaurant.get("is_veg"),
+                    restaurant.get("seating_capacity"),
+                ),
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO restaurant_tokens VALUES (?, ?, ?)",
+                [
+                    (field, token, restaurant["restaurant_id"])
+                    for field in SEARCH_FIELDS
+                    for token in tokenize(restaurant.get(field) or "")
+                ],
+            )
+
+        for items in menus:
+            for position, dish in enumerate(items.get("menu", [])):
+                connection.execute(
+                    "INSERT INTO menu_items (restaurant_id, position, dish_name, "
+                    "category, price, is_veg) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        items["restaurant_id"],
+                        position,
+                        dish["dish_name"],
+                        dish.get("category"),
+                        dish.get("price"),
+                        dish.get("is_veg"),
+                    ),
+                )
+
+        connection.executemany(
+            "INSERT OR REPLACE INTO reservations VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    reservation.get("booking_id"),
+                    reservation["restaurant"],
+                    reservation["num_people"],
+                    reservation["date_time"],
+                    reservation.get("special_requests"),
+                )
+                for reservation in reservations
+            ],
+        )
+
+
+def _restaurant(row):
+    restaurant = dict(row)
+    restaurant["is_veg"] = bool(restaurant["is_veg"])
+    return restaurant
+
+
+def _dish(row):
+    dish = dict(row)
+    dish["is_veg"] = bool(dish["is_veg"])
+    return dish
+
+
+class SQLiteKnowledgeBase(KnowledgeBase):
+    """KnowledgeBase served by parameterized queries against indexed SQLite tables.
+
+    Nothing is loaded up front; the fuzzy name indexes are built from the name
+    columns only, on the first lookup that needs them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._name_index = None
+
+    @property
+    def connection(self):
+        # sqlite3 connections are not shared across threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = connect(self.path)
+        return connection
+
+    def _query(self, sql, params=()):
+        return self.connection.execute(sql, params).fetchall()
+
+    @property
+    def name_index(self):
+        with self._lock:
+            if self._name_index is None:
+                index = FuzzyIndex()
+                for row in self._query("SELECT name, restaurant_id FROM restaurants"):
+                    index.add(row["name"], row["restaurant_id"])
+                self._name_index = index
+        return self._name_index
+
+    def all_restaurants(self):
+        return [
+            _restaurant(row)
+            for row in self._query(
+                f"SELECT {RESTAURANT_COLUMNS} FROM restaurants ORDER BY position"
+            )
+        ]
+
+    def all_menus(self):
+        menus = {}
+        for row in self._query(
+            f"SELECT restaurant_id, {MENU_COLUMNS} FROM menu_items "
+            "ORDER BY restaurant_id, position"
+        ):
+            dish = _dish(row)
+            menus.setdefault(dish.pop("restaurant_id"), []).append(dish)
+        return [
+            {"restaurant_id": restaurant_id, "menu": menu}
+            for restaurant_id, menu in menus.items()
+        ]
+
+    def restaurant_id(self, restaurant_name):
+        rows = self._query(
+            "SELECT restaurant_id FROM restaurants WHERE name_key = ?",
+            (restaurant_name.casefold(),),
+        )
+        if rows:
+            return rows[0]["restaurant_id"]
+        return self._closest_restaurant_id(restaurant_name)
+
+    def restaurant(self, restaurant_id):
+        rows = self._query(
+            f"SELECT {RESTAURANT_COLUMNS} FROM restaurants WHERE restaurant_id = ?",
+            (restaurant_id,),
+        )
+        return _restaurant(rows[0]) if rows else None
+
+    def menu(self, restaurant_id):
+        rows = self._query(
+            f"SELECT {MENU_COLUMNS} FROM menu_items WHERE restaurant_id = ? ORDER BY position",
+            (restaurant_id,),
+        )
+        return [_dish(row) for row in rows] or None
+
+    def search_restaurants(self, cuisine=None, location=None, ambience=None):
+        clauses = []
+        params = []
+        for field, value in zip(SEARCH_FIELDS, (cuisine, location, ambience)):
+            tokens = sorted(set(tokenize(value or "")))
+            if not tokens:
+                continue
+            # Restaurants carrying every token of this criterion
+            clauses.append(
+                "SELECT restaurant_id FROM restaurant_tokens "
+                f"WHERE field = ? AND token IN ({', '.join('?' * len(tokens))}) "
+                "GROUP BY restaurant_id HAVING COUNT(*) = ?"
+            )
+            params += [field, *tokens, len(tokens)]
+        if not clauses:
+            return []
+
+        rows = self._query(
+            f"SELECT {RESTAURANT_COLUMNS} FROM restaurants WHERE restaurant_id IN "
+            f"({' UNION '.join(clauses)}) ORDER BY position",
+            params,
+        )
+        return [_restaurant(row) for row in rows]
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else config.KB_SQLITE_PATH
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    import_json(db_path, config.KNOWLEDGE_BASE_DIR)
@@ -0,0 +1,23 @@
+import torch
+from transformers import StoppingCriteria
+from utils.structured_output import JsonObjectScanner
+
+
+class JsonObjectStoppingCriteria(StoppingCriteria):
+    """Stops each sequence as soon as its first top-level JSON object closes.
+
+    Only the newest token of every row is decoded per step, so the check stays
+    constant-time per token instead of rescanning the text generated so far.
+    """
+
+    def __init__(self, tokenizer, batch_size):
+        self.tokenizer = tokenizer
+        self.scanners = [JsonObjectScanner() for _ in range(batch_size)]
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = []
+        for row, scanner in enumerate(self.scanners):
+            if not scanner.done:
+                scanner.feed(self.tokenizer.decode(input_ids[row, -1:]))
+            done.append(scanner.done)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
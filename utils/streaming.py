@@ -0,0 +1,93 @@
+import asyncio
+import contextvars
+import re
+import threading
+
+_WHITESPACE = re.compile(r"(\s+)")
+
+
+class ResponseStreamFormatter:
+    """Incremental version of the final-response post-processing.
+
+    Drops a leading echo of `marker` and collapses whitespace like
+    " ".join(text.split()), emitting text as soon as it can no longer change.
+    """
+
+    def __init__(self, marker):
+        self.marker = marker
+        self._head = ""
+        self._head_done = False
+        self._started = False
+        self._pending_space = False
+
+    def feed(self, chunk):
+        if not self._head_done:
+            self._head += chunk
+            stripped = self._head.lstrip()
+            # Still undecided whether the completion starts with the marker
+            if len(stripped) < len(self.marker) and self.marker.startswith(stripped):
+                return ""
+            chunk = self._resolve_head()
+        return self._normalize(chunk)
+
+    def flush(self):
+        if self._head_done:
+            return ""
+        return self._normalize(self._resolve_head())
+
+    def _resolve_head(self):
+        self._head_done = True
+        stripped = self._head.lstrip()
+        if stripped.startswith(self.marker):
+            return stripped[len(self.marker) :]
+        return self._head
+
+    def _normalize(self, chunk):
+        output = []
+        for piece in _WHITESPACE.split(chunk):
+            if not piece:
+                continue
+            if piece.isspace():
+                self._pending_space = self._started
+                continue
+            if self._pending_space:
+                output.append(" ")
+                self._pending_space = False
+            output.append(piece)
+            self._started = True
+        return "".join(output)
+
+
+def format_response(text, marker):
+    formatter = ResponseStreamFormatter(marker)
+    return formatter.feed(text) + formatter.flush()
+
+
+_DONE = object()
+
+
+async def iterate_in_thread(iterable):
+    """Async iterator over a blocking iterable, which is consumed on its own thread
+    (in a copy of the caller's context, so tracing spans carry over)."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def produce():
+        try:
+            for item in iterable:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+
+    context = contextvars.copy_context()
+    threading.Thread(
+        target=context.run, args=(produce,), name="stream-producer", daemon=True
+    ).start()
+    while True:
+        item = await queue.get()
+        if item is _DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
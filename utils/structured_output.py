@@ -0,0 +1,81 @@
+import json
+
+
+class JsonObjectScanner:
+    """Incrementally tracks the first top-level JSON object in streamed text.
+
+    Braces inside JSON strings are ignored. `end` is set to the offset just past
+    the closing brace once the object is complete.
+    """
+
+    def __init__(self):
+        self.start = None
+        self.end = None
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.offset = 0
+
+    @property
+    def done(self):
+        return self.end is not None
+
+    def feed(self, text):
+        for char in text:
+            if self.done:
+                break
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"' and self.depth:
+                self.in_string = True
+            elif char == "{":
+                if self.start is None:
+                    self.start = self.offset
+                self.depth += 1
+            elif char == "}" and self.depth:
+                self.depth -= 1
+                if not self.depth:
+                    self.end = self.offset + 1
+            self.offset += 1
+        return self.done
+
+
+def extract_json_object(text):
+    scanner = JsonObjectScanner()
+    if not scanner.feed(text):
+        return None
+    return text[scanner.start : scanner.end]
+
+
+def truncate_completion(text, stop=None, stop_at_json_close=False):
+    """Cuts a completion at the first stop string, or just past the first JSON object."""
+    if stop_at_json_close:
+        scanner = JsonObjectScanner()
+        if scanner.feed(text):
+            text = text[: scanner.end]
+    for stop_string in stop or []:
+        index = text.find(stop_string)
+        if index != -1:
+            text = text[:index]
+    return text
+
+
+def schema_fields(schema):
+    # pydantic v2 exposes model_fields, v1 __fields__
+    return getattr(schema, "model_fields", None) or schema.__fields__
+
+
+def parse_structured(text, schema):
+    json_str = extract_json_object(text)
+    if json_str is None:
+        raise ValueError("No JSON object found in model output.")
+
+    data = json.loads(json_str)
+    if not isinstance(data, dict):
+        raise ValueError("Model output is not a JSON object.")
+    return schema(**{name: data.get(name) for name in schema_fields(schema)})
@@ -0,0 +1,156 @@
+import contextvars
+import inspect
+import json
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from utils import config
+from utils.logging_utils import logger
+from utils.metrics import registry
+
+STAGE_SECONDS = registry.histogram(
+    "agent_stage_duration_seconds", "Duration of each pipeline stage", ["stage"]
+)
+MODEL_CALLS = registry.counter(
+    "agent_model_calls_total", "Model calls per stage, by generation cache hit", ["stage", "cached"]
+)
+MODEL_TOKENS = registry.counter(
+    "agent_model_tokens_total", "Prompt and completion tokens per stage", ["stage", "kind"]
+)
+TURNS = registry.counter("agent_turns_total", "Chat turns by detected intent", ["intent"])
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+# Finished turns, newest last
+recent_traces = deque(maxlen=config.TRACE_BUFFER_SIZE)
+
+
+class Span:
+    """One timed stage of a turn; spans opened while it is current become its children."""
+
+    def __init__(self, name, parent=None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.attributes = attributes
+        self.children = []
+        self.model_calls = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.start = time.perf_counter()
+        self.duration = None
+        if parent is not None:
+            parent.children.append(self)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def record_model_call(self, prompt_tokens, completion_tokens, cached=False):
+        self.model_calls += 1
+        self.cache_hits += cached
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        MODEL_CALLS.inc(stage=self.name, cached=str(bool(cached)).lower())
+        MODEL_TOKENS.inc(prompt_tokens, stage=self.name, kind="prompt")
+        MODEL_TOKENS.inc(completion_tokens, stage=self.name, kind="completion")
+
+    def end(self):
+        self.duration = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(self.duration, stage=self.name)
+        if self.parent is None:
+            if self.name == "turn":
+                TURNS.inc(intent=self.attributes.get("intent", "unknown"))
+            recent_traces.append(self)
+            logger.debug("Trace %s", self)
+
+    def totals(self):
+        spans = [self]
+        totals = dict.fromkeys(
+            ("model_calls", "cache_hits", "prompt_tokens", "completion_tokens"), 0
+        )
+        while spans:
+            span = spans.pop()
+            for key in totals:
+                totals[key] += getattr(span, key)
+            spans.extend(span.children)
+        return totals
+
+    def to_dict(self):
+        span = {
+            "name": self.name,
+            "duration_ms": None if self.duration is None else round(self.duration * 1000, 3),
+            **self.attributes,
+        }
+        if self.parent is None:
+            span["trace_id"] = self.trace_id
+            span.update(self.totals())
+        elif self.model_calls:
+            span.update(
+                model_calls=self.model_calls,
+                cache_hits=self.cache_hits,
+                prompt_tokens=self.prompt_tokens,
+                completion_tokens=self.completion_tokens,
+            )
+        if self.children:
+            span["children"] = [child.to_dict() for child in self.children]
+        return span
+
+    def __str__(self):
+        return json.dumps(self.to_dict(), default=str)
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Times the block as a child of the current span (or as a new turn trace)."""
+    if not config.TRACING_ENABLED:
+        yield None
+        return
+    current = Span(name, _current_span.get(), **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        current.end()
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # A generator finished from another context; that context never saw the span
+            pass
+
+
+def traced(name):
+    """Decorator running each call of a function or coroutine function in span(name)."""
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def annotate(**attributes):
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)